@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import platform
+import tempfile
+import optparse
+import contextlib
+import subprocess
+
+repositoryDirectory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repositoryDirectory not in sys.path: sys.path.insert(0, repositoryDirectory)
+
+import numpy
+import stageProfiler
+import scaleFactorCombination
+from Benchmarks import syntheticCampaign
+
+# Version of the code being benchmarked, to compare results across versions
+def codeVersion():
+
+    try:
+        return subprocess.check_output([ 'git', 'describe', '--always', '--dirty' ], cwd=repositoryDirectory, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# Run scaleFactorCombination.py on a campaign in this process, with the stage profiler on, and return the time
+# spent in each stage. The printout of the combination is collected, and only shown if the run fails
+def runCombination(combinationDirectory, arguments):
+
+    profiler = stageProfiler.StageProfiler()
+    scaleFactorCombination.profiler = profiler
+
+    currentDirectory = os.getcwd()
+    output = io.StringIO()
+    failed = False
+
+    os.chdir(combinationDirectory)
+    startTime = time.perf_counter()
+
+    try:
+        with contextlib.redirect_stdout(output):
+            scaleFactorCombination.main(arguments)
+    except SystemExit:
+        failed = True
+    finally:
+        wallTime = time.perf_counter() - startTime
+        os.chdir(currentDirectory)
+        scaleFactorCombination.profiler = stageProfiler.NullProfiler()
+
+    if failed:
+        print(output.getvalue()[-2000:])
+        print('Error: the combination failed for arguments', ' '.join(arguments))
+        exit()
+
+    return wallTime, profiler.summary(), profiler.taskSummary()
+
+if __name__ == '__main__':
+
+    usage = 'usage: %prog [options]'
+    parser = optparse.OptionParser(usage)
+    parser.add_option('--methods'        , dest='methods'        , help='Number of measurement methods'  , default=5, type='int')
+    parser.add_option('--ptbins'         , dest='ptbins'         , help='Number of pt bins'              , default=9, type='int')
+    parser.add_option('--systematics'    , dest='systematics'    , help='Number of systematics'          , default=10, type='int')
+    parser.add_option('--ptcorrelated'   , dest='ptcorrelated'   , help='Fraction of pt-correlated syst.', default=0.5, type='float')
+    parser.add_option('--statpairs'      , dest='statpairs'      , help='Statistically correlated pairs' , default=2, type='int')
+    parser.add_option('--algorithms'     , dest='algorithms'     , help='Number of algorithms'           , default=1, type='int')
+    parser.add_option('--workingpoints'  , dest='workingpoints'  , help='Number of working points'       , default=3, type='int')
+    parser.add_option('--seed'           , dest='seed'           , help='Seed of the synthetic campaign' , default=1, type='int')
+    parser.add_option('--breaksyst'      , dest='breaksyst'      , help='Compute systematics breakdown'  , default=False, action='store_true')
+    parser.add_option('--ptfit'          , dest='ptfit'          , help='Run the pt-dependence fit'      , default=False, action='store_true')
+    parser.add_option('--store'          , dest='store'          , help='Write the csv files'            , default=False, action='store_true')
+    parser.add_option('--plot'           , dest='plot'           , help='Make the plots'                 , default=False, action='store_true')
+    parser.add_option('--solver'         , dest='solver'         , help='Covariance solver of the fit'   , default='auto')
+    parser.add_option('--workdir'        , dest='workdir'        , help='Dir. for the synthetic campaign', default='')
+    parser.add_option('--output'         , dest='output'         , help='Json file for the results'      , default='')
+    (opt, args) = parser.parse_args()
+
+    workDirectory = opt.workdir if opt.workdir!='' else tempfile.mkdtemp(prefix='scaleFactorBenchmark')
+
+    configuration = { 'methods' : opt.methods, 'ptbins' : opt.ptbins, 'systematics' : opt.systematics, 'ptcorrelated' : opt.ptcorrelated,
+                      'statpairs' : opt.statpairs, 'algorithms' : opt.algorithms, 'workingpoints' : opt.workingpoints, 'seed' : opt.seed,
+                      'breaksyst' : opt.breaksyst, 'ptfit' : opt.ptfit, 'store' : opt.store, 'plot' : opt.plot, 'solver' : opt.solver }
+
+    try:
+        combinationDirectory = syntheticCampaign.writeSyntheticCampaign(workDirectory, 'Synthetic', opt.methods, opt.ptbins, opt.systematics, opt.ptcorrelated,
+                                                                        opt.statpairs, opt.algorithms, opt.workingpoints, opt.seed)
+    except ValueError as error:
+        print('Error:', error)
+        exit()
+
+    arguments = [ '--campaign', 'Synthetic', '--cacheoff', '--plotdir', os.path.join(workDirectory, 'Plots'), '--csvfiledir', os.path.join(workDirectory, 'CSVFiles'), '--solver', opt.solver ]
+    if not opt.plot: arguments.append('--plotoff')
+    if opt.ptfit: arguments.append('--forceptfit')
+    if opt.store: arguments.append('--store' if opt.ptfit else '--storebybins')
+    if opt.breaksyst: arguments.append('--breaksyst')
+
+    wallTime, stages, tasks = runCombination(combinationDirectory, arguments)
+
+    results = { 'configuration' : configuration, 'combinations' : opt.algorithms*opt.workingpoints, 'wallTime' : wallTime, 'stages' : stages, 'tasks' : tasks,
+                'environment' : { 'code' : codeVersion(), 'python' : platform.python_version(), 'numpy' : numpy.__version__, 'platform' : platform.platform() } }
+
+    if opt.workdir=='': shutil.rmtree(workDirectory)
+
+    if opt.output!='':
+        with open(opt.output, 'w') as outputFile:
+            json.dump(results, outputFile, indent=1)
+    else:
+        print(json.dumps(results, indent=1))
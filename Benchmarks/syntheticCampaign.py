@@ -0,0 +1,146 @@
+import os
+import math
+import random
+from collections import OrderedDict
+
+workingPointNames = [ 'Loose', 'Medium', 'Tight', 'eXtraTight', 'eXtraeXtraTight' ]
+workingPointFlags = [ 'L', 'M', 'T', 'XT', 'XXT' ]
+csvOperatingPoints = [ 'opLoose', 'opMedium', 'opTight', 'opExtraTight', 'opExtraExtraTight' ]
+
+# Pt bin edges between minPt and maxPt, evenly spaced in log(pt) and rounded to integers, as the pt bins are
+# labelled by their integer edges
+def syntheticPtEdges(nPtBins, minPt=20., maxPt=1000.):
+
+    ptEdges = [ int(round(minPt*math.pow(maxPt/minPt, float(edge)/nPtBins))) for edge in range(nPtBins+1) ]
+    for edge in range(1, len(ptEdges)):
+        ptEdges[edge] = max(ptEdges[edge], ptEdges[edge-1]+1)
+    return ptEdges
+
+# Write a synthetic campaign: the campaign file in <workDirectory>/combination/Campaigns, and the measurement
+# files in the btv-scale-factors layout in <workDirectory>/btv-scale-factors, so that scaleFactorCombination.py
+# can run on it from <workDirectory>/combination. Each method measures a contiguous range of pt bins with the
+# statistical uncertainty and a random subset of the systematics, and the total uncertainty is their sum in
+# quadrature. The first statistical-correlation pairs of methods get a statistical correlation in each pt bin
+def writeSyntheticCampaign(workDirectory, campaignName='Synthetic', nMethods=5, nPtBins=9, nSystematics=10, ptCorrelatedFraction=0.5,
+                           nStatisticalPairs=2, nAlgorithms=1, nWorkingPoints=3, seed=1):
+
+    if nWorkingPoints>len(workingPointNames):
+        raise ValueError('at most '+str(len(workingPointNames))+' working points can be generated')
+
+    generator = random.Random(seed)
+
+    ptEdges = syntheticPtEdges(nPtBins)
+    ptbins = [ 'Pt-'+str(ptEdges[bin])+'to'+str(ptEdges[bin+1]) for bin in range(nPtBins) ]
+
+    methods = [ 'method'+str(method) for method in range(nMethods) ]
+    systematics = [ 'syst'+str(syst) for syst in range(nSystematics) ]
+    algorithms = [ 'algo'+str(algo) for algo in range(nAlgorithms) ]
+    nPtCorrelated = int(round(ptCorrelatedFraction*nSystematics))
+
+    methodPairs = [ (methods[first], methods[second]) for first in range(nMethods) for second in range(first+1, nMethods) ][:nStatisticalPairs]
+
+    # Measurement files
+    measurementDirectory = os.path.join(workDirectory, 'btv-scale-factors', campaignName, 'csv', 'btagging_fixedWP_SFb')
+    os.makedirs(measurementDirectory, exist_ok=True)
+
+    methodPtRanges, methodSystematics = {}, {}
+    for method in methods:
+        firstBin = generator.randint(0, nPtBins//2)
+        lastBin = generator.randint(max(firstBin, nPtBins//2), nPtBins-1)
+        methodPtRanges[method] = (firstBin, lastBin+1)
+        methodSystematics[method] = [ syst for syst in systematics if generator.random()<0.7 ] or systematics[:1]
+
+    for algo in algorithms:
+        for method in methods:
+            with open(os.path.join(measurementDirectory, algo+'_'+method+'_v1.csv'), 'w') as measurementFile:
+
+                measurementFile.write('wp,type,syst,flav,etaMin,etaMax,ptMin,ptMax,formula\n')
+
+                for wpFlag in workingPointFlags[:nWorkingPoints]:
+                    for bin in range(*methodPtRanges[method]):
+
+                        central = generator.uniform(0.9, 1.05)
+                        uncertainties = OrderedDict([ (syst, generator.uniform(0.002, 0.02)) for syst in [ 'statistic' ]+methodSystematics[method] ])
+                        total = math.sqrt(sum([ pow(uncertainty,2) for uncertainty in uncertainties.values() ]))
+
+                        lines = [ ('central', repr(central)), ('up', repr(central)+'+'+repr(total)), ('down', repr(central)+'-'+repr(total)) ]
+                        for syst, uncertainty in uncertainties.items():
+                            lines.append(('up_'+syst, repr(central)+'+'+repr(uncertainty)))
+                            lines.append(('down_'+syst, repr(central)+'-'+repr(uncertainty)))
+
+                        for syst, formula in lines:
+                            measurementFile.write(','.join([ wpFlag, 'comb', syst, '5', '0', '2.5', str(ptEdges[bin]), str(ptEdges[bin+1]), formula ])+'\n')
+
+    # Campaign file
+    campaignDirectory = os.path.join(workDirectory, 'combination', 'Campaigns')
+    os.makedirs(campaignDirectory, exist_ok=True)
+
+    statisticalCorrelationCoefficients = { 'statistic' : {} }
+    for first, second in methodPairs:
+        coefficients = { ptbin : generator.uniform(0.1, 0.5) for ptbin in ptbins }
+        statisticalCorrelationCoefficients['statistic'][first+'-'+second] = coefficients
+        statisticalCorrelationCoefficients['statistic'][second+'-'+first] = coefficients
+
+    campaign = [ 'from collections import OrderedDict',
+                 'from campaignConfig import FittingFunction',
+                 'import btagCalibrationWriter',
+                 '',
+                 'campaignLuminosity = \'1 fb^{-1}\'',
+                 'centerOfMassEnergy = \' (13.6 TeV, '+campaignName+')\'',
+                 'minPtCampaign  = '+repr(float(ptEdges[0])),
+                 'maxPtCampaign  = '+repr(float(ptEdges[-1])),
+                 'maxEtaCampaign = 2.5',
+                 'widthYAxis     = 0.4',
+                 'csvFileNameFlag = \''+campaignName+'\'',
+                 '',
+                 'algorithms = OrderedDict()' ]
+    campaign += [ 'algorithms[\''+algo+'\'] = [ 0., 1. ]' for algo in algorithms ]
+    campaign += [ 'workingPoints = OrderedDict()' ]
+    campaign += [ 'workingPoints[\''+wp+'\'] = \''+wpFlag+'\'' for wp, wpFlag in zip(workingPointNames[:nWorkingPoints], workingPointFlags[:nWorkingPoints]) ]
+    campaign += [ '',
+                  'if opt.store:',
+                  '    csvWorkingPoints = { '+', '.join([ '\''+wp+'\' : btagCalibrationWriter.'+op for wp, op in zip(workingPointNames[:nWorkingPoints], csvOperatingPoints) ])+' }',
+                  '',
+                  'sampleDependence         = 0.',
+                  'normalizedChi2Tollerance = 999.',
+                  'cJetsInflationFactor     = '+repr({ wp : 2. for wp in workingPointNames[:nWorkingPoints] }),
+                  '',
+                  'combinations = [ \'comb\' ]',
+                  '',
+                  'measurements = OrderedDict()' ]
+    for method in methods:
+        campaign.append('measurements[\''+method+'\'] = '+repr({ 'plotname' : method.capitalize(), 'legname' : method.capitalize(), 'data' : [ 'comb' ], 'version' : 'last',
+                                                               'color' : 1+methods.index(method), 'marker' : 20+methods.index(method)%14, 'size' : 1.2, 'shift' : 0., 'width' : 2 }))
+    campaign += [ '',
+                  'vetoedMethods = []',
+                  'maskedMethods = []',
+                  'maskedMeasurements = { }',
+                  '',
+                  'fittingFunctions, ptBinErrorScales = {}, {}',
+                  'for comb in combinations:',
+                  '    fittingFunctions[comb], ptBinErrorScales[comb] = {}, {}',
+                  '    for algo in algorithms:',
+                  '        fittingFunctions[comb][algo], ptBinErrorScales[comb][algo] = {}, {}',
+                  '        for wp in workingPoints:',
+                  '            fittingFunctions[comb][algo][wp] = FittingFunction(\'fittingFunction\', \'[0]+[1]*log(x)+[2]*log(x)*log(x)\', minPtCampaign, maxPtCampaign)',
+                  '            fittingFunctions[comb][algo][wp].SetParameters(1., 0., 0.)',
+                  '            ptBinErrorScales[comb][algo][wp] = {}',
+                  '',
+                  'type1Systematics = [ \'statistic\' ]',
+                  'type2Systematics = '+repr(systematics[:nSystematics//2]),
+                  'type3Systematics = '+repr(systematics[nSystematics//2:]),
+                  '',
+                  'systematicPtCorrelated = '+repr(systematics[:nPtCorrelated]),
+                  'systematicPtUncorrelated = '+repr([ 'statistic' ]+systematics[nPtCorrelated:]),
+                  'ptCorrelationCoefficients = { }',
+                  '',
+                  'systematicYearCorrelated = '+repr(systematics),
+                  'systematicYearUncorrelated = [ \'statistic\' ]',
+                  '',
+                  'statisticalCorrelationCoefficients = '+repr(statisticalCorrelationCoefficients),
+                  '' ]
+
+    with open(os.path.join(campaignDirectory, campaignName+'.py'), 'w') as campaignFile:
+        campaignFile.write('\n'.join(campaign))
+
+    return os.path.join(workDirectory, 'combination')
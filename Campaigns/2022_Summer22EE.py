@@ -1,6 +1,8 @@
 from collections import OrderedDict
 import math
 #import ROOT
+from campaignConfig import FittingFunction
+import btagCalibrationWriter
 
 # General data info
 campaignLuminosity = '26.3 fb^{-1}'
@@ -28,11 +30,11 @@ workingPoints['eXtraeXtraTight']  = 'XXT'
 
 if opt.store:
 
-    csvWorkingPoints = { 'Loose'            : ROOT.BTagEntry.OperatingPoint.OP_LOOSE,
-                         'Medium'           : ROOT.BTagEntry.OperatingPoint.OP_MEDIUM,
-                         'Tight'            : ROOT.BTagEntry.OperatingPoint.OP_TIGHT,
-                         'eXtraTight'       : ROOT.BTagEntry.OperatingPoint.OP_EXTRATIGHT,
-                         'eXtraeXtraTight'  : ROOT.BTagEntry.OperatingPoint.OP_EXTRAEXTRATIGHT,
+    csvWorkingPoints = { 'Loose'            : btagCalibrationWriter.opLoose,
+                         'Medium'           : btagCalibrationWriter.opMedium,
+                         'Tight'            : btagCalibrationWriter.opTight,
+                         'eXtraTight'       : btagCalibrationWriter.opExtraTight,
+                         'eXtraeXtraTight'  : btagCalibrationWriter.opExtraExtraTight,
                         } 
 
 # Some general uncertainty options
@@ -69,7 +71,7 @@ for comb in combinations:
         for wp in workingPoints:
             ptBinErrorScales[comb][algo][wp] = {}
             if comb=='comb' and 'ltsv' in opt.vetomethod and 'sys8' in opt.vetomethod and 'kinfit' in opt.vetomethod and 'ptrel' not in opt.vetomethod and 'tnp' not in opt.vetomethod:
-                fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
+                fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
                 if 'Tight' in wp:
                     if wp=='Tight' or algo=='deepJet' or (algo=='particleNet' and wp=='eXtraTight') or (algo=='robustParticleTransformer' and wp=='eXtraeXtraTight'):
                         ptBinErrorScales[comb][algo][wp]['Pt-600to1000'] = 0.5
@@ -82,7 +84,7 @@ for comb in combinations:
                         ptBinErrorScales[comb][algo][wp]['Pt-600to1000'] = 0.2
                         fittingFunctions[comb][algo][wp].SetParameters(1.0284, 5.92223e-06, -92.2645)
             elif comb=='comb' and 'ltsv' in opt.vetomethod and 'sys8' not in opt.vetomethod and 'kinfit' in opt.vetomethod and 'ptrel' not in opt.vetomethod and 'tnp' not in opt.vetomethod:
-                fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
+                fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
                 if 'Tight' in wp:
                     ptBinErrorScales[comb][algo][wp]['Pt-300to600'] = 100.
                     if (algo=='robustParticleTransformer' and wp=='Tight') or (algo=='deepJet' and wp=='eXtraeXtraTight'):
@@ -98,7 +100,7 @@ for comb in combinations:
                         ptBinErrorScales[comb][algo][wp]['Pt-600to1000'] = 0.1
                         ptBinErrorScales[comb][algo][wp]['Pt-20to30'] = 0.5
             elif comb=='mujets' and 'ltsv' in opt.vetomethod:
-                fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
+                fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
                 if algo=='robustParticleTransformer' and wp=='Medium':
                     ptBinErrorScales[comb][algo][wp]['Pt-600to1000'] = 0.6
                 elif 'Tight' in wp:
@@ -1,6 +1,8 @@
 from collections import OrderedDict
 import math
 #import ROOT
+from campaignConfig import FittingFunction
+import btagCalibrationWriter
 
 # General data info
 campaignLuminosity = '17.1 fb^{-1}'
@@ -28,11 +30,11 @@ workingPoints['eXtraeXtraTight']  = 'XXT'
 
 if opt.store:
 
-    csvWorkingPoints = { 'Loose'            : ROOT.BTagEntry.OperatingPoint.OP_LOOSE,
-                         'Medium'           : ROOT.BTagEntry.OperatingPoint.OP_MEDIUM,
-                         'Tight'            : ROOT.BTagEntry.OperatingPoint.OP_TIGHT,
-                         'eXtraTight'       : ROOT.BTagEntry.OperatingPoint.OP_EXTRATIGHT,
-                         'eXtraeXtraTight'  : ROOT.BTagEntry.OperatingPoint.OP_EXTRAEXTRATIGHT,
+    csvWorkingPoints = { 'Loose'            : btagCalibrationWriter.opLoose,
+                         'Medium'           : btagCalibrationWriter.opMedium,
+                         'Tight'            : btagCalibrationWriter.opTight,
+                         'eXtraTight'       : btagCalibrationWriter.opExtraTight,
+                         'eXtraeXtraTight'  : btagCalibrationWriter.opExtraExtraTight,
                         } 
 
 # Some general uncertainty options
@@ -70,18 +72,18 @@ for comb in combinations:
             ptBinErrorScales[comb][algo][wp] = {}
             if comb=='mujets' and (algo=='deepJet' or algo=='robustParticleTransformer'):
                 if ((algo=='deepJet' and wp=='eXtraTight') or algo=='robustParticleTransformer') and 'ltsv' not in opt.vetomethod and 'ltsv' not in opt.maskmethod:
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
                 else:
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]*(1.+[1]*x)/(1.+[2]*x)', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]*(1.+[1]*x)/(1.+[2]*x)', minPtCampaign, maxPtCampaign)
             elif comb=='comb' and ('kinfit' in opt.vetomethod or 'kinfit' in opt.maskmethod):
-                fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
                 if algo=='deepJet':
                     if wp=='Loose': fittingFunctions[comb][algo][wp].SetParameters(0.354212,0.237673,-0.0218838,0.)
                     if wp=='Medium': fittingFunctions[comb][algo][wp].SetParameters(1.47533,-0.24666,0.0296768,0.)
                     if wp=='Tight': fittingFunctions[comb][algo][wp].SetParameters(0.519429,0.156053,-0.0129339,0.)
                     if wp=='eXtraTight': fittingFunctions[comb][algo][wp].SetParameters(0.339425,0.217108,-0.0177989,0.)
                     if wp=='eXtraeXtraTight': 
-                        #fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                        #fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
                         fittingFunctions[comb][algo][wp].SetParameters(-0.471009,0.520799,-0.0465554,0.)
                 elif algo=='robustParticleTransformer':
                     if wp=='Loose': fittingFunctions[comb][algo][wp].SetParameters(-0.12055,0.423318,-0.0399768,0.)
@@ -90,13 +92,13 @@ for comb in combinations:
                     if wp=='eXtraTight': fittingFunctions[comb][algo][wp].SetParameters(-1.07075,0.785628,-0.0743669,0.)  
                     if wp=='eXtraeXtraTight': fittingFunctions[comb][algo][wp].SetParameters(-0.741095,0.626532,-0.0567302,0.)
             elif comb=='comb' and algo=='particleNet':
-                fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
                 if wp=='Loose':
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
                     fittingFunctions[comb][algo][wp].SetParameters(2.03869,-0.436488,0.0447336,0.)
                     #fittingFunctions[comb][algo][wp].SetParameters(4.04675,-1.21536,0.120034,0.)
                 elif wp=='Medium':
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
                     fittingFunctions[comb][algo][wp].SetParameters(2.03869,-0.436488,0.0447336,0.)
                 elif wp=='Tight':
                     fittingFunctions[comb][algo][wp].SetParameters(0.805525,0.0295216,-2.32352e-06,0.)
@@ -105,34 +107,34 @@ for comb in combinations:
                 elif wp=='eXtraeXtraTight':
                      fittingFunctions[comb][algo][wp].SetParameters(-70.0757,21.7726,-1.6688,-535.352)
             elif comb=='comb' and algo=='deepJet':
-                fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
                 if wp=='Loose':
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
                     fittingFunctions[comb][algo][wp].SetParameters(2.15295,-0.389697,0.0306347,0.)
                 elif wp=='Medium':
                     fittingFunctions[comb][algo][wp].SetParameters(2.02773,-0.427995,0.0428375,0.)
                 elif wp=='Tight':
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
                     fittingFunctions[comb][algo][wp].SetParameters(1.44515,-0.203004,0.020718,0.)
                 elif wp=='eXtraTight':
                      fittingFunctions[comb][algo][wp].SetParameters(-0.0724806,0.465473,-0.0523755,0.)
                 elif wp=='eXtraeXtraTight':
                      fittingFunctions[comb][algo][wp].SetParameters(-73.7967,21.728,-1.57902,-764.933)
             elif comb=='comb' and algo=='robustParticleTransformer':
-                fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
                 if wp=='Loose':
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
                     fittingFunctions[comb][algo][wp].SetParameters(2.15295,-0.389697,0.0306345,0.)
                 elif wp=='Medium':
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
                     fittingFunctions[comb][algo][wp].SetParameters(1.62248,-0.252638,0.0243624,0.)
                 elif wp=='Tight':
                     fittingFunctions[comb][algo][wp].SetParameters(1.44515,-0.203004,0.020718,0.)
                 elif wp=='eXtraTight':
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
                     fittingFunctions[comb][algo][wp].SetParameters(-0.0724806,0.465473,-0.0523755,0.)
                 elif wp=='eXtraeXtraTight':
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
                     fittingFunctions[comb][algo][wp].SetParameters(-73.7967,21.728,-1.57902,-764.933)
 
 if 'ltsv' not in opt.vetomethod and 'ltsv' not in opt.maskmethod:
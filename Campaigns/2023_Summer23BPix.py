@@ -1,6 +1,8 @@
 from collections import OrderedDict
 import math
 #import ROOT
+from campaignConfig import FittingFunction
+import btagCalibrationWriter
 
 # General data info
 campaignLuminosity = '9.5 fb^{-1}'
@@ -28,11 +30,11 @@ workingPoints['eXtraeXtraTight']  = 'XXT'
 
 if opt.store:
 
-    csvWorkingPoints = { 'Loose'            : ROOT.BTagEntry.OperatingPoint.OP_LOOSE,
-                         'Medium'           : ROOT.BTagEntry.OperatingPoint.OP_MEDIUM,
-                         'Tight'            : ROOT.BTagEntry.OperatingPoint.OP_TIGHT,
-                         'eXtraTight'       : ROOT.BTagEntry.OperatingPoint.OP_EXTRATIGHT,
-                         'eXtraeXtraTight'  : ROOT.BTagEntry.OperatingPoint.OP_EXTRAEXTRATIGHT,
+    csvWorkingPoints = { 'Loose'            : btagCalibrationWriter.opLoose,
+                         'Medium'           : btagCalibrationWriter.opMedium,
+                         'Tight'            : btagCalibrationWriter.opTight,
+                         'eXtraTight'       : btagCalibrationWriter.opExtraTight,
+                         'eXtraeXtraTight'  : btagCalibrationWriter.opExtraExtraTight,
                         } 
 
 # Some general uncertainty options
@@ -74,14 +76,14 @@ for comb in combinations:
             ptBinErrorScales[comb][algo][wp] = {}
             if comb=='mujets' and (algo=='deepJet' or algo=='robustParticleTransformer'):
                 if 'ltsv' not in opt.vetomethod and 'ltsv' not in opt.maskmethod:
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
                 else:
                     if (algo=='deepJet' and (wp=='Loose' or wp=='Medium' or wp=='eXtraTight') or (algo=='robustParticleTransformer' and (wp=='Tight' or wp=='eXtraTight'))):
-                        fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
+                        fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
                     elif (algo=='deepJet' and (wp=='Tight' or wp=='eXtraeXtraTight')) or (algo=='robustParticleTransformer' and (wp=='Loose' or wp=='Medium' or wp=='eXtraeXtraTight')):
-                        fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]*(1.+[1]*x)/(1.+[2]*x)', minPtCampaign, maxPtCampaign)
+                        fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]*(1.+[1]*x)/(1.+[2]*x)', minPtCampaign, maxPtCampaign)
             elif comb=='comb' and ('kinfit' in opt.vetomethod or 'kinfit' in opt.maskmethod):
-                fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
                 if algo=='deepJet':
                     if wp=='Loose': fittingFunctions[comb][algo][wp].SetParameters(1.33482,-0.139215,0.0132112,0.)
                     if wp=='Medium': fittingFunctions[comb][algo][wp].SetParameters(1.3333,-0.163212,0.0184351,0.)
@@ -91,40 +93,40 @@ for comb in combinations:
                 elif algo=='robustParticleTransformer':
                     if wp=='Loose': fittingFunctions[comb][algo][wp].SetParameters(0.550708,0.223283,-0.0271142,0.)
                     if wp=='Medium': 
-                        fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                        fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
                         fittingFunctions[comb][algo][wp].SetParameters(0.834087,0.0581881,-0.00530771,0.)
                     if wp=='Tight': fittingFunctions[comb][algo][wp].SetParameters(1.47033,-0.272927,0.0341827,0.)
                     if wp=='eXtraTight': fittingFunctions[comb][algo][wp].SetParameters(1.86236,-0.446144,0.0525757,0.)
                     if wp=='eXtraeXtraTight': 
-                        fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                        fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
                         fittingFunctions[comb][algo][wp].SetParameters(1.49924,-0.332789,0.0435346,0.)
             elif comb=='comb' and algo=='particleNet':
                 if 'Tight' in wp or 'Loose' in wp or 'Medium' in wp:
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
                 elif wp=='Loose':
-                    #fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                    #fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
                 else:
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
                     if wp=='Loose': fittingFunctions[comb][algo][wp].SetParameters(4.04675,-1.21536,0.120034,0.)
                     elif wp=='Medium': fittingFunctions[comb][algo][wp].SetParameters(2.46867,-0.596987,0.0585938,0.)
             elif comb=='comb' and algo=='deepJet':
                 if 'Tight' in wp:
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
                 elif wp=='Loose':
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
                     fittingFunctions[comb][algo][wp].SetParameters(2.15295,-0.389697,0.0306347,0.)
                 elif wp=='Medium':
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
                     fittingFunctions[comb][algo][wp].SetParameters(2.42786,-0.618316,0.0642063,0.)
             elif comb=='comb' and algo=='robustParticleTransformer':
                 if 'Tight' in wp:
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))', minPtCampaign, maxPtCampaign)
                 elif wp=='Loose':
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
                     fittingFunctions[comb][algo][wp].SetParameters(4.31591,-1.367,0.139604,0.)
                 elif wp=='Medium':
-                    fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                    fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
                     fittingFunctions[comb][algo][wp].SetParameters(2.84888,-0.787205,0.0809152,0.)
 
 ptBinErrorScales['mujets']['robustParticleTransformer']['Tight']['Pt-20to30'] = 1.25
@@ -1,6 +1,8 @@
 from collections import OrderedDict
 import math
 #import ROOT
+from campaignConfig import FittingFunction
+import btagCalibrationWriter
 
 # General data info
 campaignLuminosity = '109 fb^{-1}'
@@ -26,11 +28,11 @@ workingPoints['eXtraeXtraTight']  = 'XXT'
 
 if opt.store:
 
-    csvWorkingPoints = { 'Loose'            : ROOT.BTagEntry.OperatingPoint.OP_LOOSE,
-                         'Medium'           : ROOT.BTagEntry.OperatingPoint.OP_MEDIUM,
-                         'Tight'            : ROOT.BTagEntry.OperatingPoint.OP_TIGHT,
-                         'eXtraTight'       : ROOT.BTagEntry.OperatingPoint.OP_EXTRATIGHT,
-                         'eXtraeXtraTight'  : ROOT.BTagEntry.OperatingPoint.OP_EXTRAEXTRATIGHT,
+    csvWorkingPoints = { 'Loose'            : btagCalibrationWriter.opLoose,
+                         'Medium'           : btagCalibrationWriter.opMedium,
+                         'Tight'            : btagCalibrationWriter.opTight,
+                         'eXtraTight'       : btagCalibrationWriter.opExtraTight,
+                         'eXtraeXtraTight'  : btagCalibrationWriter.opExtraExtraTight,
                         } 
 
 # Some general uncertainty options
@@ -68,17 +70,17 @@ for comb in combinations:
             ptBinErrorScales[comb][algo][wp] = {}
             if comb=='mujets':
               if wp=='eXtraeXtraTight' or wp=='eXtraTight':
-                  fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                  fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
               elif wp=='Loose':
-                  fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                  fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
               else:
-                  fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]*(1.+[1]*x)/(1.+[2]*x)', minPtCampaign, maxPtCampaign)
+                  fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]*(1.+[1]*x)/(1.+[2]*x)', minPtCampaign, maxPtCampaign)
                   #if wp=='Loose':
                   #    fittingFunctions[comb][algo][wp].SetParameters(0.94573766673456239, 0.010463597845190494, 0.010043776616054479)
             else:
-                fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
-                #fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
-                #fittingFunctions[comb][algo][wp] = ROOT.TF1('fittingFunction', '[0]*(1.+[1]*x)/(1.+[2]*x)', minPtCampaign, maxPtCampaign)
+                fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x)+[2]*log(x)*log(x)', minPtCampaign, maxPtCampaign)
+                #fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', minPtCampaign, maxPtCampaign)
+                #fittingFunctions[comb][algo][wp] = FittingFunction('fittingFunction', '[0]*(1.+[1]*x)/(1.+[2]*x)', minPtCampaign, maxPtCampaign)
 
 # Systematic breakdown categories
 type1Systematics = [ 'statistic' ]
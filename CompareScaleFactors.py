@@ -1,11 +1,13 @@
 #!/usr/bin/env python
+from __future__ import print_function
 import os
 import sys
-import ROOT
 import math
 import optparse
 from array import *
-import CondTools.BTau.dataLoader as dataLoader
+from collections import OrderedDict
+import numpy
+import stageProfiler
 
 # From https://github.com/cms-nanoAOD/nanoAOD-tools/blob/master/python/postprocessing/modules/btv/btagSFProducer.py
 supported_btagSF = {
@@ -172,10 +174,143 @@ supported_btagSF = {
     }
 }
 
-def plotScaleFactors(plottitle, scaleFactors, plotformat):
+class FormulaError(ValueError):
+    pass
+
+# Functions allowed in the csv formulas, as written for TFormula, evaluated with numpy on arrays of pt values
+formulaFunctions = { 'log' : numpy.log, 'log10' : numpy.log10, 'exp' : numpy.exp, 'sqrt' : numpy.sqrt, 'pow' : numpy.power, 'abs' : numpy.abs, 'fabs' : numpy.abs,
+                     'max' : numpy.maximum, 'min' : numpy.minimum, 'tanh' : numpy.tanh, 'atan' : numpy.arctan, 'erf' : numpy.vectorize(math.erf, otypes=[ float ]) }
+formulaFunctions.update({ 'Log' : numpy.log, 'Log10' : numpy.log10, 'Exp' : numpy.exp, 'Sqrt' : numpy.sqrt, 'Power' : numpy.power, 'Abs' : numpy.abs,
+                          'Max' : numpy.maximum, 'Min' : numpy.minimum, 'TanH' : numpy.tanh, 'ATan' : numpy.arctan, 'Erf' : formulaFunctions['erf'] })
+
+compiledFormulas = { }
+
+# Compile a csv formula of x into python code, once for each formula. TMath:: prefixes are dropped, ^ is the power
+# operator as in TFormula, and only x and the formulaFunctions can be used
+def compileFormula(formula):
+
+    if formula not in compiledFormulas:
+
+        expression = formula.strip().replace('TMath::', '').replace('^', '**')
+        try:
+            code = compile(expression, formula, 'eval')
+        except SyntaxError:
+            raise FormulaError('formula '+formula+' can\'t be parsed')
+
+        unknownNames = [ name for name in code.co_names if name!='x' and name not in formulaFunctions ]
+        if len(unknownNames)>0:
+            raise FormulaError('formula '+formula+' uses unknown names '+', '.join(unknownNames))
+
+        compiledFormulas[formula] = code
+
+    return compiledFormulas[formula]
+
+# Scale factor defined by a formula in each pt bin, and 0 outside of them. As for the chain of (x>=ptMin && x<ptMax) ?
+# formula : ... conditions of the TF1, the first bin added wins where bins overlap, e.g. for the eta bins of a csv file.
+# The pt edges of all the bins split the pt range in segments, sorted and each evaluated with the formula of the first
+# bin covering it, so the segments of an array of pt values are found by binary search and evaluated at once
+class PiecewiseScaleFactor:
+
+    def __init__(self):
+
+        self.bins = [ ]
+
+    def addBin(self, ptMin, ptMax, formula):
+
+        self.bins.append((float(ptMin), float(ptMax), compileFormula(formula)))
+        self.edges = None
+
+    def empty(self):
+        return len(self.bins)==0
+
+    def makeSegments(self):
+
+        self.edges = numpy.unique([ edge for ptMin, ptMax, code in self.bins for edge in (ptMin, ptMax) ])
+        self.segmentFormulas = [ ]
+
+        for lowEdge, highEdge in zip(self.edges[:-1], self.edges[1:]):
+            segmentFormula = None
+            for ptMin, ptMax, code in self.bins:
+                if ptMin<=lowEdge and highEdge<=ptMax:
+                    segmentFormula = code
+                    break
+            self.segmentFormulas.append(segmentFormula)
+
+    def evaluate(self, x):
+
+        if self.edges is None: self.makeSegments()
+
+        x = numpy.asarray(x, dtype=float)
+        values = numpy.zeros(x.shape)
+        segments = numpy.searchsorted(self.edges, x, side='right') - 1
+
+        for segment, code in enumerate(self.segmentFormulas):
+            if code is None: continue
+            inSegment = segments==segment
+            if numpy.any(inSegment):
+                values[inSegment] = eval(code, { '__builtins__' : { } }, dict(formulaFunctions, x=x[inSegment]))
+
+        return values
+
+    # Pt values to draw the scale factor from minPt to just below maxPt, where the last bin ends: evenly spaced in
+    # log(pt), plus each pt edge and the value just below it, so that the steps between the bins are drawn vertically
+    def ptGrid(self, minPt, maxPt, nPoints=1000):
+
+        if self.edges is None: self.makeSegments()
+
+        ptValues = numpy.geomspace(minPt, maxPt, nPoints) if minPt>0. else numpy.linspace(minPt, maxPt, nPoints)
+        edges = self.edges[(self.edges>minPt) & (self.edges<=maxPt)]
+        return numpy.unique(numpy.concatenate([ ptValues[:-1], edges[edges<maxPt], edges*(1.-1.e-9) ]))
+
+# Entries of the csv files, read once per (tagger, campaign) file with the loader of the csv files, and indexed by
+# (tagger, campaign, operating point, measurement type, jet flavour, systematic type). Each key keeps the
+# (ptMin, ptMax, formula) of its entries in the order of the file, and the keys of each file are kept in the
+# order they first appear, so that the working points and measurement types can be listed without a new pass
+class ScaleFactorIndex:
+
+    def __init__(self, loadData):
+
+        self.loadData = loadData
+        self.entries = { }
+        self.fileKeys = OrderedDict()
+
+    def load(self, tagger, campaign, fileName):
+
+        if (tagger, campaign) in self.fileKeys: return
+
+        fileKeys = self.fileKeys[(tagger, campaign)] = [ ]
+
+        for data in self.loadData(fileName):
+            for e in data.entries:
+                key = (tagger, campaign, int(e.params.operatingPoint), str(e.params.measurementType), int(e.params.jetFlavor), str(e.params.sysType))
+                if key not in self.entries:
+                    self.entries[key] = [ ]
+                    fileKeys.append(key)
+                self.entries[key].append((float(e.params.ptMin), float(e.params.ptMax), str(e.formula)))
+
+    def get(self, tagger, campaign, operatingPoint, measurementType, jetFlavor, sysType):
+        return self.entries.get((tagger, campaign, operatingPoint, measurementType, jetFlavor, sysType), [ ])
+
+    def keys(self, tagger, campaign):
+        return self.fileKeys.get((tagger, campaign), [ ])
+
+# The scale factors are passed as (name, pt values, scale factor values, width, style, color), evaluated beforehand,
+# and ROOT is only imported here, once there is something to plot
+def plotScaleFactors(plottitle, scaleFactorCurves, plotformat):
+
+    import ROOT
 
     ROOT.gROOT.SetBatch(ROOT.kTRUE)
 
+    scaleFactors = [ ]
+    for name, ptValues, scaleFactorValues, width, style, color in scaleFactorCurves:
+        graph = ROOT.TGraph(len(ptValues), numpy.ascontiguousarray(ptValues, dtype=numpy.float64), numpy.ascontiguousarray(scaleFactorValues, dtype=numpy.float64))
+        graph.SetName(name)
+        graph.SetLineWidth(width)
+        graph.SetLineStyle(style)
+        graph.SetLineColor(color)
+        scaleFactors.append((graph, ptValues, scaleFactorValues))
+
     yoff = 0.85 if ('_T2_' in plottitle) else 0.35
     leg = ROOT.TLegend(0.18, yoff, 0.50, yoff-0.2)
     leg.SetFillColor(ROOT.kWhite) 
@@ -187,15 +322,15 @@ def plotScaleFactors(plottitle, scaleFactors, plotformat):
     #histoiter = 1 
     minX, maxX, minY, maxY = 999., -1., 999., -1.
        
-    for function in scaleFactors:
+    for graph, ptValues, scaleFactorValues in scaleFactors:
  
-        if 'central' in function.GetName():
-           leg.AddEntry(function, function.GetName().replace('_central', ''), "l")
+        if 'central' in graph.GetName():
+           leg.AddEntry(graph, graph.GetName().replace('_central', ''), "l")
 
-        minX = min(minX, function.GetXmin())
-        maxX = max(maxX, function.GetXmax())
-        minY = min(minY, function.GetMinimum())
-        maxY = max(maxY, function.GetMaximum())
+        minX = min(minX, ptValues.min())
+        maxX = max(maxX, ptValues.max())
+        minY = min(minY, scaleFactorValues.min())
+        maxY = max(maxY, scaleFactorValues.max())
 
     minY = max(minY, 0.7)
     maxY = min(maxY, 1.5)
@@ -266,8 +401,8 @@ def plotScaleFactors(plottitle, scaleFactors, plotformat):
     
     histo.DrawCopy()
 
-    for function in scaleFactors:
-        function.DrawCopy("same")
+    for graph, ptValues, scaleFactorValues in scaleFactors:
+        graph.Draw("L")
 
     leg.Draw()
 
@@ -289,13 +424,22 @@ if __name__ == '__main__':
     parser.add_option('--meastypes'   , dest='meastypes'   , help='Measurement type(s) to be compared'  , default='default')
     parser.add_option('--flavour'     , dest='flavour'     , help='Flavour to be studied'               , default='b')
     parser.add_option('--plotformat'  , dest='plotformat'  , help='Formats of the plot, e.g.: png-pdf'  , default='png')
+    parser.add_option('--profile'     , dest='profile'     , help='Print time and memory by stage'      , default=False, action='store_true')
+    parser.add_option('--profiledump' , dest='profiledump' , help='cProfile output file'                , default='')
     (opt, args) = parser.parse_args()
+
+    profiler = stageProfiler.makeProfiler(opt.profile, opt.profiledump)
+    profiler.start()
+
+    import CondTools.BTau.dataLoader as dataLoader
+    scaleFactorIndex = ScaleFactorIndex(dataLoader.get_data)
+    profiler.lap('setup')
     
     years = opt.years.split('-')
 
     flavour = { 'b' : 0, 'c' : 1, 'l' : 2, '0' : 0, '1' : 1, '2' : 2 }.get(opt.flavour, None)
     if flavour==None:
-        print 'Wrong choice of jet flavour:', opt.flavour, '-> exiting'
+        print('Wrong choice of jet flavour:', opt.flavour, '-> exiting')
         exit()
 
     if opt.customfiles:
@@ -318,22 +462,25 @@ if __name__ == '__main__':
             custom_btagSF['measurement_types'] = { 0 : "", 1 : "", 2 : ""}
             custom_btagSF['supported_wp'] = [ ]
 
-            for data in dataLoader.get_data(csvfile):
-                for e in data.entries:
+            scaleFactorIndex.load(tagger, csvyear, csvfile)
 
-                    wp = { 0 : "L", 1 : "M", 2 : "T" }.get(e.params.operatingPoint, None)
+            for indexTagger, indexCampaign, operatingPoint, measurementType, jetFlavor, sysType in scaleFactorIndex.keys(tagger, csvyear):
 
-                    if wp not in custom_btagSF['supported_wp']:
-                        custom_btagSF['supported_wp'].append(wp)
+                wp = { 0 : "L", 1 : "M", 2 : "T" }.get(operatingPoint, None)
 
-                    if e.params.measurementType not in custom_btagSF['measurement_types'][e.params.jetFlavor]:
-                        custom_btagSF['measurement_types'][e.params.jetFlavor] += "-" + e.params.measurementType
+                if wp is not None and wp not in custom_btagSF['supported_wp']:
+                    custom_btagSF['supported_wp'].append(wp)
+
+                if measurementType not in custom_btagSF['measurement_types'][jetFlavor]:
+                    custom_btagSF['measurement_types'][jetFlavor] += "-" + measurementType
 
             if tagger not in supported_btagSF:
                 supported_btagSF[tagger] = { }
 
             supported_btagSF[tagger][csvyear] = custom_btagSF
 
+        profiler.lap('loading')
+
     scaleFactors = [ ]
 
     color = 1
@@ -352,14 +499,15 @@ if __name__ == '__main__':
                     inputFileName = supported_btagSF[tagger][campaign]['inputFileName']
                     if '/' not in inputFileName:
                         inputFileName = os.path.join(opt.inputpath, inputFileName)
-                    loaders = dataLoader.get_data(inputFileName)
+                    scaleFactorIndex.load(tagger, campaign, inputFileName)
+                    profiler.lap('loading')
 
                     for wp in supported_btagSF[tagger][campaign]['supported_wp']:
                         if wp in opt.wps:
 
                             wp_btv = { "l" : 0, "m" : 1, "t" : 2 }.get(wp.lower(), None)
                             if wp_btv==None:
-                                print 'Working point', wp, 'not supported -> skipping'
+                                print('Working point', wp, 'not supported -> skipping')
                                 continue
 
                             meastypes = opt.meastypes if (opt.meastypes!='default') else supported_btagSF[tagger][campaign]['measurement_types'][flavour]
@@ -368,36 +516,41 @@ if __name__ == '__main__':
                                     
                                     minPt, maxPt = 999999., -1.
                                     title = tagger + '_' + campaign + '_' + wp + '_' + meastype
-                                    function = { 'central' : ' 0. ', 'up' : ' 0. ', 'down' : ' 0. ' } #, 'up_correlated' : ' 0. ', 'down_correlated' : ' 0. ', 'up_uncorrelated' : ' 0. ', 'down_uncorrelated' : ' 0. ' }
+                                    function = { 'central' : PiecewiseScaleFactor(), 'up' : PiecewiseScaleFactor(), 'down' : PiecewiseScaleFactor() } #, 'up_correlated', 'down_correlated', 'up_uncorrelated', 'down_uncorrelated' }
 
-                                    for data in loaders:
-                                        for e in data.entries:
-                                            if e.params.measurementType==meastype and e.params.operatingPoint==wp_btv and e.params.jetFlavor==flavour:
-                                                if e.params.sysType in function:
-                                                    formula = '(x>='+str(e.params.ptMin)+' && x<'+str(e.params.ptMax)+') ? '+e.formula
-                                                    function[e.params.sysType] = function[e.params.sysType].replace(' 0. ',formula+' : 0. ')
-                                                    minPt = min(minPt, e.params.ptMin)
-                                                    maxPt = max(maxPt, e.params.ptMax)
+                                    for syst in function:
+                                        for entryPtMin, entryPtMax, formula in scaleFactorIndex.get(tagger, campaign, wp_btv, meastype, flavour, syst):
+                                            try:
+                                                function[syst].addBin(entryPtMin, entryPtMax, formula)
+                                            except FormulaError as error:
+                                                print('Error:', error, 'for', title+'_'+syst, '-> skipping')
+                                                function[syst] = None
+                                                break
+                                            minPt = min(minPt, entryPtMin)
+                                            maxPt = max(maxPt, entryPtMax)
 
                                     for syst in function:
-                                        if function[syst]==' 0. ': continue
-                                        systFunction = ROOT.TF1(title+'_'+syst, function[syst], minPt, maxPt)
+                                        if function[syst] is None or function[syst].empty(): continue
                                         width = 3 if (syst=='central') else 1
                                         style = 1 if (syst=='central') else 2
                                         if 'uncorrelated' in syst: style = 3
                                         elif 'correlated' in syst: style = 4
-                                        systFunction.SetLineWidth(width)
-                                        systFunction.SetLineStyle(style)
-                                        systFunction.SetLineColor(color)
-                                        scaleFactors.append(systFunction)
+                                        ptValues = function[syst].ptGrid(minPt, maxPt)
+                                        scaleFactors.append((title+'_'+syst, ptValues, function[syst].evaluate(ptValues), width, style, color))
 
                                     color += 1
 
+                    profiler.lap('functions')
+
     if len(scaleFactors)==0:
-        print 'Exiting with no scale factors to plot'
+        print('Exiting with no scale factors to plot')
         exit()
 
     plottitle = opt.taggers + '_' + opt.years + '_' + opt.wps + '_' + opt.flavour
     if opt.meastypes!='default':
         plottitle += '_' + opt.meastypes 
     plotScaleFactors(plottitle, scaleFactors, opt.plotformat)
+    profiler.lap('plotting')
+
+    profiler.stop()
+    profiler.printSummary()
@@ -1,13 +1,12 @@
 #!/usr/bin/env python
 import os
 import sys
-#!/usr/bin/env python
-import ROOT
 import math
 import optparse
 from array import *
-import CondTools.BTau.dataLoader as dataLoader
 from collections import defaultdict
+import stageProfiler
+import btagCalibrationWriter
 
 if __name__ == '__main__':
 
@@ -21,8 +20,17 @@ if __name__ == '__main__':
     parser.add_option('--yearcorroff' , dest='yearcorroff' , help='Turn off year correlations'            , default=False, action='store_true')
     parser.add_option('--splittype2'  , dest='splittype2'  , help='Split type2 uncertainties'             , default=False, action='store_true')
     parser.add_option('--custom'      , dest='custom'      , help='Custom list of wanted uncertainties'   , default=None)
+    parser.add_option('--profile'     , dest='profile'     , help='Print time and memory by stage'        , default=False, action='store_true')
+    parser.add_option('--profiledump' , dest='profiledump' , help='cProfile output file'                  , default='')
     (opt, args) = parser.parse_args()
 
+    profiler = stageProfiler.makeProfiler(opt.profile, opt.profiledump)
+    profiler.start()
+
+    # The csv loader needs ROOT, so it is imported after the options are parsed
+    import CondTools.BTau.dataLoader as dataLoader
+    profiler.lap('setup')
+
     uncorrelatedList = [ 'statistic' ] # To be completed
 
     type2List = [ "_pileup", "_jes", "_jer" ] # To be checked
@@ -45,8 +53,7 @@ if __name__ == '__main__':
     outputfilename = opt.csvpath + '/' + opt.outputfile.replace('default', opt.inputfile.replace('.csv', '')) + outputFlag + '.csv'
 
     loaders = dataLoader.get_data(opt.csvpath + '/' + opt.inputfile)
-
-    calib = ROOT.BTagCalibration(outputfilename.split('/')[-1].split('_')[0])
+    profiler.lap('loading')
 
     mergedSystematics = [ ] 
     mergedUncertainty = { }
@@ -55,7 +62,8 @@ if __name__ == '__main__':
 
         mergedSystematics = [ 'correlated', 'uncorrelated' ] if ('years' in outputFlag) else [ 'unsplit' ] 
 
-        # Get the structure of the CSV file
+        # Get the structure of the CSV file. This is the first pass over the entries of each loader, timed as
+        # one ingestion lap per loader, so that the merging stage only counts the merging of the uncertainties
         for data in loaders:
             for e in data.entries:
 
@@ -83,6 +91,8 @@ if __name__ == '__main__':
                                 auxMergedUncertaintyList[par1][paramList[par1]] = newMergedUncertaintyList[par1][paramList[par1]]
                                 break
 
+            profiler.lap('ingestion')
+
         # Merge uncertainties
         for data in loaders:
             for e in data.entries:
@@ -103,63 +113,77 @@ if __name__ == '__main__':
 
                     mergedUncertainty[e.params.operatingPoint][e.params.measurementType][mergedSystematic][e.params.jetFlavor][e.params.etaMin][e.params.etaMax][e.params.ptMin][e.params.ptMax][e.params.discrMin][e.params.discrMax] += systematicValue*systematicValue
 
-    # Now we can write the output: first the cetral values, total uncertainties, and splitted systematics ...
-    for data in loaders:
-        for e in data.entries:
-     
-            if e.params.sysType=='central' or e.params.sysType=='up' or e.params.sysType=='down' or e.params.sysType.split('_')[1] in splitList:
-
-                params = ROOT.BTagEntry.Parameters( e.params.operatingPoint, 
-                                                    e.params.measurementType, 
-                                                    e.params.sysType,
-                                                    e.params.jetFlavor,
-                                                    e.params.etaMin,
-                                                    e.params.etaMax, 
-                                                    e.params.ptMin, 
-                                                    e.params.ptMax,
-                                                    e.params.discrMin,
-                                                    e.params.discrMax )
-                
-                SFFun = ROOT.TF1 ('SFFun', e.formula, e.params.ptMin, e.params.ptMax)
-                entry = ROOT.BTagEntry(SFFun, params)
-                calib.addEntry(entry)
-                
-    # ... then the merged systematics
-    for mergedSystematic in mergedSystematics:
+        profiler.lap('merging')
+
+    # The entries are streamed to the output file in one batch per loader and per central entry, and the output
+    # file is only renamed in place once complete: if the writing stops, the spool file is removed
+    with btagCalibrationWriter.BTagCalibrationWriter(outputfilename.split('/')[-1].split('_')[0], outputfilename) as calib:
+
+        # Now we can write the output: first the cetral values, total uncertainties, and splitted systematics ...
         for data in loaders:
+            entries = [ ]
             for e in data.entries:
-                if e.params.sysType=='central': 
-
-                    auxMergedUncertainty = mergedUncertainty[e.params.operatingPoint][e.params.measurementType][mergedSystematic][e.params.jetFlavor]
-                    for etamin in auxMergedUncertainty:
-                        if etamin>=e.params.etaMin:
-                            for etamax in auxMergedUncertainty[etamin]:
-                                if etamax<=e.params.etaMax:
-                                    for ptmin in auxMergedUncertainty[etamin][etamax]:
-                                        if ptmin>=e.params.ptMin:
-                                            for ptmax in auxMergedUncertainty[etamin][etamax][ptmin]:
-                                                if ptmax<=e.params.ptMax:
-
-                                                    for variation in [ 'up_', 'down_' ]:
-
-                                                        params = ROOT.BTagEntry.Parameters( e.params.operatingPoint, 
-                                                                                            e.params.measurementType, 
-                                                                                            variation + mergedSystematic,
-                                                                                            e.params.jetFlavor,
-                                                                                            etamin,
-                                                                                            etamax, 
-                                                                                            ptmin, 
-                                                                                            ptmax,
-                                                                                            e.params.discrMin,
-                                                                                            e.params.discrMax )
-
-                                                        systematicValue = str(math.sqrt(auxMergedUncertainty[etamin][etamax][ptmin][ptmax][e.params.discrMin][e.params.discrMax]))
-                                                        sign = '+' if (variation=='up_') else '-'
-                                                        SFFun = ROOT.TF1 ('SFFun', e.formula + sign + systematicValue, ptmin, ptmax)
-                                                        entry = ROOT.BTagEntry(SFFun, params)
-                                                        calib.addEntry(entry)
-
-    with open(outputfilename, 'w') as f:
-        f.write(calib.makeCSV())
+     
+                if e.params.sysType=='central' or e.params.sysType=='up' or e.params.sysType=='down' or e.params.sysType.split('_')[1] in splitList:
+
+                    entries.append( ( int(e.params.operatingPoint), 
+                                      str(e.params.measurementType), 
+                                      str(e.params.sysType),
+                                      int(e.params.jetFlavor),
+                                      e.params.etaMin,
+                                      e.params.etaMax, 
+                                      e.params.ptMin, 
+                                      e.params.ptMax,
+                                      e.params.discrMin,
+                                      e.params.discrMax,
+                                      str(e.formula) ) )
+
+            calib.addEntries(entries)
+                
+        profiler.lap('entries')
+
+        # ... then the merged systematics
+        for mergedSystematic in mergedSystematics:
+            for data in loaders:
+                for e in data.entries:
+                    if e.params.sysType=='central': 
+
+                        entries = [ ]
+                        auxMergedUncertainty = mergedUncertainty[e.params.operatingPoint][e.params.measurementType][mergedSystematic][e.params.jetFlavor]
+                        for etamin in auxMergedUncertainty:
+                            if etamin>=e.params.etaMin:
+                                for etamax in auxMergedUncertainty[etamin]:
+                                    if etamax<=e.params.etaMax:
+                                        for ptmin in auxMergedUncertainty[etamin][etamax]:
+                                            if ptmin>=e.params.ptMin:
+                                                for ptmax in auxMergedUncertainty[etamin][etamax][ptmin]:
+                                                    if ptmax<=e.params.ptMax:
+
+                                                        for variation in [ 'up_', 'down_' ]:
+
+                                                            systematicValue = str(math.sqrt(auxMergedUncertainty[etamin][etamax][ptmin][ptmax][e.params.discrMin][e.params.discrMax]))
+                                                            sign = '+' if (variation=='up_') else '-'
+
+                                                            entries.append( ( int(e.params.operatingPoint), 
+                                                                              str(e.params.measurementType), 
+                                                                              variation + mergedSystematic,
+                                                                              int(e.params.jetFlavor),
+                                                                              etamin,
+                                                                              etamax, 
+                                                                              ptmin, 
+                                                                              ptmax,
+                                                                              e.params.discrMin,
+                                                                              e.params.discrMax,
+                                                                              str(e.formula) + sign + systematicValue ) )
+
+                        calib.addEntries(entries)
+
+        profiler.lap('entries')
+
+        calib.close()
+    profiler.lap('writing')
+
+    profiler.stop()
+    profiler.printSummary()
 
                 
@@ -0,0 +1,124 @@
+import io
+import os
+import csv
+import shutil
+import tempfile
+from collections import OrderedDict
+
+# Jet flavours and operating points, with the values of the BTagEntry enums
+flavourB, flavourC, flavourUDSG = 0, 1, 2
+opLoose, opMedium, opTight, opExtraTight, opExtraExtraTight = 0, 1, 2, 3, 4
+
+csvHeader = 'OperatingPoint, measurementType, sysType, jetFlavor, etaMin, etaMax, ptMin, ptMax, discrMin, discrMax, formula \n'
+
+# Layout of the csv files in the btv-scale-factors repository, which use working point labels and hadron flavours
+newCsvHeader = [ 'wp', 'type', 'syst', 'flav', 'etaMin', 'etaMax', 'ptMin', 'ptMax', 'formula' ]
+newCsvWorkingPoints = { opLoose : 'L', opMedium : 'M', opTight : 'T', opExtraTight : 'XT', opExtraExtraTight : 'XXT' }
+newCsvFlavours = { flavourB : 5, flavourC : 4, flavourUDSG : 0 }
+
+# Numbers are written as a default C++ stream would do, i.e. as %g with 6 significant digits
+def formatNumber(value):
+    return str(value) if isinstance(value, int) else '%g' % value
+
+# Replacement for BTagCalibration when writing csv files: the entries are plain tuples
+# (operatingPoint, measurementType, sysType, jetFlavor, etaMin, etaMax, ptMin, ptMax, discrMin, discrMax, formula)
+# instead of BTagEntry objects, so no TF1 is compiled per entry. As in BTagCalibration, the entries are grouped
+# by (operating point, measurement type, systematic) and the groups are written in alphabetical order, while
+# the entries in a group keep the order in which they were added.
+# The entries are not kept in memory: each batch of entries is formatted when it is added, and its lines are
+# appended to a spool file in a temporary directory (not in the output directory, which can be a checkout of the
+# btv-scale-factors repository), one block per group, so only the position and size of the blocks are remembered.
+# close() copies the blocks of each group, in order, to a temporary file next to the output file, which is then
+# renamed to it, so the output file is either complete or not written at all. The writer is a context manager:
+# if the run stops before close(), discard() removes the spool file, unless keepSpool is set to inspect it
+class BTagCalibrationWriter:
+
+    def __init__(self, tagger, fileName, standalone=False, keepSpool=False):
+
+        self.tagger = tagger
+        self.fileName = fileName
+        self.standalone = standalone
+        self.keepSpool = keepSpool
+        self.blocks = OrderedDict()
+
+        outputDirectory, outputName = os.path.split(fileName)
+        self.spoolDirectory = tempfile.mkdtemp(prefix='btagCalibrationWriter')
+        self.spoolFileName = os.path.join(self.spoolDirectory, outputName+'.spool')
+        self.temporaryFileName = os.path.join(outputDirectory, '.'+outputName+'.'+str(os.getpid()))
+        self.spoolFile = open(self.spoolFileName, 'w+b')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exceptionType, exceptionValue, traceback):
+        if not self.spoolFile.closed: self.discard()
+
+    @staticmethod
+    def token(operatingPoint, measurementType, sysType):
+        return ', '.join([ formatNumber(operatingPoint), measurementType, sysType ])
+
+    @staticmethod
+    def makeCSVLine(entry):
+        return ', '.join([ formatNumber(x) if not isinstance(x, str) else x for x in entry[:-1] ])+', "'+entry[-1]+'" \n'
+
+    @staticmethod
+    def makeNewCSVRow(entry):
+
+        operatingPoint, measurementType, sysType, jetFlavor, etaMin, etaMax, ptMin, ptMax, discrMin, discrMax, formula = entry
+        return [ newCsvWorkingPoints[operatingPoint], measurementType, sysType, newCsvFlavours[jetFlavor],
+                 formatNumber(etaMin), formatNumber(etaMax), formatNumber(ptMin), formatNumber(ptMax), formula ]
+
+    def header(self):
+
+        if not self.standalone: return self.tagger+';'+csvHeader
+
+        output = io.StringIO()
+        csv.writer(output, lineterminator='\n').writerow(newCsvHeader)
+        return output.getvalue()
+
+    def formatLines(self, entries):
+
+        if not self.standalone: return ''.join([ self.makeCSVLine(entry) for entry in entries ])
+
+        output = io.StringIO()
+        csv.writer(output, lineterminator='\n').writerows([ self.makeNewCSVRow(entry) for entry in entries ])
+        return output.getvalue()
+
+    # Append a batch of entries, e.g. those of one combination, to the spool file
+    def addEntries(self, entries):
+
+        groups = OrderedDict()
+        for operatingPoint, measurementType, sysType, jetFlavor, etaMin, etaMax, ptMin, ptMax, discrMin, discrMax, formula in entries:
+            entry = (operatingPoint, measurementType.lower(), sysType.lower(), jetFlavor, etaMin, etaMax, ptMin, ptMax, discrMin, discrMax, formula)
+            groups.setdefault(self.token(*entry[:3]), []).append(entry)
+
+        for token, groupEntries in groups.items():
+            block = self.formatLines(groupEntries).encode()
+            self.blocks.setdefault(token, []).append((self.spoolFile.tell(), len(block)))
+            self.spoolFile.write(block)
+
+        self.spoolFile.flush()
+
+    def close(self):
+
+        try:
+            with open(self.temporaryFileName, 'wb') as outputFile:
+                outputFile.write(self.header().encode())
+                for token in sorted(self.blocks):
+                    for offset, size in self.blocks[token]:
+                        self.spoolFile.seek(offset)
+                        outputFile.write(self.spoolFile.read(size))
+            os.replace(self.temporaryFileName, self.fileName)
+        except BaseException:
+            if os.path.exists(self.temporaryFileName): os.remove(self.temporaryFileName)
+            raise
+
+        self.spoolFile.close()
+        shutil.rmtree(self.spoolDirectory)
+
+    # Stop writing without producing the output file. The spool file is removed, or kept and reported if keepSpool is set
+    def discard(self):
+
+        self.spoolFile.close()
+        if self.keepSpool: print('Csv entries of', self.fileName, 'written so far kept in', self.spoolFileName)
+        else: shutil.rmtree(self.spoolDirectory)
@@ -0,0 +1,149 @@
+import os
+import sys
+import importlib.util
+
+# Settings every campaign file has to define
+requiredSettings = [ 'campaignLuminosity', 'centerOfMassEnergy', 'minPtCampaign', 'maxPtCampaign', 'maxEtaCampaign', 'widthYAxis', 'csvFileNameFlag',
+                     'algorithms', 'workingPoints', 'sampleDependence', 'normalizedChi2Tollerance', 'cJetsInflationFactor', 'combinations', 'measurements',
+                     'vetoedMethods', 'maskedMethods', 'maskedMeasurements', 'fittingFunctions', 'ptBinErrorScales',
+                     'type1Systematics', 'type2Systematics', 'type3Systematics', 'systematicPtCorrelated', 'systematicPtUncorrelated', 'ptCorrelationCoefficients',
+                     'systematicYearCorrelated', 'systematicYearUncorrelated', 'statisticalCorrelationCoefficients' ]
+
+requiredMeasurementKeys = [ 'plotname', 'legname', 'data', 'version', 'color', 'marker', 'size', 'shift', 'width' ]
+
+# Campaigns already loaded in this process
+loadedCampaigns = {}
+
+# Lazy factory for the pt-dependence fitting functions declared in the campaign files: it only keeps
+# the formula and the starting parameters, and the TF1 is compiled when a fit actually needs it
+class FittingFunction:
+
+    def __init__(self, name, formula, minPt, maxPt):
+
+        self.name = name
+        self.formula = formula
+        self.minPt, self.maxPt = minPt, maxPt
+        self.parameters = []
+
+    def SetParameters(self, *parameters):
+        self.parameters = list(parameters)
+
+    def makeTF1(self, name=None, minPt=None, maxPt=None):
+
+        import ROOT
+
+        tf1 = ROOT.TF1(name or self.name, self.formula, self.minPt if minPt is None else minPt, self.maxPt if maxPt is None else maxPt)
+        for par in range(min(tf1.GetNpar(), len(self.parameters))): tf1.SetParameter(par, self.parameters[par])
+        return tf1
+
+class CampaignError(Exception):
+    pass
+
+# Classification of a systematic source, compiled from the campaign lists: ptCorrelated and yearCorrelated
+# are None while the source is not assigned, ptCorrelation is the correlation between different pt bins, and
+# category is the breakdown category, 1, 2 or 3 for type1, type2 or type3, or None
+class SystematicClass:
+
+    def __init__(self):
+
+        self.ptCorrelated = None
+        self.ptCorrelation = 1.
+        self.yearCorrelated = None
+        self.category = None
+
+    def complete(self):
+        return self.ptCorrelated is not None and self.yearCorrelated is not None and self.category is not None
+
+# Classification returned for the sources not listed in the campaign
+unassignedSystematic = SystematicClass()
+
+# Compile the systematic lists of a campaign into a table systematic -> SystematicClass, checking that
+# no source is assigned twice to the same property
+def compileSystematicClassification(module, campaignName):
+
+    classification = {}
+
+    def assign(systematics, attribute, value, conflict):
+        for syst in systematics:
+            systematicClass = classification.setdefault(syst, SystematicClass())
+            if getattr(systematicClass, attribute) not in (None, value):
+                raise CampaignError('Systematic '+syst+' '+conflict+' in campaign '+campaignName)
+            setattr(systematicClass, attribute, value)
+
+    assign(module.systematicPtCorrelated, 'ptCorrelated', True, 'assigned both as pt-correlated and pt-uncorrelated')
+    assign(module.systematicPtUncorrelated, 'ptCorrelated', False, 'assigned both as pt-correlated and pt-uncorrelated')
+    assign(module.systematicYearCorrelated, 'yearCorrelated', True, 'assigned both as year-correlated and year-uncorrelated')
+    assign(module.systematicYearUncorrelated, 'yearCorrelated', False, 'assigned both as year-correlated and year-uncorrelated')
+    for category, systematics in enumerate([ module.type1Systematics, module.type2Systematics, module.type3Systematics ], 1):
+        assign(systematics, 'category', category, 'assigned to more than one breakdown category')
+
+    for syst, systematicClass in classification.items():
+        systematicClass.ptCorrelation = 0. if systematicClass.ptCorrelated is False else module.ptCorrelationCoefficients.get(syst, 1.)
+
+    return classification
+
+# Campaign settings, read from the module built out of Campaigns/<campaign>.py
+class CampaignConfig:
+
+    def __init__(self, name, module):
+
+        self.name = name
+        self.module = module
+        self.systematicClassification = {}
+
+    def __getattr__(self, setting):
+
+        if setting in ('name', 'module', 'systematicClassification'): raise AttributeError(setting)
+        return getattr(self.module, setting)
+
+    # Settings to be used as globals by the scripts, without the modules imported by the campaign file
+    def settings(self):
+        return { setting : value for setting, value in vars(self.module).items() if not setting.startswith('__') and setting not in ('opt', 'ROOT') and not isinstance(value, type(sys)) }
+
+    def validate(self, store=False):
+
+        missingSettings = [ setting for setting in requiredSettings if not hasattr(self.module, setting) ]
+        if store and not hasattr(self.module, 'csvWorkingPoints'): missingSettings.append('csvWorkingPoints')
+        if len(missingSettings)>0:
+            raise CampaignError('Campaign '+self.name+' misses the settings: '+', '.join(missingSettings))
+
+        for method in self.module.measurements:
+            missingKeys = [ key for key in requiredMeasurementKeys if key not in self.module.measurements[method] ]
+            if len(missingKeys)>0:
+                raise CampaignError('Measurement '+method+' in campaign '+self.name+' misses the keys: '+', '.join(missingKeys))
+
+        self.systematicClassification = compileSystematicClassification(self.module, self.name)
+
+    # Check that a fitting function is declared for each selected combination, algorithm and working point
+    def validateFittingFunctions(self, combinations, algorithms, workingPoints):
+
+        for comb in combinations:
+            for algo in algorithms:
+                for wp in workingPoints:
+                    fittingFunction = self.module.fittingFunctions.get(comb, {}).get(algo, {}).get(wp, None)
+                    if not isinstance(fittingFunction, FittingFunction):
+                        raise CampaignError('No fitting function declared for combination '+comb+', algorithm '+algo+', working point '+wp+' in campaign '+self.name)
+
+# Load a campaign file as a module: opt and ROOT are made available to the campaign file, as it uses them to
+# choose its settings. The loaded campaign is cached, so that it is only executed once per process
+def loadCampaign(campaignName, opt, ROOT=None, campaignDirectory='./Campaigns'):
+
+    if campaignName in loadedCampaigns:
+        return loadedCampaigns[campaignName]
+
+    campaignFileName = os.path.join(campaignDirectory, campaignName+'.py')
+    if not os.path.exists(campaignFileName):
+        raise CampaignError('Campaign '+campaignName+' not found')
+
+    moduleName = 'campaign_'+campaignName
+    spec = importlib.util.spec_from_file_location(moduleName, campaignFileName)
+    module = importlib.util.module_from_spec(spec)
+    module.opt, module.ROOT = opt, ROOT
+    sys.modules[moduleName] = module
+    spec.loader.exec_module(module)
+
+    campaign = CampaignConfig(campaignName, module)
+    campaign.validate(opt.store)
+
+    loadedCampaigns[campaignName] = campaign
+    return campaign
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import os
+import csv
+import shutil
+import tempfile
+import optparse
+import btagCalibrationWriter
+
+# Reference files written with BTagEntry objects: by BTagCalibration::makeCSV in CMSSW, and in the layout of the
+# btv-scale-factors repository
+defaultReferenceFiles = [ './CSVFiles/DeepJet_106XUL16APVSF.csv', './CSVFiles/DeepJet_106XUL18SF_YearCorrelation-V1.csv',
+                          '../btv-scale-factors/2023_Summer23BPix/csv/btagging_fixedWP_SFb/deepJet_ptrel_v1.csv' ]
+
+def number(value):
+    return int(value) if value.lstrip('-').isdigit() else float(value)
+
+# Entry tuples of a csv file, as given to BTagCalibrationWriter, with its tagger and layout
+def readEntries(fileName):
+
+    with open(fileName) as inputFile:
+        lines = inputFile.read().splitlines()
+
+    if ';' in lines[0]:
+        entries = []
+        for line in lines[1:]:
+            if ', "' not in line:
+                print('Error: line', line, 'of', fileName, 'not written by makeCSV')
+                exit()
+            fields, formula = line.split(', "')
+            fields = fields.split(', ')
+            entries.append((int(fields[0]), fields[1], fields[2], int(fields[3]))+tuple([ number(field) for field in fields[4:] ])+(formula[:formula.rindex('"')],))
+        return lines[0].split(';')[0], False, entries
+
+    operatingPoints = { label : operatingPoint for operatingPoint, label in btagCalibrationWriter.newCsvWorkingPoints.items() }
+    flavours = { str(hadronFlavour) : flavour for flavour, hadronFlavour in btagCalibrationWriter.newCsvFlavours.items() }
+    rows = list(csv.reader(lines))
+    if rows[0]!=btagCalibrationWriter.newCsvHeader:
+        print('Error: unknown layout of', fileName)
+        exit()
+
+    return '', True, [ (operatingPoints[row[0]], row[1], row[2], flavours[row[3]])+tuple([ number(field) for field in row[4:8] ])+(0., 1., row[8]) for row in rows[1:] ]
+
+# Write the entries of a reference file again, and compare the two files line by line. Returns the number of
+# differing lines, printing the first ones, and how the files still match: with the same lines in a different
+# order, as the files not written by makeCSV in a single pass don't group the entries like it, or only up to the
+# case of the measurement types and systematics, which BTagEntry::Parameters lowercases
+def checkFile(fileName, outputDirectory, maxPrintedLines):
+
+    tagger, standalone, entries = readEntries(fileName)
+    outputFileName = os.path.join(outputDirectory, os.path.basename(fileName))
+
+    with btagCalibrationWriter.BTagCalibrationWriter(tagger, outputFileName, standalone) as calibrationWriter:
+        calibrationWriter.addEntries(entries)
+        calibrationWriter.close()
+
+    with open(fileName) as referenceFile, open(outputFileName) as outputFile:
+        referenceLines, outputLines = referenceFile.read().splitlines(), outputFile.read().splitlines()
+
+    differences = [ (line, referenceLine, outputLine) for line, (referenceLine, outputLine) in enumerate(zip(referenceLines, outputLines)) if referenceLine!=outputLine ]
+    if len(differences)==0: match = 'identical'
+    elif sorted(referenceLines)==sorted(outputLines): match = 'reordered'
+    elif sorted([ line.lower() for line in referenceLines ])==sorted([ line.lower() for line in outputLines ]): match = 'lowercased'
+    else: match = 'different'
+
+    if match=='different':
+        for line, referenceLine, outputLine in differences[:maxPrintedLines]:
+            print('    line', line+1, ': reference', referenceLine, '\n'+' '*(11+len(str(line+1)))+'writer   ', outputLine)
+
+    return len(differences) + abs(len(referenceLines)-len(outputLines)), match
+
+if __name__ == '__main__':
+
+    # Input parameters
+    usage = 'usage: %prog [options]'
+    parser = optparse.OptionParser(usage)
+    parser.add_option('--reference'      , dest='reference'      , help='Reference csv files, comma separated', default=','.join(defaultReferenceFiles))
+    parser.add_option('--printlines'     , dest='printlines'     , help='Differing lines printed per file'   , default=5, type='int')
+    (opt, args) = parser.parse_args()
+
+    outputDirectory = tempfile.mkdtemp(prefix='checkCalibrationWriter')
+    failedFiles = 0
+
+    for fileName in opt.reference.split(','):
+
+        if not os.path.exists(fileName):
+            print('Error: reference file', fileName, 'not found')
+            exit()
+
+        nDifferences, match = checkFile(fileName, outputDirectory, opt.printlines)
+        if match=='identical': print(fileName+': identical')
+        elif match=='reordered': print(fileName+': same lines, grouped by operating point, type and systematic')
+        elif match=='lowercased': print(fileName+': same lines up to the case of types and systematics, lowercased as by BTagEntry')
+        else:
+            print(fileName+':', nDifferences, 'differing lines')
+            failedFiles += 1
+
+    shutil.rmtree(outputDirectory)
+    if failedFiles>0: exit(1)
@@ -0,0 +1,660 @@
+import math
+from collections import OrderedDict
+import numpy
+
+try:
+    import scipy.linalg
+except ImportError:
+    scipy = None
+
+# Flatten the nested measuredScaleFactors[ptbin][method] dictionary into the vectors used by the fit:
+# the measurement vector, the matrix U mapping measurements onto pt bins, and one uncertainty
+# vector per systematic source (zero for the measurements that don't have it)
+class MeasurementVectors:
+
+    def __init__(self, measuredScaleFactors):
+
+        self.ptbins = list(measuredScaleFactors.keys())
+        self.measurements, self.systematics = [], []
+
+        systematicIndex = OrderedDict()
+        for ptbin in measuredScaleFactors:
+            for method in measuredScaleFactors[ptbin]:
+                self.measurements.append((ptbin, method))
+                for syst in measuredScaleFactors[ptbin][method]['systematics']:
+                    if syst!='total' and syst not in systematicIndex:
+                        systematicIndex[syst] = len(systematicIndex)
+
+        self.systematics = list(systematicIndex.keys())
+        self.systematicIndex = systematicIndex
+
+        nMeasurements, nCombinedScaleFactors = len(self.measurements), len(self.ptbins)
+        ptbinIndex = { ptbin : iptbin for iptbin, ptbin in enumerate(self.ptbins) }
+
+        self.ptbinIndices = numpy.array([ ptbinIndex[ptbin] for ptbin, method in self.measurements ], dtype=int)
+        self.methods = [ method for ptbin, method in self.measurements ]
+
+        self.matrixU = numpy.zeros((nMeasurements, nCombinedScaleFactors))
+        self.matrixU[numpy.arange(nMeasurements), self.ptbinIndices] = 1.
+
+        self.scaleFactorVector = numpy.zeros(nMeasurements)
+        self.uncertaintyVectors = numpy.zeros((nMeasurements, len(self.systematics)))
+
+        for meas, (ptbin, method) in enumerate(self.measurements):
+            self.scaleFactorVector[meas] = measuredScaleFactors[ptbin][method]['central']
+            for syst, value in measuredScaleFactors[ptbin][method]['systematics'].items():
+                if syst!='total': self.uncertaintyVectors[meas][systematicIndex[syst]] = value
+
+    def __len__(self):
+        return len(self.measurements)
+
+# Build covariance matrices as sums of outer products of the uncertainty vectors, weighted by the
+# correlation mask of each systematic. Systematics sharing the same correlation model (pt-uncorrelated,
+# or pt-correlated with a given coefficient) share the same mask, so their outer products are summed
+# with a single matrix product. The correlation models come from the campaign systematic classification
+class CovarianceBuilder:
+
+    def __init__(self, measurementVectors, systematicClassification, statisticalCorrelationCoefficients):
+
+        self.measurementVectors = measurementVectors
+        self.systematicClassification = systematicClassification
+        self.statisticalCorrelationCoefficients = statisticalCorrelationCoefficients
+
+        ptbinIndices = measurementVectors.ptbinIndices
+        self.samePtBin = ptbinIndices[:,None]==ptbinIndices[None,:]
+        self.masks = {}
+
+    def maskKey(self, syst):
+
+        if syst in self.statisticalCorrelationCoefficients: return ('statistical', syst)
+        systematicClass = self.systematicClassification[syst]
+        if systematicClass.ptCorrelated is False: return ('ptuncorrelated', 0.)
+        return ('ptcorrelated', systematicClass.ptCorrelation)
+
+    def correlationMask(self, syst):
+
+        key = self.maskKey(syst)
+        if key not in self.masks:
+
+            if key[0]=='ptuncorrelated':
+                mask = self.samePtBin.astype(float)
+
+            elif key[0]=='ptcorrelated':
+                mask = numpy.where(self.samePtBin, 1., key[1])
+
+            else:
+                mask = numpy.where(self.samePtBin, 1., self.systematicClassification[syst].ptCorrelation)
+
+                # Correlations between different methods in the same pt bin
+                measurements = self.measurementVectors.measurements
+                for row, (row_ptbin, row_method) in enumerate(measurements):
+                    for column, (column_ptbin, column_method) in enumerate(measurements):
+                        if row_ptbin==column_ptbin and row_method!=column_method:
+                            methodPair = row_method+'-'+column_method
+                            if methodPair in self.statisticalCorrelationCoefficients[syst]:
+                                mask[row][column] = self.statisticalCorrelationCoefficients[syst][methodPair].get(row_ptbin, 1.)
+                            elif syst=='statistic':
+                                mask[row][column] = 0.
+
+            self.masks[key] = mask
+
+        return self.masks[key]
+
+    # Systematics of the measurements grouped by correlation mask
+    def groupSystematics(self, systematics):
+
+        groupedSystematics = OrderedDict()
+        for syst in systematics:
+            if syst in self.measurementVectors.systematicIndex:
+                groupedSystematics.setdefault(self.maskKey(syst), []).append(syst)
+        return groupedSystematics
+
+    def covariance(self, systematics=None):
+
+        measurementVectors = self.measurementVectors
+        if systematics is None: systematics = measurementVectors.systematics
+
+        nMeasurements = len(measurementVectors)
+        covarianceMatrix = numpy.zeros((nMeasurements, nMeasurements))
+
+        for key, systematicGroup in self.groupSystematics(systematics).items():
+            uncertaintyVectors = measurementVectors.uncertaintyVectors[:, [ measurementVectors.systematicIndex[syst] for syst in systematicGroup ]]
+            covarianceMatrix += self.correlationMask(systematicGroup[0])*numpy.dot(uncertaintyVectors, uncertaintyVectors.T)
+
+        return covarianceMatrix
+
+    # The masks give to all the systematics of a group the same correlation rho between different pt bins, so that
+    # the group contributes rho*A*A^T, with the uncertainty vectors of the group as columns of A, plus terms within
+    # the pt bins. Returns the columns sqrt(rho)*A of the groups correlated between pt bins, or None if a group has
+    # a negative correlation between pt bins
+    def ptCorrelatedFactor(self, systematics):
+
+        measurementVectors = self.measurementVectors
+
+        lowRankColumns = [ numpy.zeros((len(measurementVectors), 0)) ]
+        for key, systematicGroup in self.groupSystematics(systematics).items():
+            ptCorrelation = key[1] if key[0]!='statistical' else self.systematicClassification[systematicGroup[0]].ptCorrelation
+            if ptCorrelation<0.: return None
+            if ptCorrelation>0.:
+                lowRankColumns.append(math.sqrt(ptCorrelation)*measurementVectors.uncertaintyVectors[:, [ measurementVectors.systematicIndex[syst] for syst in systematicGroup ]])
+
+        return numpy.hstack(lowRankColumns)
+
+    # Structure of the covariance matrix C = B + G*G^T, with B block diagonal by pt bin: G has the pt-correlated
+    # columns of ptCorrelatedFactor, and the blocks of B are the blocks of C minus those of G*G^T. Returns the
+    # indices and matrices of the blocks and G, or None if there is no such structure, i.e. with a single pt bin
+    # or negative correlations between pt bins
+    def ptBinStructure(self, covarianceMatrix):
+
+        measurementVectors = self.measurementVectors
+        if len(measurementVectors.ptbins)<2: return None
+
+        lowRankFactor = self.ptCorrelatedFactor(measurementVectors.systematics)
+        if lowRankFactor is None: return None
+
+        return ptBinBlocks(covarianceMatrix, measurementVectors.ptbinIndices, len(measurementVectors.ptbins), lowRankFactor)
+
+# Blocks of B = C - G*G^T by pt bin, dropping the columns of G without any measurement
+def ptBinBlocks(covarianceMatrix, ptbinIndices, nPtbins, lowRankFactor):
+
+    lowRankFactor = lowRankFactor[:, numpy.any(lowRankFactor!=0., axis=0)]
+
+    blockIndices = [ numpy.flatnonzero(ptbinIndices==iptbin) for iptbin in range(nPtbins) ]
+    blockMatrices = [ covarianceMatrix[numpy.ix_(indices, indices)] - numpy.dot(lowRankFactor[indices], lowRankFactor[indices].T) for indices in blockIndices ]
+
+    return blockIndices, blockMatrices, lowRankFactor
+
+# Covariance of the measurements of several eras combined jointly, C = E + S*S^T: the block-diagonal part E has
+# one block per era, with the systematics not correlated with the other eras, and S*S^T has the year-correlated
+# systematics shared by two or more eras. For each shared systematic, with uncertainty vector a_e and correlation
+# between pt bins rho_e in era e, S has the column sqrt(rho_e)*a_e, and one column sqrt(1-rho_e)*a_e per pt bin,
+# restricted to the measurements of the pt bin. Within an era this is the same correlation model as
+# CovarianceBuilder, and between eras the correlation is sqrt(rho_e*rho_f) across pt bins, and
+# sqrt(rho_e*rho_f)+sqrt((1-rho_e)*(1-rho_f)) in the same pt bin, so that C stays positive semi-definite also if
+# the eras classify a systematic differently. The systematics with statistical correlations between methods are
+# kept within their era. For the factorization, ptBinStructure splits C by pt bin, with blocks spanning the eras,
+# so that the columns of S by pt bin go into the blocks, and only its pt-correlated columns are left in the
+# low-rank factor. The joint fit has a design matrix for the era-specific scale factors, and one for the scale
+# factors averaged over the eras, i.e. one scale factor per pt bin for all the eras
+class JointCovarianceBuilder:
+
+    def __init__(self, covarianceBuilders):
+
+        self.covarianceBuilders = covarianceBuilders
+        eraMeasurementVectors = [ covarianceBuilder.measurementVectors for covarianceBuilder in covarianceBuilders ]
+
+        ptbins = set([ ptbin for measurementVectors in eraMeasurementVectors for ptbin in measurementVectors.ptbins ])
+        self.ptbins = sorted(ptbins, key=lambda ptbin: (float(ptbin.split('-')[1].split('to')[0]), float(ptbin.split('to')[1])))
+        ptbinIndex = { ptbin : iptbin for iptbin, ptbin in enumerate(self.ptbins) }
+
+        self.eraOffsets = numpy.cumsum([ 0 ]+[ len(measurementVectors) for measurementVectors in eraMeasurementVectors ])
+        self.eraParameterOffsets = numpy.cumsum([ 0 ]+[ len(measurementVectors.ptbins) for measurementVectors in eraMeasurementVectors ])
+        self.eraPtbinIndices = [ numpy.array([ ptbinIndex[ptbin] for ptbin in measurementVectors.ptbins ], dtype=int) for measurementVectors in eraMeasurementVectors ]
+        nMeasurements = self.eraOffsets[-1]
+
+        self.scaleFactorVector = numpy.concatenate([ measurementVectors.scaleFactorVector for measurementVectors in eraMeasurementVectors ])
+        self.ptbinIndices = numpy.concatenate([ eraPtbinIndices[measurementVectors.ptbinIndices] for eraPtbinIndices, measurementVectors in zip(self.eraPtbinIndices, eraMeasurementVectors) ])
+
+        self.matrixU = numpy.zeros((nMeasurements, self.eraParameterOffsets[-1]))
+        for era, measurementVectors in enumerate(eraMeasurementVectors):
+            self.matrixU[self.eraOffsets[era]:self.eraOffsets[era+1], self.eraParameterOffsets[era]:self.eraParameterOffsets[era+1]] = measurementVectors.matrixU
+
+        self.averageMatrixU = numpy.zeros((nMeasurements, len(self.ptbins)))
+        self.averageMatrixU[numpy.arange(nMeasurements), self.ptbinIndices] = 1.
+
+        yearCorrelatedEras = OrderedDict()
+        for covarianceBuilder in covarianceBuilders:
+            for syst in covarianceBuilder.measurementVectors.systematics:
+                if self.yearCorrelated(covarianceBuilder, syst): yearCorrelatedEras[syst] = yearCorrelatedEras.get(syst, 0) + 1
+
+        self.sharedSystematics = [ syst for syst, nEras in yearCorrelatedEras.items() if nEras>1 ]
+
+    # Systematics that can be correlated with the other eras: negative correlations between pt bins are not
+    # supported by the low-rank factor, and are kept within their era as well
+    def yearCorrelated(self, covarianceBuilder, syst):
+
+        systematicClass = covarianceBuilder.systematicClassification[syst]
+        return systematicClass.yearCorrelated is True and 0.<=systematicClass.ptCorrelation<=1. and syst not in covarianceBuilder.statisticalCorrelationCoefficients
+
+    def eraSharedSystematics(self, era):
+
+        covarianceBuilder = self.covarianceBuilders[era]
+        return [ syst for syst in self.sharedSystematics if syst in covarianceBuilder.measurementVectors.systematicIndex and self.yearCorrelated(covarianceBuilder, syst) ]
+
+    def eraSystematics(self, era):
+
+        eraSharedSystematics = self.eraSharedSystematics(era)
+        return [ syst for syst in self.covarianceBuilders[era].measurementVectors.systematics if syst not in eraSharedSystematics ]
+
+    def eraIndices(self, era):
+        return numpy.arange(self.eraOffsets[era], self.eraOffsets[era+1])
+
+    def sharedFactor(self):
+
+        nPtbins = len(self.ptbins)
+        sharedFactor = numpy.zeros((self.eraOffsets[-1], len(self.sharedSystematics)*(1+nPtbins)))
+        systematicColumn = { syst : isyst*(1+nPtbins) for isyst, syst in enumerate(self.sharedSystematics) }
+
+        for era, covarianceBuilder in enumerate(self.covarianceBuilders):
+
+            measurementVectors = covarianceBuilder.measurementVectors
+            eraRows = self.eraIndices(era)
+            ptbinColumns = 1 + self.eraPtbinIndices[era][measurementVectors.ptbinIndices]
+
+            for syst in self.eraSharedSystematics(era):
+                uncertaintyVector = measurementVectors.uncertaintyVectors[:, measurementVectors.systematicIndex[syst]]
+                ptCorrelation = covarianceBuilder.systematicClassification[syst].ptCorrelation
+                sharedFactor[eraRows, systematicColumn[syst]] = math.sqrt(ptCorrelation)*uncertaintyVector
+                sharedFactor[eraRows, systematicColumn[syst]+ptbinColumns] = math.sqrt(1.-ptCorrelation)*uncertaintyVector
+
+        return sharedFactor
+
+    def covariance(self):
+
+        # Columns of systematics or pt bins without any measurement are dropped
+        sharedFactor = self.sharedFactor()
+        sharedFactor = sharedFactor[:, numpy.any(sharedFactor!=0., axis=0)]
+        covarianceMatrix = numpy.dot(sharedFactor, sharedFactor.T)
+        for era, covarianceBuilder in enumerate(self.covarianceBuilders):
+            indices = self.eraIndices(era)
+            covarianceMatrix[numpy.ix_(indices, indices)] += covarianceBuilder.covariance(self.eraSystematics(era))
+        return covarianceMatrix
+
+    # Structure of the covariance matrix C = B + G*G^T, with B block diagonal by pt bin over all the eras, as for
+    # CovarianceBuilder: G has one column sqrt(rho_e)*a_e per shared systematic, over the eras that have it, and the
+    # pt-correlated columns of the systematics of each era. Returns None with a single pt bin, or with negative
+    # correlations between pt bins
+    def ptBinStructure(self, covarianceMatrix):
+
+        if len(self.ptbins)<2: return None
+
+        lowRankColumns = [ self.sharedFactor()[:, [ isyst*(1+len(self.ptbins)) for isyst in range(len(self.sharedSystematics)) ]] ]
+        for era, covarianceBuilder in enumerate(self.covarianceBuilders):
+            eraFactor = covarianceBuilder.ptCorrelatedFactor(self.eraSystematics(era))
+            if eraFactor is None: return None
+            lowRankColumns.append(numpy.zeros((self.eraOffsets[-1], eraFactor.shape[1])))
+            lowRankColumns[-1][self.eraIndices(era)] = eraFactor
+
+        return ptBinBlocks(covarianceMatrix, self.ptbinIndices, len(self.ptbins), numpy.hstack(lowRankColumns))
+
+# Covariance matrices of the uncertainty breakdowns: type1 and type3 categories, single type2 sources,
+# and year-correlated and year-uncorrelated components
+def buildBreakdownCovarianceMatrices(covarianceBuilder, breakSyst, yearCorr):
+
+    systematics = covarianceBuilder.measurementVectors.systematics
+    systematicClasses = [ covarianceBuilder.systematicClassification[syst] for syst in systematics ]
+    breakdownCovarianceMatrices = OrderedDict()
+
+    if breakSyst:
+        breakdownCovarianceMatrices['type1'] = covarianceBuilder.covariance([ syst for syst, systematicClass in zip(systematics, systematicClasses) if systematicClass.category==1 ])
+        breakdownCovarianceMatrices['type3'] = covarianceBuilder.covariance([ syst for syst, systematicClass in zip(systematics, systematicClasses) if systematicClass.category==3 ])
+
+    if yearCorr:
+        breakdownCovarianceMatrices['correlated']   = covarianceBuilder.covariance([ syst for syst, systematicClass in zip(systematics, systematicClasses) if systematicClass.yearCorrelated is True ])
+        breakdownCovarianceMatrices['uncorrelated'] = covarianceBuilder.covariance([ syst for syst, systematicClass in zip(systematics, systematicClasses) if systematicClass.yearCorrelated is False ])
+
+    if breakSyst:
+        for syst, systematicClass in zip(systematics, systematicClasses):
+            if systematicClass.category==2:
+                breakdownCovarianceMatrices[syst] = covarianceBuilder.covariance([ syst ])
+
+    return breakdownCovarianceMatrices
+
+# Combination of a subset of the measurements, selected by a boolean array, from the submatrices of the full
+# covariance matrix, so that the covariance is built only once for all the subsets. The pt bins without any
+# selected measurement are dropped. Returns the indices of the combined pt bins, the combined scale factors,
+# their uncertainties, the chi2 and the number of degrees of freedom, or None if the subset can't be combined
+def combineMeasurementSubset(measurementVectors, covarianceMatrix, selected):
+
+    selectedMeasurements = numpy.flatnonzero(selected)
+    if len(selectedMeasurements)==0: return None
+
+    ptbinIndices = numpy.unique(measurementVectors.ptbinIndices[selectedMeasurements])
+    matrixU = measurementVectors.matrixU[numpy.ix_(selectedMeasurements, ptbinIndices)]
+    solver = GeneralizedLeastSquaresSolver(matrixU, covarianceMatrix[numpy.ix_(selectedMeasurements, selectedMeasurements)])
+    if not solver.solvable: return None
+
+    scaleFactorVector = measurementVectors.scaleFactorVector[selectedMeasurements]
+    combinedScaleFactorVector = solver.combine(scaleFactorVector)
+    chi2 = solver.chi2(solver.residuals(scaleFactorVector, combinedScaleFactorVector))
+
+    return ptbinIndices, combinedScaleFactorVector, numpy.sqrt(numpy.diag(solver.scaleFactorUncertaintyMatrix)), chi2, len(selectedMeasurements)-len(ptbinIndices)
+
+# Propagate all the breakdown covariance matrices C_k to the combined scale factors at once: the matrices
+# are stacked in a 3-D array, and the variances diag(K*C_k*K^T) come from a single contraction. Tiny
+# negative variances from rounding are set to zero. Returns a (sources x ptbins) array of uncertainties
+def propagateBreakdownUncertainties(coefficientsMatrix, breakdownCovarianceMatrices, negativeTolerance=9.9e-06):
+
+    if len(breakdownCovarianceMatrices)==0:
+        return numpy.zeros((0, coefficientsMatrix.shape[0]))
+
+    stackedCovarianceMatrices = numpy.array(list(breakdownCovarianceMatrices.values()))
+    breakdownVariances = numpy.einsum('pi,kij,pj->kp', coefficientsMatrix, stackedCovarianceMatrices, coefficientsMatrix, optimize=True)
+
+    breakdownVariances[(breakdownVariances<0.) & (breakdownVariances>-negativeTolerance)] = 0.
+    if numpy.any(breakdownVariances<0.):
+        source = list(breakdownCovarianceMatrices.keys())[numpy.argwhere(breakdownVariances<0.)[0][0]]
+        raise ValueError('Negative variance propagated for uncertainty source '+source)
+
+    return numpy.sqrt(breakdownVariances)
+
+# LDL^T decomposition without pivoting, for symmetric matrices that are not positive definite
+def ldlDecomposition(matrix):
+
+    size = matrix.shape[0]
+    lower, diagonal = numpy.identity(size), numpy.zeros(size)
+
+    for col in range(size):
+        diagonal[col] = matrix[col][col] - numpy.dot(lower[col,:col]*lower[col,:col], diagonal[:col])
+        if diagonal[col]==0. or not numpy.isfinite(diagonal[col]):
+            raise numpy.linalg.LinAlgError('Zero pivot in LDL decomposition')
+        lower[col+1:,col] = (matrix[col+1:,col] - numpy.dot(lower[col+1:,:col], lower[col,:col]*diagonal[:col]))/diagonal[col]
+
+    return lower, diagonal
+
+# Solutions of the unit triangular systems for all the columns of rhs at once, with the LAPACK triangular solver
+# of scipy, or with the general solver of numpy if scipy is not available
+def forwardSubstitution(lower, rhs):
+
+    if scipy is None: return numpy.linalg.solve(lower, rhs)
+    return scipy.linalg.solve_triangular(lower, rhs, lower=True, unit_diagonal=True, check_finite=False)
+
+def backSubstitution(upper, rhs):
+
+    if scipy is None: return numpy.linalg.solve(upper, rhs)
+    return scipy.linalg.solve_triangular(upper, rhs, lower=False, unit_diagonal=True, check_finite=False)
+
+# Largest ratio of the pivots of a factorization for which the matrix is considered well conditioned: beyond it,
+# the solutions lose more than 12 of the 16 significant digits
+maximumPivotRatio = 1e+12
+
+# Factorization C = L*D*L^T of a symmetric matrix, with unit lower-triangular L. The Cholesky decomposition
+# is tried first, and LDL^T is used as a fallback. The pivots give the log-determinant for free, so there is no
+# need for a separate determinant computation, and the ratio of the largest to the smallest pivot, which is only
+# a lower bound of the condition number, as a cheap indicator of an ill-conditioned matrix. The unpivoted LDL^T
+# decomposition is unstable for such matrices, and is only used for matrices that are not positive definite
+class SymmetricFactorization:
+
+    def __init__(self, matrix):
+
+        self.size = matrix.shape[0]
+        self.lower, self.diagonal, self.method = None, None, None
+
+        try:
+            choleskyLower = numpy.linalg.cholesky(matrix)
+            choleskyDiagonal = numpy.diag(choleskyLower)
+            self.lower, self.diagonal, self.method = choleskyLower/choleskyDiagonal, choleskyDiagonal*choleskyDiagonal, 'cholesky'
+        except numpy.linalg.LinAlgError:
+            try:
+                self.lower, self.diagonal = ldlDecomposition(matrix)
+                self.method = 'ldl'
+            except numpy.linalg.LinAlgError:
+                pass
+
+        self.invertible = self.method is not None and self.size>0 and bool(numpy.all(numpy.isfinite(self.lower)))
+
+        if self.invertible:
+            absDiagonal = numpy.abs(self.diagonal)
+            self.logDeterminant = float(numpy.sum(numpy.log(absDiagonal)))
+            self.determinantSign = int(numpy.prod(numpy.sign(self.diagonal)))
+            self.pivotRatio = float(absDiagonal.max()/absDiagonal.min())
+            self.positiveDefinite = bool(numpy.all(self.diagonal>0.))
+        else:
+            self.logDeterminant, self.determinantSign, self.pivotRatio, self.positiveDefinite = -numpy.inf, 0, numpy.inf, False
+
+    # Invertible, but positive definite only up to rounding, or not at all
+    @property
+    def illConditioned(self):
+        return self.invertible and (not self.positiveDefinite or self.pivotRatio>maximumPivotRatio)
+
+    # Returns L^-1*rhs: the quadratic form rhs^T*C^-1*rhs is then sum(z*z/D)
+    def halfSolve(self, rhs):
+        return forwardSubstitution(self.lower, rhs)
+
+    def solve(self, rhs):
+        halfSolution = self.halfSolve(rhs)
+        halfSolution = (halfSolution.T/self.diagonal).T
+        return backSubstitution(self.lower.T, halfSolution)
+
+    def inverse(self):
+        return self.solve(numpy.identity(self.size))
+
+    def quadraticForm(self, vector):
+        halfSolution = self.halfSolve(vector)
+        return float(numpy.sum(halfSolution*halfSolution/self.diagonal))
+
+# Factorization of a covariance matrix C = B + G*G^T, with B block diagonal and G with few columns, from the
+# factorizations of the blocks of B and of the small capacitance matrix I + G^T*B^-1*G, with the Woodbury identity
+#   C^-1 = B^-1 - B^-1*G*(I + G^T*B^-1*G)^-1*G^T*B^-1
+# The cost grows linearly with the number of blocks, instead of with the cube of the size of C. The blocks being
+# small, their inverses are kept, so that B^-1 is applied with one matrix product per block. It has the same
+# interface as SymmetricFactorization, to be used by GeneralizedLeastSquaresSolver
+class BlockLowRankFactorization:
+
+    def __init__(self, blockIndices, blockMatrices, lowRankFactor):
+
+        self.size = lowRankFactor.shape[0]
+        self.method = 'blocklowrank'
+        self.blockIndices = blockIndices
+        self.blockFactorizations = [ SymmetricFactorization(blockMatrix) for blockMatrix in blockMatrices ]
+        self.lowRankFactor = lowRankFactor
+        self.capacitanceFactorization = None
+
+        self.invertible = self.size>0 and all([ blockFactorization.invertible for blockFactorization in self.blockFactorizations ])
+        if not self.invertible: return
+
+        self.blockInverses = [ blockFactorization.inverse() for blockFactorization in self.blockFactorizations ]
+        if lowRankFactor.shape[1]==0: return
+
+        self.blockSolvedFactor = self.blockSolve(lowRankFactor)
+        capacitanceMatrix = numpy.identity(lowRankFactor.shape[1]) + numpy.dot(lowRankFactor.T, self.blockSolvedFactor)
+        self.capacitanceFactorization = SymmetricFactorization((capacitanceMatrix + capacitanceMatrix.T)/2.)
+        self.invertible = self.capacitanceFactorization.invertible
+
+    # The determinant is det(B)*det(I + G^T*B^-1*G), and C is positive definite if B is. The pivot ratio is the
+    # largest of the blocks and of the capacitance matrix
+    def factorizations(self):
+        return self.blockFactorizations + ([ self.capacitanceFactorization ] if self.capacitanceFactorization is not None else [])
+
+    @property
+    def logDeterminant(self):
+        return float(sum([ factorization.logDeterminant for factorization in self.factorizations() ])) if self.invertible else -numpy.inf
+
+    @property
+    def determinantSign(self):
+        return int(numpy.prod([ factorization.determinantSign for factorization in self.factorizations() ])) if self.invertible else 0
+
+    @property
+    def pivotRatio(self):
+        return max([ factorization.pivotRatio for factorization in self.factorizations() ]) if self.invertible else numpy.inf
+
+    @property
+    def positiveDefinite(self):
+        return self.invertible and all([ blockFactorization.positiveDefinite for blockFactorization in self.blockFactorizations ])
+
+    @property
+    def illConditioned(self):
+        return self.invertible and (not self.positiveDefinite or self.pivotRatio>maximumPivotRatio)
+
+    # Returns B^-1*rhs
+    def blockSolve(self, rhs):
+
+        solution = numpy.zeros(rhs.shape)
+        for indices, blockInverse in zip(self.blockIndices, self.blockInverses):
+            solution[indices] = numpy.dot(blockInverse, rhs[indices])
+        return solution
+
+    def solve(self, rhs):
+
+        blockSolution = self.blockSolve(rhs)
+        if self.capacitanceFactorization is None: return blockSolution
+        return blockSolution - numpy.dot(self.blockSolvedFactor, self.capacitanceFactorization.solve(numpy.dot(self.lowRankFactor.T, blockSolution)))
+
+    def inverse(self):
+        return self.solve(numpy.identity(self.size))
+
+    def quadraticForm(self, vector):
+
+        blockSolution = self.blockSolve(vector)
+        quadraticForm = float(numpy.dot(vector, blockSolution))
+        if self.capacitanceFactorization is None: return quadraticForm
+        return quadraticForm - self.capacitanceFactorization.quadraticForm(numpy.dot(self.lowRankFactor.T, blockSolution))
+
+# Factorization of C = B + G*G^T with the block structure, falling back to the factorization of the dense matrix
+# if a block of B, or the capacitance matrix, is singular
+def factorizeBlockLowRank(blockIndices, blockMatrices, lowRankFactor):
+
+    blockLowRankFactorization = BlockLowRankFactorization(blockIndices, blockMatrices, lowRankFactor)
+    if blockLowRankFactorization.invertible: return blockLowRankFactorization
+
+    covarianceMatrix = numpy.dot(lowRankFactor, lowRankFactor.T)
+    for indices, blockMatrix in zip(blockIndices, blockMatrices):
+        covarianceMatrix[numpy.ix_(indices, indices)] += blockMatrix
+    return SymmetricFactorization(covarianceMatrix)
+
+solverModes = [ 'auto', 'dense', 'block' ]
+
+# Factorization of the covariance matrix of a combination, dense or with the pt-bin structure of the covariance
+# builder, of a single era or joint. In auto mode, the structure is only used for the combinations with at least minimumBlockMeasurements
+# measurements, below which the dense factorization is faster, and with fewer columns in G than measurements
+# outside the largest block, as otherwise it doesn't reduce the size of the problem. Without structure, or if
+# the blocks are singular, the dense factorization is used
+def factorizeCovariance(covarianceBuilder, covarianceMatrix, solverMode='auto', minimumBlockMeasurements=300):
+
+    if solverMode=='dense' or (solverMode=='auto' and covarianceMatrix.shape[0]<minimumBlockMeasurements):
+        return SymmetricFactorization(covarianceMatrix)
+
+    ptBinStructure = covarianceBuilder.ptBinStructure(covarianceMatrix)
+    if ptBinStructure is None: return SymmetricFactorization(covarianceMatrix)
+
+    blockIndices, blockMatrices, lowRankFactor = ptBinStructure
+    if solverMode=='auto' and lowRankFactor.shape[1]>=covarianceMatrix.shape[0]-max([ len(indices) for indices in blockIndices ]):
+        return SymmetricFactorization(covarianceMatrix)
+
+    return factorizeBlockLowRank(blockIndices, blockMatrices, lowRankFactor)
+
+# Generalized least squares combination of the measurements y = U*s with covariance C:
+#   s = (U^T*C^-1*U)^-1 * U^T*C^-1 * y = K * y
+# The covariance is factorized once, and the factorization is reused for the coefficient matrix K,
+# the propagated uncertainty matrix K*C*K^T = (U^T*C^-1*U)^-1, and the chi2. A factorization of C can also be
+# given, to share it between fits with different design matrices: the covariance matrix itself is then only
+# needed for the pulls and the toy experiments
+class GeneralizedLeastSquaresSolver:
+
+    def __init__(self, matrixU, covarianceMatrix, covarianceFactorization=None):
+
+        self.matrixU = matrixU
+        self.covarianceMatrix = covarianceMatrix
+        self.covarianceFactorization = SymmetricFactorization(covarianceMatrix) if covarianceFactorization is None else covarianceFactorization
+        self.fisherFactorization = None
+
+        if not self.covarianceFactorization.invertible: return
+
+        self.inverseCovarianceU = self.covarianceFactorization.solve(matrixU)
+        self.fisherMatrix = numpy.dot(matrixU.T, self.inverseCovarianceU)
+        self.fisherMatrix = (self.fisherMatrix + self.fisherMatrix.T)/2.
+        self.fisherFactorization = SymmetricFactorization(self.fisherMatrix)
+
+        if not self.fisherFactorization.invertible: return
+
+        self.scaleFactorUncertaintyMatrix = self.fisherFactorization.inverse()
+        self.coefficientsMatrix = numpy.dot(self.scaleFactorUncertaintyMatrix, self.inverseCovarianceU.T)
+
+    @property
+    def solvable(self):
+        return self.fisherFactorization is not None and self.fisherFactorization.invertible
+
+    def combine(self, scaleFactorVector):
+        return numpy.dot(self.coefficientsMatrix, scaleFactorVector)
+
+    def inverseCovariance(self):
+        return self.covarianceFactorization.inverse()
+
+    # Residuals r = y - U*s of the measurements with respect to the combined scale factors
+    def residuals(self, scaleFactorVector, combinedScaleFactorVector):
+        return scaleFactorVector - numpy.dot(self.matrixU, combinedScaleFactorVector)
+
+    # chi2 = r^T*C^-1*r, computed from the covariance factorization
+    def chi2(self, residuals):
+        return self.covarianceFactorization.quadraticForm(residuals)
+
+    # Pulls of the measurements: the residual variance is C - U*(U^T*C^-1*U)^-1*U^T, since the
+    # combined scale factors are correlated with the measurements entering them
+    def pulls(self, residuals):
+
+        residualVariances = numpy.diag(self.covarianceMatrix) - numpy.sum(numpy.dot(self.matrixU, self.scaleFactorUncertaintyMatrix)*self.matrixU, axis=1)
+        pulls = numpy.zeros(len(residuals))
+        positiveVariances = residualVariances>0.
+        pulls[positiveVariances] = residuals[positiveVariances]/numpy.sqrt(residualVariances[positiveVariances])
+        return pulls
+
+# Toy experiments for the generalized least squares combination: the pseudo-measurements y = U*s + e are drawn
+# around the combined scale factors s, with e = L*sqrt(D)*z from the factorization C = L*D*L^T of the covariance
+# and z standard normal, and all the toys of a batch are combined with one matrix product, as the coefficient
+# matrix K doesn't depend on the measurements. Only the sums needed for the moments of the combined scale
+# factors and of the pulls are kept, together with the chi2 of each toy, so memory is bounded by the batch size
+class ToyExperiments:
+
+    def __init__(self, solver, combinedScaleFactorVector, nToys, seed, batchSize=10000):
+
+        # The noise needs the L*D*L^T factorization of the whole covariance matrix
+        covarianceFactorization = solver.covarianceFactorization
+        if not isinstance(covarianceFactorization, SymmetricFactorization): covarianceFactorization = SymmetricFactorization(solver.covarianceMatrix)
+        if not covarianceFactorization.invertible or not numpy.all(covarianceFactorization.diagonal>0.):
+            raise ValueError('covariance matrix not positive definite')
+
+        self.nToys = nToys
+        nMeasurements, nCombinedScaleFactors = solver.matrixU.shape
+
+        generator = numpy.random.default_rng(seed)
+        noiseMatrix = covarianceFactorization.lower*numpy.sqrt(covarianceFactorization.diagonal)
+        expectedMeasurements = numpy.dot(solver.matrixU, combinedScaleFactorVector)
+        inverseCovariance = solver.inverseCovariance()
+
+        combinedScaleFactorUncertainties = numpy.sqrt(numpy.diag(solver.scaleFactorUncertaintyMatrix))
+        residualVariances = numpy.diag(solver.covarianceMatrix) - numpy.sum(numpy.dot(solver.matrixU, solver.scaleFactorUncertaintyMatrix)*solver.matrixU, axis=1)
+        # Measurements alone in their pt bin have no residual, and no pull
+        self.measurementPullDefined = residualVariances>1e-09*numpy.diag(solver.covarianceMatrix)
+        residualUncertainties = numpy.where(self.measurementPullDefined, numpy.sqrt(numpy.abs(residualVariances)), numpy.inf)
+
+        self.scaleFactorDeviationSums, self.scaleFactorDeviationSquaredSums = numpy.zeros(nCombinedScaleFactors), numpy.zeros(nCombinedScaleFactors)
+        self.measurementPullSums, self.measurementPullSquaredSums = numpy.zeros(nMeasurements), numpy.zeros(nMeasurements)
+        self.chi2 = numpy.zeros(nToys)
+
+        for firstToy in range(0, nToys, batchSize):
+
+            nBatchToys = min(batchSize, nToys-firstToy)
+            toyMeasurements = expectedMeasurements[:,None] + numpy.dot(noiseMatrix, generator.standard_normal((nMeasurements, nBatchToys)))
+            toyScaleFactors = numpy.dot(solver.coefficientsMatrix, toyMeasurements)
+            toyResiduals = toyMeasurements - numpy.dot(solver.matrixU, toyScaleFactors)
+
+            scaleFactorDeviations = toyScaleFactors - combinedScaleFactorVector[:,None]
+            self.scaleFactorDeviationSums += numpy.sum(scaleFactorDeviations, axis=1)
+            self.scaleFactorDeviationSquaredSums += numpy.sum(scaleFactorDeviations*scaleFactorDeviations, axis=1)
+
+            measurementPulls = toyResiduals/residualUncertainties[:,None]
+            self.measurementPullSums += numpy.sum(measurementPulls, axis=1)
+            self.measurementPullSquaredSums += numpy.sum(measurementPulls*measurementPulls, axis=1)
+
+            self.chi2[firstToy:firstToy+nBatchToys] = numpy.einsum('it,it->t', toyResiduals, numpy.dot(inverseCovariance, toyResiduals))
+
+        self.scaleFactorBias = self.scaleFactorDeviationSums/nToys
+        self.scaleFactorUncertainties = numpy.sqrt(numpy.clip(self.scaleFactorDeviationSquaredSums/nToys - self.scaleFactorBias*self.scaleFactorBias, 0., None))
+        self.scaleFactorPullMeans = self.scaleFactorBias/combinedScaleFactorUncertainties
+        self.scaleFactorPullWidths = self.scaleFactorUncertainties/combinedScaleFactorUncertainties
+
+    # Mean and width of the pulls of a group of measurements, e.g. the measurements of one method, or None
+    # if none of them has a pull
+    def measurementPullMoments(self, measurementIndices):
+
+        measurementIndices = [ meas for meas in measurementIndices if self.measurementPullDefined[meas] ]
+        if len(measurementIndices)==0: return None
+
+        nPulls = len(measurementIndices)*self.nToys
+        pullMean = numpy.sum(self.measurementPullSums[measurementIndices])/nPulls
+        pullWidth = numpy.sqrt(max(numpy.sum(self.measurementPullSquaredSums[measurementIndices])/nPulls - pullMean*pullMean, 0.))
+        return pullMean, pullWidth
+
+    # Fraction of toys with chi2 larger than the observed one
+    def pValue(self, chi2):
+        return float(numpy.count_nonzero(self.chi2>=chi2))/self.nToys
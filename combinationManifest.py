@@ -0,0 +1,95 @@
+import os
+import json
+import pickle
+import hashlib
+
+# Bump this when the stored results change format, to invalidate the manifests
+manifestVersion = 2
+
+# Convert the inputs of a combination to plain json values, keeping the order of the dictionaries, as the
+# order of measurements and systematics changes the results. Objects, e.g. the fitting functions, are
+# described by their class name and attributes
+def canonicalForm(value):
+
+    if isinstance(value, dict):
+        return [ 'dict', [ [ canonicalForm(key), canonicalForm(item) ] for key, item in value.items() ] ]
+    if isinstance(value, (list, tuple)):
+        return [ type(value).__name__, [ canonicalForm(item) for item in value ] ]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if hasattr(value, '__dict__'):
+        return [ type(value).__name__, canonicalForm(vars(value)) ]
+    return repr(value)
+
+def hashInputs(inputs):
+    return hashlib.sha256(json.dumps([ manifestVersion, canonicalForm(inputs) ]).encode()).hexdigest()
+
+# Content hash of a set of files, e.g. the source files of the combination code
+def hashFiles(fileNames):
+
+    contentHash = hashlib.sha256()
+    for fileName in fileNames:
+        with open(fileName, 'rb') as sourceFile:
+            contentHash.update(sourceFile.read())
+    return contentHash.hexdigest()
+
+# Manifest of the combinations of a campaign: for each (algorithm, combination, working point) it records the
+# hash of the inputs and the file where the results computed from those inputs are stored, so that later runs
+# only recompute the combinations whose inputs changed
+class CombinationManifest:
+
+    def __init__(self, manifestDirectory):
+
+        self.manifestDirectory = manifestDirectory
+        self.manifestFileName = os.path.join(manifestDirectory, 'manifest.json')
+        self.entries = {}
+
+        if os.path.exists(self.manifestFileName):
+            try:
+                with open(self.manifestFileName) as manifestFile:
+                    manifest = json.load(manifestFile)
+                if manifest.get('version')==manifestVersion: self.entries = manifest['combinations']
+            except ValueError:
+                self.entries = {}
+
+    @staticmethod
+    def key(task):
+        return '/'.join(task)
+
+    def resultsFileName(self, task):
+        return os.path.join(self.manifestDirectory, '_'.join(task)+'.pickle')
+
+    # Stored results for a combination, or None if the inputs changed since they were computed
+    def load(self, task, inputHash):
+
+        entry = self.entries.get(self.key(task), None)
+        if entry is None or entry['hash']!=inputHash: return None
+
+        try:
+            with open(self.resultsFileName(task), 'rb') as resultsFile:
+                storedHash, results = pickle.load(resultsFile)
+        except Exception:
+            return None
+
+        return results if storedHash==inputHash else None
+
+    def store(self, task, inputHash, results, measurementFiles=None):
+
+        os.makedirs(self.manifestDirectory, exist_ok=True)
+
+        resultsFileName = self.resultsFileName(task)
+        temporaryFileName = resultsFileName+'.'+str(os.getpid())
+        with open(temporaryFileName, 'wb') as resultsFile:
+            pickle.dump((inputHash, results), resultsFile, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporaryFileName, resultsFileName)
+
+        self.entries[self.key(task)] = { 'hash' : inputHash, 'results' : os.path.basename(resultsFileName), 'measurementFiles' : measurementFiles or [] }
+
+    def write(self):
+
+        os.makedirs(self.manifestDirectory, exist_ok=True)
+
+        temporaryFileName = self.manifestFileName+'.'+str(os.getpid())
+        with open(temporaryFileName, 'w') as manifestFile:
+            json.dump({ 'version' : manifestVersion, 'combinations' : self.entries }, manifestFile, indent=1, sort_keys=True)
+        os.replace(temporaryFileName, self.manifestFileName)
@@ -0,0 +1,145 @@
+import os
+import re
+import csv
+import glob
+import pickle
+import hashlib
+from collections import OrderedDict
+
+# Bump this when the parsing changes, to invalidate the cached files
+cacheVersion = 2
+
+# Measurement files already parsed or hashed in this process, by absolute file name
+loadedMeasurementFiles = {}
+measurementFileHashes = {}
+
+# Find the measurement file of a method: a given version, or the last one available
+def findMeasurementFile(measurementDir, algo, wpFlag, method, version):
+
+    if version!='last':
+        measurementFileName = measurementDir+algo+'_'+method+'_'+version+'.csv'
+        if not os.path.exists(measurementFileName):
+            measurementFileName = measurementDir+algo+wpFlag+'_'+method+'_'+version+'.csv'
+        if not os.path.exists(measurementFileName):
+            return None
+
+    else:
+        measurementFileList = glob.glob(measurementDir+algo+'_'+method+'_v*.csv')
+        if len(measurementFileList)==0:
+            measurementFileList = glob.glob(measurementDir+algo+wpFlag+'_'+method+'_v*.csv')
+        if len(measurementFileList)==0:
+            return None
+
+        lastVersion = max([ int(x.split('_')[-1].replace('.csv','').replace('v','')) for x in measurementFileList ])
+        measurementFileName = measurementDir+algo+'_'+method+'_v'+str(lastVersion)+'.csv'
+
+    return measurementFileName
+
+# Content hash of a measurement file, computed at most once per run
+def measurementFileHash(fileName):
+
+    absoluteFileName = os.path.abspath(fileName)
+    if absoluteFileName not in measurementFileHashes:
+        with open(absoluteFileName, 'rb') as measurementFile:
+            measurementFileHashes[absoluteFileName] = hashlib.sha256(measurementFile.read()).hexdigest()
+
+    return measurementFileHashes[absoluteFileName]
+
+# Grammar of the formula column: a constant, optionally followed by an offset, e.g. '0.95', '0.95+0.02',
+# '0.95-2e-03', '1.0e+00+-0.02'. Both numbers accept signs and scientific notation
+numberPattern = r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?'
+formulaPattern = re.compile(r'^\s*('+numberPattern+r')\s*(?:([+-])\s*('+numberPattern+r'))?\s*$')
+
+class FormulaError(ValueError):
+    pass
+
+def decodeFormula(formula):
+
+    match = formulaPattern.match(formula)
+    if match is None:
+        raise FormulaError('cannot parse formula \''+formula+'\'')
+
+    constant, operator, offset = match.groups()
+    if operator is None: return float(constant)
+    return float(constant)+float(offset) if operator=='+' else float(constant)-float(offset)
+
+# Scale factors of a measurement file, indexed by working point, pt bin and systematic. Pt bins and
+# systematics keep the order in which they first appear in the file, and only positive values are kept
+class MeasurementFile:
+
+    def __init__(self, scaleFactors, ptRanges):
+
+        self.scaleFactors = scaleFactors
+        self.ptRanges = ptRanges
+
+    @classmethod
+    def fromContent(cls, content, fileName=''):
+
+        scaleFactors, ptRanges = OrderedDict(), {}
+        reader = csv.DictReader(content.splitlines())
+
+        for row in reader:
+
+            try:
+                measuredScaleFactor = decodeFormula(row['formula'])
+            except FormulaError as error:
+                raise FormulaError(fileName+':'+str(reader.line_num)+': '+str(error))
+
+            if measuredScaleFactor>0.:
+
+                ptMin, ptMax = float(row['ptMin']), float(row['ptMax'])
+                ptbin = 'Pt-'+str(int(ptMin))+'to'+str(int(ptMax))
+                ptRanges[ptbin] = (ptMin, ptMax)
+
+                if row['wp'] not in scaleFactors: scaleFactors[row['wp']] = OrderedDict()
+                if ptbin not in scaleFactors[row['wp']]: scaleFactors[row['wp']][ptbin] = OrderedDict()
+                scaleFactors[row['wp']][ptbin][row['syst']] = measuredScaleFactor
+
+        return cls(scaleFactors, ptRanges)
+
+    def ptbins(self, wp, maxPt):
+        return [ ptbin for ptbin in self.scaleFactors.get(wp, {}) if self.ptRanges[ptbin][0]<maxPt ]
+
+    def get(self, wp, ptbin, syst):
+        return self.scaleFactors[wp][ptbin][syst]
+
+# Load a measurement file, parsing it at most once per run. If a cache directory is given, the parsed file is
+# also stored there, keyed by file name, size, modification time and content hash, so that later runs skip
+# the csv parsing as long as the file doesn't change
+def loadMeasurementFile(fileName, cacheDirectory=None):
+
+    absoluteFileName = os.path.abspath(fileName)
+    if absoluteFileName in loadedMeasurementFiles:
+        return loadedMeasurementFiles[absoluteFileName]
+
+    with open(absoluteFileName, 'rb') as measurementFile:
+        content = measurementFile.read()
+
+    fileStat = os.stat(absoluteFileName)
+    cacheKey = (cacheVersion, absoluteFileName, fileStat.st_size, fileStat.st_mtime_ns, hashlib.sha256(content).hexdigest())
+
+    measurementData = None
+
+    if cacheDirectory:
+        cacheFileName = os.path.join(cacheDirectory, hashlib.sha1(absoluteFileName.encode()).hexdigest()+'.pickle')
+        if os.path.exists(cacheFileName):
+            try:
+                with open(cacheFileName, 'rb') as cacheFile:
+                    cachedKey, cachedData = pickle.load(cacheFile)
+                if cachedKey==cacheKey: measurementData = MeasurementFile(*cachedData)
+            except Exception:
+                measurementData = None
+
+    if measurementData is None:
+
+        measurementData = MeasurementFile.fromContent(content.decode(), fileName)
+
+        if cacheDirectory:
+            os.makedirs(cacheDirectory, exist_ok=True)
+            temporaryFileName = cacheFileName+'.'+str(os.getpid())
+            with open(temporaryFileName, 'wb') as cacheFile:
+                pickle.dump((cacheKey, (measurementData.scaleFactors, measurementData.ptRanges)), cacheFile, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporaryFileName, cacheFileName)
+
+    loadedMeasurementFiles[absoluteFileName] = measurementData
+    return measurementData
@@ -0,0 +1,264 @@
+import os
+import shutil
+import numpy
+
+# Create a plot directory, and copy the index.php file there and in its parent directory. The copy goes
+# through a temporary file renamed in place, so concurrent workers never see a partially written file
+def preparePlotDirectory(plotDirectory, indexFileName):
+
+    os.makedirs(plotDirectory, exist_ok=True)
+
+    if os.path.exists(indexFileName):
+        for directory in [ plotDirectory, os.path.dirname(os.path.normpath(plotDirectory)) ]:
+            temporaryFileName = os.path.join(directory, '.index.php.'+str(os.getpid()))
+            shutil.copyfile(indexFileName, temporaryFileName)
+            os.replace(temporaryFileName, os.path.join(directory, 'index.php'))
+
+def makeGraph(ROOT, x, ex, y, ey):
+
+    nPoints = len(x)
+    if nPoints==0: return ROOT.TGraphErrors()
+    return ROOT.TGraphErrors(nPoints, *[ numpy.ascontiguousarray(values, dtype=numpy.float64) for values in (x, y, ex, ey) ])
+
+def drawLabels(ROOT, luminosityLabel):
+
+    # Run2015B Style
+    tex = ROOT.TLatex(0.2,0.88,'CMS')
+    tex.SetNDC()
+    tex.SetTextAlign(13)
+    tex.SetTextFont(61)
+    tex.SetTextSize(0.07475)
+    tex.SetLineWidth(2)
+    tex.Draw()
+    tex1 = ROOT.TLatex(0.2,0.79,'Preliminary')
+    tex1.SetNDC()
+    tex1.SetTextAlign(13)
+    tex1.SetTextFont(52)
+    tex1.SetTextSize(0.05681)
+    tex1.SetLineWidth(2)
+    tex1.Draw()
+    text1 = ROOT.TLatex(0.98,0.95125, luminosityLabel)
+    text1.SetNDC()
+    text1.SetTextAlign(31)
+    text1.SetTextFont(42)
+    text1.SetTextSize(0.04875)
+    text1.SetLineWidth(2)
+    text1.Draw()
+    # End Run2015B Style
+
+    return [ tex, tex1, text1 ]
+
+# Draw the plot of one scale factor combination from the spec recorded by the fit: the measurements and the
+# combined scale factors in the top pad and, unless the pt-dependence fit is not plotted, the combined scale
+# factors and the fit in the bottom pad
+def renderCombinationPlot(plotSpec):
+
+    import ROOT
+    ROOT.gROOT.SetBatch(True)
+
+    plotFitOff = plotSpec['fit'] is None
+    minCombinedPt, maxCombinedPt = plotSpec['ptRange']
+
+    canvasHight = 350 if plotFitOff else 700
+    c1 = ROOT.TCanvas('c1','plots',200,0,700,canvasHight)
+    c1.SetFillColor(10)
+    c1.SetFillStyle(4000)
+    c1.SetBorderSize(2)
+
+    padHight = 0.03 if plotFitOff else 0.52
+    pad1 = ROOT.TPad('pad1','This is pad1',0.02,padHight,0.98,0.98,21)
+
+    # Run2015B Setting
+    ROOT.gStyle.SetOptFit(0)
+    ROOT.gStyle.SetOptStat(0)
+    ROOT.gStyle.SetOptTitle(0)
+    c1.Range(0,0,1,1)
+    c1.SetFillColor(10)
+    c1.SetBorderMode(0)
+    c1.SetBorderSize(2)
+    c1.SetTickx(1)
+    c1.SetTicky(1)
+    c1.SetLeftMargin(0.16)
+    c1.SetRightMargin(0.02)
+    c1.SetTopMargin(0.05)
+    c1.SetBottomMargin(0.13)
+    c1.SetFrameFillColor(0)
+    c1.SetFrameFillStyle(0)
+    c1.SetFrameBorderMode(0)
+
+    pad1.SetFillColor(0)
+    pad1.SetBorderMode(0)
+    pad1.SetBorderSize(2)
+    #pad1.SetLogy()
+    pad1.SetLogx()
+    pad1.SetTickx(1)
+    pad1.SetTicky(1)
+    pad1.SetLeftMargin(0.16)
+    pad1.SetRightMargin(0.02)
+    pad1.SetTopMargin(0.065)
+    pad1.SetBottomMargin(0.13)
+    pad1.SetFrameFillStyle(0)
+    pad1.SetFrameBorderMode(0)
+    pad1.SetFrameFillStyle(0)
+    pad1.SetFrameBorderMode(0)
+    pad1.Draw()
+
+    if not plotFitOff:
+
+        pad2 = ROOT.TPad('pad2','This is pad2',0.02,    0.03,0.98,0.49,21)
+
+        pad2.SetFillColor(0)
+        pad2.SetBorderMode(0)
+        pad2.SetBorderSize(2)
+        #pad2.SetGridy()
+        pad2.SetLogx()
+        pad2.SetTickx(1)
+        pad2.SetTicky(1)
+        pad2.SetLeftMargin(0.16)
+        pad2.SetRightMargin(0.02)
+        #pad2.SetTopMargin(0.05)
+        #pad2.SetBottomMargin(0.31)
+        pad2.SetTopMargin(0.065)
+        pad2.SetBottomMargin(0.13)
+        pad2.SetFrameFillStyle(0)
+        pad2.SetFrameBorderMode(0)
+        pad2.SetFrameFillStyle(0)
+        pad2.SetFrameBorderMode(0)
+        pad2.Draw()
+        # End Run2015B Setting
+
+    # Build the graphs of the single measurements
+    graphScaleFactors, graphScaleFactorsTotal = [], []
+
+    for measurement in plotSpec['measurements']:
+
+        graphMetod      = makeGraph(ROOT, measurement['x'], measurement['ex'], measurement['y'], measurement['eyStatistic'])
+        graphMetodTotal = makeGraph(ROOT, measurement['x'], measurement['ex'], measurement['y'], measurement['eyTotal'])
+
+        graphMetod.SetFillColor(measurement['color']);    graphMetodTotal.SetFillColor(measurement['color']);
+        graphMetod.SetMarkerStyle(measurement['marker']); graphMetodTotal.SetMarkerStyle(measurement['marker']);
+        graphMetod.SetMarkerColor(measurement['color']);  graphMetodTotal.SetMarkerColor(measurement['color']);
+        graphMetod.SetMarkerSize(measurement['size']);    graphMetodTotal.SetMarkerSize(measurement['size']);
+        graphMetod.SetLineStyle(1);                       graphMetodTotal.SetLineStyle(1);
+        graphMetod.SetLineColor(measurement['color']);    graphMetodTotal.SetLineColor(measurement['color']);
+        graphMetod.SetLineWidth(measurement['width']);    graphMetodTotal.SetLineWidth(1);
+
+        graphScaleFactors.append(graphMetod)
+        graphScaleFactorsTotal.append(graphMetodTotal)
+
+    combined = plotSpec['combined']
+    graphCombinedScaleFactors = makeGraph(ROOT, combined['x'], combined['ex'], combined['y'], combined['ey'])
+
+    # Plot the measurements in the top pad
+    pad1.cd()
+
+    histo = ROOT.TH2F('histo','',58,minCombinedPt,maxCombinedPt,100,1.-plotSpec['widthYAxis'],1.+plotSpec['widthYAxis'])
+    histo.SetLabelSize(0.05, 'XYZ')
+    histo.SetTitleSize(0.06, 'XYZ')
+    histo.SetLabelFont(42, 'XYZ')
+    histo.SetTitleFont(42, 'XYZ')
+    #histo.GetXaxis().SetTitle('Jet p_{T} [GeV]')
+    histo.GetXaxis().SetTitle('p_{T} [GeV]')
+    #histo.GetYaxis().SetTitle('Data/Simulation SF_{b}')
+    histo.GetYaxis().SetTitle('SF_{b}')
+    #histo.SetTitleOffset(1.1,'X') # Ideal for .png
+    histo.SetTitleOffset(0.95,'X')
+    histo.SetTitleOffset(0.8,'Y')
+    histo.SetTickLength(0.06,'X')
+    histo.SetNdivisions(509, 'XYZ')
+    histo.GetXaxis().SetMoreLogLabels()
+    histo.GetXaxis().SetNoExponent()
+    histo.Draw('')
+
+    for graph in graphScaleFactors: graph.Draw('P')
+    for graph in graphScaleFactorsTotal: graph.Draw('P')
+
+    labels = drawLabels(ROOT, plotSpec['luminosityLabel'])
+
+    # Print the combination result in the top pad
+    graphCombinedScaleFactors.SetFillStyle(3005)
+    graphCombinedScaleFactors.SetFillColor(ROOT.kGray+3)
+    graphCombinedScaleFactors.Draw('e2')
+
+    # Add legend
+    leg1 = ROOT.TLegend(0.48,0.64,0.70,0.89)
+    leg1.SetBorderSize(0)
+    leg1.SetFillColor(ROOT.kWhite)
+    leg1.SetTextFont(62)
+    leg1.SetHeader(plotSpec['header'])
+    leg1.SetNColumns(int((len(graphScaleFactors))/3)+1)
+
+    for graph, measurement in zip(graphScaleFactors, plotSpec['measurements']):
+        leg1.AddEntry(graph, measurement['legname'], 'PL')
+    leg1.AddEntry(graphCombinedScaleFactors,'weighted average','PF')
+
+    leg1.SetY1(0.89 - 0.25*leg1.GetNRows()/4)
+    if leg1.GetNColumns()>1: leg1.SetX2(0.92)
+    if leg1.GetNColumns()>2:
+        leg1.SetX1(0.36)
+        leg1.SetX2(0.95)
+    leg1.Draw()
+
+    # Superimpose the single measurements on the combination and legend
+    for graph in graphScaleFactors: graph.Draw('P')
+    for graph in graphScaleFactorsTotal: graph.Draw('P')
+
+    # Now plotting the combination in the bottom pad
+    if not plotFitOff:
+
+        fit = plotSpec['fit']
+
+        pad2.cd()
+        histo.Draw('')
+        graphCombinedScaleFactors.Draw('e2')
+
+        fittingFunction = ROOT.TF1('fittingFunction', fit['formula'], fit['minPt'], fit['maxPt'])
+        for par, parameter in enumerate(fit['parameters']): fittingFunction.SetParameter(par, parameter)
+        fittingFunction.SetLineColor(ROOT.kBlack)
+        fittingFunction.SetLineWidth(2)
+        fittingFunction.SetLineStyle(1)
+
+        # Add the functions values to the bottom pad
+        graphFittedScaleFactors = makeGraph(ROOT, fit['x'], fit['ex'], fit['y'], fit['ey'])
+
+        graphFittedScaleFactors.SetMarkerColor(ROOT.kRed)
+        graphFittedScaleFactors.SetLineColor(ROOT.kRed)
+        graphFittedScaleFactors.SetLineStyle(1)
+        graphFittedScaleFactors.SetMarkerStyle(24)
+        graphFittedScaleFactors.SetMarkerSize(0.001)
+        graphFittedScaleFactors.SetLineWidth(2)
+        graphFittedScaleFactors.Draw('P')
+        fittingFunction.SetMarkerColor(1)
+        fittingFunction.Draw('same')
+
+        # Add legend
+        leg2 = ROOT.TLegend(0.48,0.64,0.70,0.89)
+        leg2.SetBorderSize(0)
+        leg2.SetFillColor(ROOT.kWhite)
+        leg2.SetTextFont(62)
+        leg2.SetTextSize(0.05)
+        leg2.SetHeader(plotSpec['header'])
+        leg2.AddEntry(graphCombinedScaleFactors,'weighted average','PF')
+        leg2.AddEntry(fittingFunction,'fit','L')
+        leg2.AddEntry(graphFittedScaleFactors,'fit #pm (stat #oplus syst)','LE')
+        leg2.Draw()
+
+        labels += drawLabels(ROOT, plotSpec['luminosityLabel'])
+
+    # Save plots
+    preparePlotDirectory(plotSpec['plotDirectory'], plotSpec['indexFileName'])
+
+    for plotFormat in plotSpec['plotFormats']:
+        c1.Print(os.path.join(plotSpec['plotDirectory'], plotSpec['plotName']+'.'+plotFormat))
+
+    del c1
+
+def plotFilesExist(plotSpec):
+    return all([ os.path.exists(os.path.join(plotSpec['plotDirectory'], plotSpec['plotName']+'.'+plotFormat)) for plotFormat in plotSpec['plotFormats'] ])
+
+# Draw the queued plots, in the worker pool if one is given
+def renderPlots(plotSpecs, pool=None):
+
+    if pool is not None: pool.map(renderCombinationPlot, plotSpecs)
+    else:
+        for plotSpec in plotSpecs: renderCombinationPlot(plotSpec)
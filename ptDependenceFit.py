@@ -0,0 +1,337 @@
+import re
+import numpy
+
+class PtFitError(Exception):
+    pass
+
+# Weighted linear least squares for the functions linear in (some of) their parameters: the basis functions
+# are the columns of basisMatrix, and the weights come from the covariance matrix of the points
+def linearLeastSquares(basisMatrix, y, covarianceMatrix):
+
+    whitening = numpy.linalg.inv(numpy.linalg.cholesky(covarianceMatrix))
+    return numpy.linalg.lstsq(numpy.dot(whitening, basisMatrix), numpy.dot(whitening, y), rcond=None)[0]
+
+# Functional families of the pt-dependence fit used in the campaigns. Each family gives the function value,
+# the analytic Jacobian with respect to the parameters, the derivative in pt and its Jacobian (for the
+# effective variance of the pt bin widths), the allowed range of the parameters, a starting point, and
+# the integral over pt ranges
+class PtFunctionFamily:
+
+    formulas = []
+    nParameters = 0
+
+    # Integral over the ranges [minPt, maxPt], for arrays of ranges, with Gauss-Legendre quadrature, which is
+    # exact for polynomials up to degree 2*nPoints-1. Families with a closed-form primitive override it
+    def integral(self, parameters, minPt, maxPt, nPoints=8):
+
+        nodes, weights = numpy.polynomial.legendre.leggauss(nPoints)
+        halfWidth, center = (maxPt-minPt)/2., (maxPt+minPt)/2.
+        points = center[:,None] + halfWidth[:,None]*nodes[None,:]
+        return halfWidth*numpy.dot(self.value(parameters, points.ravel()).reshape(points.shape), weights)
+
+    def bounds(self, minPt, maxPt):
+        return [ -numpy.inf ]*self.nParameters, [ numpy.inf ]*self.nParameters
+
+    def startingParameters(self, x, y, covarianceMatrix, initialParameters, minPt, maxPt):
+        return initialParameters
+
+# Primitive of [0]+[1]*L+[2]*L*L with L = log(x): [0]*x + [1]*x*(L-1) + [2]*x*(L*L-2*L+2)
+def logQuadraticPrimitive(parameters, x):
+
+    logPt = numpy.log(x)
+    return x*(parameters[0] + parameters[1]*(logPt - 1.) + parameters[2]*(logPt*logPt - 2.*logPt + 2.))
+
+# [0]+[1]*log(x)+[2]*log(x)*log(x)
+class LogQuadratic(PtFunctionFamily):
+
+    formulas = [ '[0]+[1]*log(x)+[2]*log(x)*log(x)', '[0]+[1]*log(x)+[2]*log(x)^2' ]
+    nParameters = 3
+
+    def value(self, parameters, x):
+        logPt = numpy.log(x)
+        return parameters[0] + parameters[1]*logPt + parameters[2]*logPt*logPt
+
+    def jacobian(self, parameters, x):
+        logPt = numpy.log(x)
+        return numpy.column_stack([ numpy.ones(len(x)), logPt, logPt*logPt ])
+
+    def derivative(self, parameters, x):
+        return (parameters[1] + 2.*parameters[2]*numpy.log(x))/x
+
+    def derivativeJacobian(self, parameters, x):
+        return numpy.column_stack([ numpy.zeros(len(x)), 1./x, 2.*numpy.log(x)/x ])
+
+    def integral(self, parameters, minPt, maxPt):
+        return logQuadraticPrimitive(parameters, maxPt) - logQuadraticPrimitive(parameters, minPt)
+
+    def startingParameters(self, x, y, covarianceMatrix, initialParameters, minPt, maxPt):
+        return linearLeastSquares(self.jacobian(initialParameters, x), y, covarianceMatrix)
+
+# [0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3]), with [3] below the fit range, by at most its width: further
+# below, the function is almost flat in [3], which drifts to large negative values without improving the fit.
+# The pole of the logarithm is kept at least half of the lower edge below it, so that the function stays smooth
+# over all the range written in the csv files
+class ShiftedLogQuadratic(PtFunctionFamily):
+
+    formulas = [ '[0]+[1]*log(x-[3])+[2]*log(x-[3])*log(x-[3])', '[0]+[1]*log(x-[3])+[2]*log(x-[3])^2' ]
+    nParameters = 4
+
+    def value(self, parameters, x):
+        logPt = numpy.log(x-parameters[3])
+        return parameters[0] + parameters[1]*logPt + parameters[2]*logPt*logPt
+
+    def jacobian(self, parameters, x):
+        logPt = numpy.log(x-parameters[3])
+        return numpy.column_stack([ numpy.ones(len(x)), logPt, logPt*logPt, -(parameters[1] + 2.*parameters[2]*logPt)/(x-parameters[3]) ])
+
+    def derivative(self, parameters, x):
+        return (parameters[1] + 2.*parameters[2]*numpy.log(x-parameters[3]))/(x-parameters[3])
+
+    def derivativeJacobian(self, parameters, x):
+        shiftedPt = x-parameters[3]
+        logPt = numpy.log(shiftedPt)
+        return numpy.column_stack([ numpy.zeros(len(x)), 1./shiftedPt, 2.*logPt/shiftedPt, (parameters[1] + 2.*parameters[2]*(logPt-1.))/(shiftedPt*shiftedPt) ])
+
+    def integral(self, parameters, minPt, maxPt):
+        return logQuadraticPrimitive(parameters, maxPt-parameters[3]) - logQuadraticPrimitive(parameters, minPt-parameters[3])
+
+    def bounds(self, minPt, maxPt):
+        return [ -numpy.inf ]*3 + [ minPt - (maxPt - minPt) ], [ numpy.inf ]*3 + [ minPt - 0.5*max(1., abs(minPt)) ]
+
+    # The function is linear in [0], [1], and [2] for a given [3]
+    def startingParameters(self, x, y, covarianceMatrix, initialParameters, minPt, maxPt):
+        shift = min(initialParameters[3], self.bounds(minPt, maxPt)[1][3] - 1.)
+        return numpy.append(linearLeastSquares(self.jacobian(numpy.array([ 0., 0., 0., shift ]), x)[:,:3], y, covarianceMatrix), shift)
+
+# [0]*(1.+[1]*x)/(1.+[2]*x), without poles in the fit range
+class Rational(PtFunctionFamily):
+
+    formulas = [ '[0]*(1.+[1]*x)/(1.+[2]*x)', '[0]*(1+[1]*x)/(1+[2]*x)' ]
+    nParameters = 3
+
+    def value(self, parameters, x):
+        return parameters[0]*(1. + parameters[1]*x)/(1. + parameters[2]*x)
+
+    def jacobian(self, parameters, x):
+        denominator = 1. + parameters[2]*x
+        return numpy.column_stack([ (1. + parameters[1]*x)/denominator, parameters[0]*x/denominator, -parameters[0]*x*(1. + parameters[1]*x)/(denominator*denominator) ])
+
+    def derivative(self, parameters, x):
+        denominator = 1. + parameters[2]*x
+        return parameters[0]*(parameters[1] - parameters[2])/(denominator*denominator)
+
+    def derivativeJacobian(self, parameters, x):
+        denominator = 1. + parameters[2]*x
+        return numpy.column_stack([ (parameters[1] - parameters[2])/(denominator*denominator), parameters[0]/(denominator*denominator),
+                                    -parameters[0]/(denominator*denominator) - 2.*parameters[0]*(parameters[1] - parameters[2])*x/(denominator*denominator*denominator) ])
+
+    def bounds(self, minPt, maxPt):
+        return [ -numpy.inf, -numpy.inf, -(1. - 1e-03)/maxPt ], [ numpy.inf, numpy.inf, numpy.inf ]
+
+    # Without starting values from the campaign, start from the straight line [0]*(1+[1]*x)
+    def startingParameters(self, x, y, covarianceMatrix, initialParameters, minPt, maxPt):
+
+        if numpy.any(initialParameters!=0.): return initialParameters
+
+        intercept, slope = linearLeastSquares(numpy.column_stack([ numpy.ones(len(x)), x ]), y, covarianceMatrix)
+        return numpy.array([ intercept, slope/intercept if intercept!=0. else 0., 0. ])
+
+# [0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))
+class LogProduct(PtFunctionFamily):
+
+    formulas = [ '[0]+[1]*log(x+19)*log(x+18)*(3-[2]*log(x+18))' ]
+    nParameters = 3
+
+    def value(self, parameters, x):
+        logProduct, logPt = numpy.log(x+19.)*numpy.log(x+18.), numpy.log(x+18.)
+        return parameters[0] + parameters[1]*logProduct*(3. - parameters[2]*logPt)
+
+    def jacobian(self, parameters, x):
+        logProduct, logPt = numpy.log(x+19.)*numpy.log(x+18.), numpy.log(x+18.)
+        return numpy.column_stack([ numpy.ones(len(x)), logProduct*(3. - parameters[2]*logPt), -parameters[1]*logProduct*logPt ])
+
+    def derivative(self, parameters, x):
+        logProduct, logPt = numpy.log(x+19.)*numpy.log(x+18.), numpy.log(x+18.)
+        logProductDerivative = numpy.log(x+18.)/(x+19.) + numpy.log(x+19.)/(x+18.)
+        return parameters[1]*(logProductDerivative*(3. - parameters[2]*logPt) - parameters[2]*logProduct/(x+18.))
+
+    def derivativeJacobian(self, parameters, x):
+        logProduct, logPt = numpy.log(x+19.)*numpy.log(x+18.), numpy.log(x+18.)
+        logProductDerivative = numpy.log(x+18.)/(x+19.) + numpy.log(x+19.)/(x+18.)
+        return numpy.column_stack([ numpy.zeros(len(x)), logProductDerivative*(3. - parameters[2]*logPt) - parameters[2]*logProduct/(x+18.),
+                                    -parameters[1]*(logProductDerivative*logPt + logProduct/(x+18.)) ])
+
+    # The function is [0] + c1*log(x+19)*log(x+18) + c2*log(x+19)*log(x+18)^2, with c1 = 3*[1] and c2 = -[1]*[2]
+    def startingParameters(self, x, y, covarianceMatrix, initialParameters, minPt, maxPt):
+
+        logProduct, logPt = numpy.log(x+19.)*numpy.log(x+18.), numpy.log(x+18.)
+        constant, linear, quadratic = linearLeastSquares(numpy.column_stack([ numpy.ones(len(x)), logProduct, logProduct*logPt ]), y, covarianceMatrix)
+        if linear==0.: return initialParameters
+        return numpy.array([ constant, linear/3., -3.*quadratic/linear ])
+
+functionFamilies = [ LogQuadratic(), ShiftedLogQuadratic(), Rational(), LogProduct() ]
+
+def normalizedFormula(formula):
+    return formula.replace(' ', '')
+
+# Family of a campaign fitting function formula, or None if there is no native fit for it
+def functionFamily(formula):
+
+    for family in functionFamilies:
+        if normalizedFormula(formula) in family.formulas: return family
+    return None
+
+# Result of the pt-dependence fit: the parameters with their covariance, the chi2, and the function with the
+# fitted parameters, which can be evaluated and written as a formula string in the same format as the one
+# of TF1::GetExpFormula('p'). If the fit is not converged, failure gives the reason, and there is no covariance
+class PtFitResult:
+
+    def __init__(self, family, formula, parameters, parameterCovariance, chi2, ndf, minPt, maxPt, failure=None):
+
+        self.family = family
+        self.failure = failure
+        self.converged = failure is None
+        self.formulaTemplate = normalizedFormula(formula)
+        self.parameters = numpy.array(parameters, dtype=float)
+        self.parameterCovariance = parameterCovariance
+        self.chi2, self.ndf = chi2, ndf
+        self.minPt, self.maxPt = minPt, maxPt
+
+    def formula(self):
+        return re.sub(r'\[(\d+)\]', lambda parameter: '%g' % self.parameters[int(parameter.group(1))], self.formulaTemplate)
+
+    def evaluate(self, x):
+        return self.family.value(self.parameters, numpy.atleast_1d(numpy.asarray(x, dtype=float)))
+
+    # Averages of the function over the ranges [minPt, maxPt], for arrays of ranges
+    def averages(self, minPt, maxPt):
+        minPt, maxPt = numpy.asarray(minPt, dtype=float), numpy.asarray(maxPt, dtype=float)
+        return self.family.integral(self.parameters, minPt, maxPt)/(maxPt-minPt)
+
+    # The fitted scale factor of a pt bin, written in the csv files and plotted, is the average of the function
+    # within 1 GeV of the bin centre. They are computed once for all the pt bins, and kept in binAverages
+    def cacheBinAverages(self, midPt):
+        self.binAverages = self.averages(midPt-1., midPt+1.)
+
+# Same interface for a TF1 fitted with ROOT
+class RootFitResult:
+
+    def __init__(self, tf1, formula, minPt, maxPt):
+
+        self.tf1 = tf1
+        self.formulaTemplate = normalizedFormula(formula)
+        self.parameters = numpy.array([ tf1.GetParameter(par) for par in range(tf1.GetNpar()) ], dtype=float)
+        self.parameterCovariance, self.failure, self.converged = None, None, True
+        self.chi2, self.ndf = tf1.GetChisquare(), tf1.GetNDF()
+        self.minPt, self.maxPt = minPt, maxPt
+
+    def formula(self):
+        return str(self.tf1.GetExpFormula('p'))
+
+    def evaluate(self, x):
+        return numpy.array([ self.tf1.Eval(float(value)) for value in numpy.atleast_1d(x) ])
+
+    def averages(self, minPt, maxPt):
+        return numpy.array([ self.tf1.Integral(float(low), float(high))/(high-low) for low, high in zip(minPt, maxPt) ])
+
+    def cacheBinAverages(self, midPt):
+        self.binAverages = self.averages(midPt-1., midPt+1.)
+
+# chi2 = r^T*W^-1*r of the fit, with W = V + diag((f'(x)*ex)^2), and its gradient: the effective variance
+# depends on the parameters through f'(x), so its derivative enters the gradient as well
+def fitChi2(family, parameters, x, ex, y, covarianceMatrix):
+
+    slopeUncertainties = family.derivative(parameters, x)*ex
+    effectiveCovariance = covarianceMatrix + numpy.diag(slopeUncertainties*slopeUncertainties)
+    residuals = y - family.value(parameters, x)
+
+    factorization = numpy.linalg.cholesky(effectiveCovariance)
+    weightedResiduals = numpy.linalg.solve(factorization.T, numpy.linalg.solve(factorization, residuals))
+    chi2 = float(numpy.dot(residuals, weightedResiduals))
+
+    jacobian = family.jacobian(parameters, x)
+    gradient = -2.*numpy.dot(jacobian.T, weightedResiduals) - 2.*numpy.dot((weightedResiduals*weightedResiduals*slopeUncertainties*ex), family.derivativeJacobian(parameters, x))
+
+    return chi2, gradient, jacobian, factorization
+
+# Fit the combined scale factors y, at the pt bin centres x with half widths ex, with the campaign fitting
+# function, minimizing r^T*W^-1*r with the residuals r = y - f(x). The covariance V of the points is either
+# diagonal or the full bin-to-bin covariance of the combined scale factors, and the pt bin widths are taken
+# into account as an effective variance (f'(x)*ex)^2 added to its diagonal, as ROOT does for TGraphErrors.
+# The minimization is a Levenberg-Marquardt iteration with the exact gradient and the Gauss-Newton
+# approximation of the Hessian, 2*J^T*W^-1*J, whose inverse gives the parameter covariance
+def fitPtDependence(fittingFunction, x, ex, y, covarianceMatrix, minPt, maxPt, maxIterations=1000, tolerance=1e-12, singularityThreshold=1e-10):
+
+    family = functionFamily(fittingFunction.formula)
+    if family is None:
+        raise PtFitError('no native fit for the function '+fittingFunction.formula)
+
+    x, ex, y = numpy.asarray(x, dtype=float), numpy.asarray(ex, dtype=float), numpy.asarray(y, dtype=float)
+    if len(x)<family.nParameters:
+        raise PtFitError('not enough pt bins to fit the function '+fittingFunction.formula)
+
+    initialParameters = numpy.zeros(family.nParameters)
+    nInitialParameters = min(family.nParameters, len(fittingFunction.parameters))
+    initialParameters[:nInitialParameters] = fittingFunction.parameters[:nInitialParameters]
+
+    # The parameters are kept strictly inside the bounds, by a small margin
+    lowerBounds, upperBounds = [ numpy.array(bounds, dtype=float) for bounds in family.bounds(minPt, maxPt) ]
+    lowerMargins, upperMargins = [ numpy.where(numpy.isfinite(bounds), 1e-06*numpy.maximum(1., numpy.abs(bounds)), 0.) for bounds in [ lowerBounds, upperBounds ] ]
+    lowerLimits, upperLimits = lowerBounds + lowerMargins, upperBounds - upperMargins
+
+    parameters = numpy.clip(family.startingParameters(x, y, covarianceMatrix, initialParameters, minPt, maxPt), lowerLimits, upperLimits)
+    chi2, gradient, jacobian, factorization = fitChi2(family, parameters, x, ex, y, covarianceMatrix)
+    damping, failure = 1e-03, 'maximum number of iterations reached'
+
+    for iteration in range(maxIterations):
+
+        whitenedJacobian = numpy.linalg.solve(factorization, jacobian)
+        hessian = 2.*numpy.dot(whitenedJacobian.T, whitenedJacobian)
+        hessianScale = numpy.maximum(numpy.diag(hessian), 1e-300)
+
+        # Increase the damping until a step lowers the chi2
+        while damping<1e+20:
+            step = numpy.linalg.solve(hessian + damping*numpy.diag(hessianScale), -gradient)
+            newParameters = numpy.clip(parameters + step, lowerLimits, upperLimits)
+            try:
+                newChi2, newGradient, newJacobian, newFactorization = fitChi2(family, newParameters, x, ex, y, covarianceMatrix)
+            except numpy.linalg.LinAlgError:
+                newChi2 = numpy.inf
+            if numpy.isfinite(newChi2) and newChi2<=chi2: break
+            damping *= 10.
+
+        if damping>=1e+20:
+            failure = 'no step lowers the chi2'
+            break
+
+        converged = chi2-newChi2<=tolerance*max(chi2, 1.) and numpy.all(numpy.abs(newParameters-parameters)<=1e-09*numpy.maximum(numpy.abs(parameters), 1e-06))
+        parameters, chi2, gradient, jacobian, factorization = newParameters, newChi2, newGradient, newJacobian, newFactorization
+        damping = max(damping/10., 1e-12)
+        if converged:
+            failure = None
+            break
+
+    # A fit that ends with a parameter at its bound, which usually also stops it from converging, is not at a
+    # minimum of the function, and the Hessian doesn't give its uncertainties
+    if numpy.any((parameters<=lowerLimits+lowerMargins) | (parameters>=upperLimits-upperMargins)):
+        failure = 'parameter at its bound'
+
+    # The parameters of the campaign functions can be strongly correlated and on very different scales, so the
+    # columns of the Jacobian are normalized before the inversion. A singular Jacobian, with the columns scaled by
+    # the size of the parameters, means that some parameters are not constrained by the fit
+    whitenedJacobian = numpy.linalg.solve(factorization, jacobian)
+    singularValues = numpy.linalg.svd(whitenedJacobian*numpy.maximum(numpy.abs(parameters), 1.), compute_uv=False)
+    if failure is None and not singularValues[-1]>singularityThreshold*singularValues[0]:
+        failure = 'parameters not constrained'
+
+    # The fits that are not converged are returned without parameter covariance
+    if failure is not None:
+        return PtFitResult(family, fittingFunction.formula, parameters, None, chi2, len(x)-family.nParameters, minPt, maxPt, failure)
+
+    columnNorms = numpy.linalg.norm(whitenedJacobian, axis=0)
+    columnNorms[columnNorms==0.] = 1.
+    normalizedJacobian = whitenedJacobian/columnNorms
+    parameterCovariance = numpy.linalg.inv(numpy.dot(normalizedJacobian.T, normalizedJacobian))
+    parameterCovariance /= numpy.outer(columnNorms, columnNorms)
+
+    return PtFitResult(family, fittingFunction.formula, parameters, parameterCovariance, chi2, len(x)-family.nParameters, minPt, maxPt)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import os
+import json
+import optparse
+import resultsStore
+
+# Format a value of a query row for printing
+def formatValue(value, column):
+
+    if value is None: return '-'
+    if isinstance(value, float): return '%.4f' % value
+    if column in [ 'ptFitParameters', 'ptFitUncertainties' ]: return ', '.join([ '%g' % parameter for parameter in json.loads(value) ])
+    return str(value)
+
+# Print the rows of a query as a table, with aligned columns
+def printTable(columns, rows):
+
+    if len(rows)==0:
+        print('No results found')
+        return
+
+    cells = [ columns ] + [ [ formatValue(value, column) for value, column in zip(row, columns) ] for row in rows ]
+    widths = [ max([ len(line[column]) for line in cells ]) for column in range(len(columns)) ]
+
+    for line in cells:
+        print('  '.join([ cell.ljust(width) for cell, width in zip(line, widths) ]).rstrip())
+
+if __name__ == '__main__':
+
+    # Input parameters
+    usage = 'usage: %prog [options]'
+    parser = optparse.OptionParser(usage)
+    parser.add_option('--resultsdb'      , dest='resultsdb'      , help='Database of the combination results', default='./CombinationResults.sqlite')
+    parser.add_option('--table'          , dest='table'          , help='Table: '+', '.join(resultsStore.queryTables), default='scalefactors')
+    parser.add_option('--campaign'       , dest='campaign'       , help='Campaigns, comma separated'     , default='all')
+    parser.add_option('--algorithm'      , dest='algorithm'      , help='Algorithms, comma separated'    , default='all')
+    parser.add_option('--combination'    , dest='combination'    , help='Combinations, comma separated'  , default='all')
+    parser.add_option('--workingpoint'   , dest='workingpoint'   , help='Working points, comma separated', default='all')
+    parser.add_option('--ptbin'          , dest='ptbin'          , help='Pt bins, e.g. Pt-50to70'        , default='all')
+    parser.add_option('--masked'         , dest='masked'         , help='Vetoed or masked methods, or none', default='')
+    parser.add_option('--joint'          , dest='joint'          , help='Results of the joint combinations', default=False, action='store_true')
+    parser.add_option('--allruns'        , dest='allruns'        , help='Results of all runs, not the last', default=False, action='store_true')
+    (opt, args) = parser.parse_args()
+
+    selections = [ [] if selection=='all' else selection.split(',') for selection in [ opt.campaign, opt.algorithm, opt.combination, opt.workingpoint, opt.ptbin ] ]
+    maskedMethods = [ method for method in opt.masked.split(',') if method!='' ]
+
+    if not os.path.exists(opt.resultsdb):
+        print('Error: results database', opt.resultsdb, 'not found')
+        exit()
+
+    try:
+        store = resultsStore.ResultsStore(opt.resultsdb)
+        rows = store.query(opt.table, *selections, maskedMethods=maskedMethods, joint=opt.joint, allRuns=opt.allruns)
+    except resultsStore.ResultsStoreError as error:
+        print('Error:', error)
+        exit()
+
+    printTable(resultsStore.queryTables[opt.table], rows)
+    store.close()
@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import sqlite3
+
+# Bump this when the tables change, as older databases can't be read anymore
+resultsStoreVersion = 1
+
+resultsStoreSchema = [
+    'CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, time TEXT, campaign TEXT, jointCampaigns TEXT, code TEXT, options TEXT)',
+    'CREATE TABLE IF NOT EXISTS combinations (combination INTEGER PRIMARY KEY, run INTEGER, campaign TEXT, algo TEXT, comb TEXT, wp TEXT, '
+    'jointCampaigns TEXT, vetoedMethods TEXT, maskedMethods TEXT, inputHash TEXT, nMeasurements INTEGER, normalizedChi2 REAL, '
+    'ptFitFormula TEXT, ptFitParameters TEXT, ptFitUncertainties TEXT, ptFitChi2 REAL, ptFitNdf INTEGER)',
+    'CREATE TABLE IF NOT EXISTS scaleFactors (combination INTEGER, campaign TEXT, algo TEXT, comb TEXT, wp TEXT, ptbin TEXT, '
+    'ptMin REAL, ptMax REAL, scaleFactor REAL, uncertainty REAL, fittedScaleFactor REAL)',
+    'CREATE TABLE IF NOT EXISTS breakdowns (combination INTEGER, campaign TEXT, algo TEXT, comb TEXT, wp TEXT, ptbin TEXT, category TEXT, uncertainty REAL)',
+    'CREATE INDEX IF NOT EXISTS combinationsIndex ON combinations (campaign, algo, comb, wp)',
+    'CREATE INDEX IF NOT EXISTS scaleFactorsIndex ON scaleFactors (campaign, algo, comb, wp, ptbin)',
+    'CREATE INDEX IF NOT EXISTS scaleFactorsCombinationIndex ON scaleFactors (combination)',
+    'CREATE INDEX IF NOT EXISTS breakdownsIndex ON breakdowns (campaign, algo, comb, wp, ptbin)',
+    'CREATE INDEX IF NOT EXISTS breakdownsCombinationIndex ON breakdowns (combination)' ]
+
+# Columns returned by the queries of each table
+queryTables = { 'scalefactors' : [ 'campaign', 'algo', 'comb', 'wp', 'ptbin', 'scaleFactor', 'uncertainty', 'fittedScaleFactor', 'vetoedMethods', 'maskedMethods' ],
+                'breakdowns'   : [ 'campaign', 'algo', 'comb', 'wp', 'ptbin', 'category', 'uncertainty', 'vetoedMethods', 'maskedMethods' ],
+                'chi2'         : [ 'campaign', 'algo', 'comb', 'wp', 'nMeasurements', 'normalizedChi2', 'ptFitChi2', 'ptFitNdf', 'vetoedMethods', 'maskedMethods' ],
+                'ptfit'        : [ 'campaign', 'algo', 'comb', 'wp', 'ptFitFormula', 'ptFitParameters', 'ptFitUncertainties', 'vetoedMethods', 'maskedMethods' ],
+                'runs'         : [ 'run', 'time', 'campaign', 'jointCampaigns', 'code', 'options' ] }
+
+class ResultsStoreError(Exception):
+    pass
+
+# Pt range of a pt bin label, e.g. Pt-50to70
+def ptRange(ptbin):
+    return float(ptbin.split('-')[1].split('to')[0]), float(ptbin.split('to')[1])
+
+def methodList(methods):
+    return ','.join(sorted(set(methods)))
+
+# Results of the combinations kept in a SQLite database: each run adds a row to the runs table, and for each
+# combination a row to the combinations table, with the input hash, the normalized chi2 and the pt-dependence
+# fit, the combined scale factors of its pt bins to the scaleFactors table, and their uncertainty breakdowns
+# to the breakdowns table. The rows of the last two tables repeat the campaign, algorithm, combination,
+# working point, and pt bin, so that the selections of the queries go through their indexes, and are only
+# joined to the combinations for the masks. The results are committed together at the end of the run
+class ResultsStore:
+
+    def __init__(self, fileName):
+
+        if os.path.dirname(fileName)!='': os.makedirs(os.path.dirname(fileName), exist_ok=True)
+
+        try:
+            self.connection = sqlite3.connect(fileName, timeout=60.)
+            version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+            if version==0:
+                for statement in resultsStoreSchema: self.connection.execute(statement)
+                self.connection.execute('PRAGMA user_version = '+str(resultsStoreVersion))
+                self.connection.commit()
+            elif version!=resultsStoreVersion:
+                raise ResultsStoreError('results database '+fileName+' has version '+str(version)+' instead of '+str(resultsStoreVersion))
+        except sqlite3.Error as error:
+            raise ResultsStoreError('results database '+fileName+' can\'t be opened: '+str(error))
+
+    def beginRun(self, campaign, jointCampaigns, code, options):
+
+        cursor = self.connection.execute('INSERT INTO runs (time, campaign, jointCampaigns, code, options) VALUES (?, ?, ?, ?, ?)',
+                                         (time.strftime('%Y-%m-%d %H:%M:%S'), campaign, ','.join(jointCampaigns), code, json.dumps(options, sort_keys=True)))
+        return cursor.lastrowid
+
+    # Add the results of a combination, as recorded by scaleFactorCombination.py
+    def storeCombination(self, run, algo, comb, wp, combinationRecord, inputHash=None):
+
+        ptFit = combinationRecord['ptFit']
+        key = (combinationRecord['campaign'], algo, comb, wp)
+
+        cursor = self.connection.execute('INSERT INTO combinations (run, campaign, algo, comb, wp, jointCampaigns, vetoedMethods, maskedMethods, inputHash, nMeasurements, normalizedChi2, '
+                                         'ptFitFormula, ptFitParameters, ptFitUncertainties, ptFitChi2, ptFitNdf) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                         (run,)+key+(','.join(combinationRecord['jointCampaigns']), methodList(combinationRecord['vetoedMethods']), methodList(combinationRecord['maskedMethods']),
+                                         inputHash, combinationRecord['nMeasurements'], combinationRecord['normalizedChi2'],
+                                         None if ptFit is None else ptFit['formula'], None if ptFit is None else json.dumps(ptFit['parameters']),
+                                         None if ptFit is None or ptFit['uncertainties'] is None else json.dumps(ptFit['uncertainties']),
+                                         None if ptFit is None else ptFit['chi2'], None if ptFit is None else ptFit['ndf']))
+        combination = cursor.lastrowid
+
+        fittedScaleFactors = [ None ]*len(combinationRecord['ptbins']) if ptFit is None else ptFit['binAverages']
+        self.connection.executemany('INSERT INTO scaleFactors VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                    [ (combination,)+key+(ptbin,)+ptRange(ptbin)+(scaleFactor, uncertainty, fittedScaleFactor) for ptbin, scaleFactor, uncertainty, fittedScaleFactor in
+                                      zip(combinationRecord['ptbins'], combinationRecord['scaleFactors'], combinationRecord['uncertainties'], fittedScaleFactors) ])
+
+        self.connection.executemany('INSERT INTO breakdowns VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                    [ (combination,)+key+(ptbin, category, uncertainty) for category, uncertainties in combinationRecord['breakdowns'].items()
+                                      for ptbin, uncertainty in zip(combinationRecord['ptbins'], uncertainties) ])
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    # Rows of one of the queryTables, as a list of tuples with the columns of the table. The campaigns, algorithms,
+    # combinations, working points, and pt bins are selected from lists, where an empty list selects all, and
+    # maskedMethods keeps the combinations where all those methods were vetoed or masked, or none if it is [ 'none' ].
+    # The results of the joint combinations are only returned if joint is set, and then alone. Unless allRuns is set,
+    # only the last results of each combination and set of masks are returned
+    def query(self, table, campaigns=[], algos=[], combs=[], wps=[], ptbins=[], maskedMethods=[], joint=False, allRuns=False):
+
+        if table not in queryTables:
+            raise ResultsStoreError('unknown table '+table+' (valid tables: '+', '.join(queryTables)+')')
+
+        if table=='runs':
+            conditions, parameters = [], []
+            if len(campaigns)>0:
+                conditions.append('campaign IN ('+','.join('?'*len(campaigns))+')')
+                parameters.extend(campaigns)
+            return self.connection.execute('SELECT '+', '.join(queryTables[table])+' FROM runs'+(' WHERE '+' AND '.join(conditions) if len(conditions)>0 else '')+
+                                           ' ORDER BY run', parameters).fetchall()
+
+        rowTable = { 'scalefactors' : 'scaleFactors', 'breakdowns' : 'breakdowns' }.get(table, 'combinations')
+        rowAlias = 'c' if rowTable=='combinations' else 'r'
+        conditions, parameters = [], []
+
+        for column, values in [ ('campaign', campaigns), ('algo', algos), ('comb', combs), ('wp', wps), ('ptbin', ptbins if rowTable!='combinations' else []) ]:
+            if len(values)>0:
+                conditions.append(rowAlias+'.'+column+' IN ('+','.join('?'*len(values))+')')
+                parameters.extend(values)
+
+        conditions.append('c.jointCampaigns'+('!=' if joint else '=')+'\'\'')
+
+        if maskedMethods==[ 'none' ]:
+            conditions.append('c.vetoedMethods=\'\' AND c.maskedMethods=\'\'')
+        else:
+            for method in maskedMethods:
+                conditions.append('instr(\',\'||c.vetoedMethods||\',\'||c.maskedMethods||\',\', ?)>0')
+                parameters.append(','+method+',')
+
+        if not allRuns:
+            conditions.append('c.combination IN (SELECT max(combination) FROM combinations GROUP BY campaign, algo, comb, wp, jointCampaigns, vetoedMethods, maskedMethods)')
+
+        # The rows are returned in the order they were stored, i.e. as the combinations were run
+        columns = [ ('c' if column in [ 'vetoedMethods', 'maskedMethods' ] else rowAlias)+'.'+column for column in queryTables[table] ]
+        source = 'combinations c' if rowTable=='combinations' else rowTable+' r JOIN combinations c ON c.combination=r.combination'
+        order = 'c.combination' if rowTable=='combinations' else 'c.combination, r.rowid'
+
+        return self.connection.execute('SELECT '+', '.join(columns)+' FROM '+source+(' WHERE '+' AND '.join(conditions) if len(conditions)>0 else '')+
+                                       ' ORDER BY '+order, parameters).fetchall()
@@ -1,93 +1,60 @@
 #!/usr/bin/env python3
 import os
 import sys
-import ROOT
 import math
 import copy
 import glob
-import csv
+import zlib
 import optparse
+import io
+import contextlib
+import itertools
+import multiprocessing
 from array import *
 from collections import defaultdict
 from collections import OrderedDict
+import numpy
+import campaignConfig
+import btagCalibrationWriter
+import combinationEngine
+import measurementLoader
+import plotRenderer
+import ptDependenceFit
+import combinationManifest
+import resultsStore
+import stageProfiler
 
-if __name__ == '__main__':
+# Profiler of the stages of the run, which does nothing unless profiling is requested
+profiler = stageProfiler.NullProfiler()
 
-    # Input parameters
-    usage = 'usage: %prog [options]'
-    parser = optparse.OptionParser(usage)   
-    parser.add_option('--campaign'       , dest='campaign'       , help='Measurement campaign'           , default='') 
-    parser.add_option('--algorithm'      , dest='algorithm'      , help='Algorithms to be analysed'      , default='all')
-    parser.add_option('--combination'    , dest='combination'    , help='Combination to be performed'    , default='all')
-    parser.add_option('--workingpoint'   , dest='workingpoint'   , help='Working points to be analysed'  , default='all')
-    parser.add_option('--vetomethod'     , dest='vetomethod'     , help='Measurement methods to veto'    , default='NONE')
-    parser.add_option('--maskmethod'     , dest='maskmethod'     , help='Measurement methods to mask'    , default='NONE')
-    parser.add_option('--plotoff'        , dest='plotoff'        , help='Don\'t make plots'              , default=False, action='store_true')
-    parser.add_option('--plotfitoff'     , dest='plotfitoff'     , help='Don\'t plot pt-dependence fit'  , default=False, action='store_true')
-    parser.add_option('--store'          , dest='store'          , help='Store csv files'                , default=False, action='store_true')
-    parser.add_option('--storebybins'    , dest='storebybins'    , help='Store csv files by bins'        , default=False, action='store_true')
-    parser.add_option('--breaksyst'      , dest='breaksyst'      , help='Store systematics breakdown'    , default=False, action='store_true')
-    parser.add_option('--yearcorr'       , dest='yearcorr'       , help='Store year correlations'        , default=False, action='store_true')
-    parser.add_option('--cjetsoff'       , dest='cjetsoff'       , help='Don\'t store SFs for c jets'    , default=False, action='store_true')
-    parser.add_option('--forceptfit'     , dest='forceptfit'     , help='Force the pt-dependence fit'    , default=False, action='store_true')
-    parser.add_option('--standalone'     , dest='standalone'     , help='Use standalone btag calib. tool', default=False, action='store_true')
-    parser.add_option('--publish'        , dest='publish'        , help='Publish csv file version'       , default='')
-    parser.add_option('--plotdir'        , dest='plotdir'        , help='Output directory for plots'     , default='./Plots')
-    parser.add_option('--csvfiledir'     , dest='csvfiledir'     , help='Output directory for csv files' , default='./CSVFiles')
-    parser.add_option('--ignoremismatch' , dest='ignoremismatch' , help='Ignore error mismatch'          , default=False, action='store_true')
-    (opt, args) = parser.parse_args()
+# Campaigns of the joint combination, the first being the one given by --campaign, or empty if not requested
+jointCampaigns = []
 
-    # Some setting
-    if not os.path.exists('./Campaigns/'+opt.campaign+'.py'):
-        print('Campaign', opt.campaign, 'not found. Please, specify a valid campaign name')
-        exit()
+# ROOT is only imported when plots or pt-dependence fits are requested, so that runs
+# which only need the combination itself start with numpy alone
+ROOT = None
 
-    if os.environ.get('CMSSW_VERSION') is None or int(os.environ['CMSSW_VERSION'].split('_')[1])<=13: opt.standalone = True
-    
-    ROOT.gROOT.ProcessLine('gErrorIgnoreLevel = 1001;')
+def importROOT():
 
-    if opt.storebybins or opt.breaksyst or opt.yearcorr or opt.publish!='': opt.store = True
+    global ROOT
 
-    if opt.store:
+    if ROOT is None:
+        import ROOT as rootModule
+        rootModule.gROOT.ProcessLine('gErrorIgnoreLevel = 1001;')
+        ROOT = rootModule
 
-        if opt.standalone: ROOT.gROOT.ProcessLine('.L BTagCalibrationStandalone.cpp+')
-  
-        opt.storebyfunction = not opt.storebybins
-        jetFlavoursToBeStored = [ ROOT.BTagEntry.FLAV_B ]
-        if not opt.cjetsoff: jetFlavoursToBeStored.append(ROOT.BTagEntry.FLAV_C)
+    return ROOT
 
-        if opt.publish!='': 
-            opt.csvfiledir = '../btv-scale-factors/'+opt.campaign+'/csv/btagging_fixedWP_SFb/'
-        else: 
-            opt.csvfiledir += '/'+opt.campaign
-            os.system('mkdir -p '+opt.csvfiledir)
+# Make the settings of a campaign the globals used by the combinations
+def activateCampaign(campaign):
 
-    else:
-        opt.storebyfunction = False
+    global systematicClassification
 
-    if opt.plotoff: opt.plotfitoff = True
-    opt.doptfit = not opt.plotfitoff or opt.storebyfunction or opt.forceptfit
-    
-    # Read campaign info
-    handle = open('./Campaigns/'+opt.campaign+'.py','r')
-    exec(handle.read())
-    handle.close()
+    globals().update(campaign.settings())
+    systematicClassification = campaign.systematicClassification
 
-    # Get list of combinations, algorithms, working points, and measurement methods
-    if opt.algorithm!='all':
-       for algo in list(algorithms.keys()):
-           if algo.lower() not in opt.algorithm.lower(): del algorithms[algo]
-
-    if opt.combination!='all':
-       for comb in copy.deepcopy(combinations):
-           if comb.lower() not in opt.combination.lower(): combinations.remove(comb)
-
-    if opt.workingpoint!='all':
-       for wp in list(workingPoints.keys()):
-           keepWP = False
-           for wp2keep in opt.workingpoint.split(','):
-               if wp.lower()==wp2keep.lower(): keepWP = True
-           if not keepWP: del workingPoints[wp]
+# Add the methods selected by --vetomethod and --maskmethod to the vetoed and masked methods of the active campaign
+def applyMethodOptions():
 
     if opt.vetomethod!='None':
         for method in list(measurements.keys()):
@@ -97,708 +64,1028 @@ if __name__ == '__main__':
         for method in list(measurements.keys()):
             if method.lower() in opt.maskmethod.lower() and method not in maskedMethods: maskedMethods.append(method) 
 
-    # Loop on algorithms, combinations, and working points
-    for algo in algorithms:
+# Check if a measurement is masked in the campaign settings or by --maskmethod
+def measurementMasked(method, algo, wp, ptbin):
+    return method in maskedMethods or (method in maskedMeasurements and algo in maskedMeasurements[method] and wp in maskedMeasurements[method][algo] and (ptbin in maskedMeasurements[method][algo][wp] or 'all' in maskedMeasurements[method][algo][wp]))
 
-        if opt.store:
-            
-            wpFlag = '' if opt.workingpoint=='all' else '-'.join([ ''.join([ x for x in y if x.isupper() ]) for y in workingPoints ])
-            csvFileNameList = [ algo+wpFlag ]
-            if opt.combination!='all': csvFileNameList.append('-'.join([ x for x in combinations ]))
-            if opt.publish=='':
-                if len(maskedMethods)>0 or len(vetoedMethods)>0: 
-                    csvFileNameList.append('masked'+'-'.join([ measurements[x]['plotname'] for x in sorted(set(vetoedMethods+maskedMethods)) ]))
-            else:
-                csvFileNameList.append(csvFileNameFlag)
+maskSweepModes = [ 'leaveoneout', 'subsets', 'ptbins' ]
 
-            if opt.storebybins: csvFileNameList.append('Binned')
-            if opt.breaksyst: csvFileNameList.append('CategoryBreakdown')
-            if opt.yearcorr: csvFileNameList.append('YearCorrelation')
+# Subsets of the measurements to be combined in the mask sweep, as (label, selected measurements): all the
+# measurements, the campaign masks, and the subsets of the requested sweep modes, i.e. leaving one method out,
+# all the subsets of methods, or leaving one measurement (method and pt bin) out
+def maskSweepSubsets(algo, wp, measurementVectors):
 
-            if opt.publish!='':
-                if opt.publish=='new':
-                    measurementFileList = glob.glob(opt.csvfiledir+'/'+'_'.join(csvFileNameList)+'_v*.csv')
-                    lastVersion = -1 if len(measurementFileList)==0 else max([ int(x.split('_')[-1].replace('.csv','').replace('v','')) for x in measurementFileList ])
-                    csvFileNameList.append('v'+str(lastVersion+1))
-                else:
-                    csvFileNameList.append(opt.publish)
+    methods = list(OrderedDict.fromkeys(measurementVectors.methods))
+    measurementMethods = numpy.array(measurementVectors.methods)
+    sweepModes = opt.sweepmasks.split(',')
 
-            csvFile = ROOT.BTagCalibration(opt.csvfiledir+'/'+'_'.join(csvFileNameList)+'.csv')
+    subsets = [ ('all', numpy.ones(len(measurementVectors), dtype=bool)) ]
 
-        for comb in combinations:
-            for wp in workingPoints:
+    campaignMasks = numpy.array([ measurementMasked(method, algo, wp, ptbin) for ptbin, method in measurementVectors.measurements ], dtype=bool)
+    if numpy.any(campaignMasks): subsets.append(('campaign masks', ~campaignMasks))
 
-                measuredScaleFactors = OrderedDict() 
-                graphScaleFactors, graphScaleFactorsTotal = OrderedDict(), OrderedDict()
+    if 'leaveoneout' in sweepModes:
+        for method in methods:
+            subsets.append(('without '+method, measurementMethods!=method))
 
-                # loop on the measurement methods ...
-                for method in measurements:
-                    if comb in measurements[method]['data'] and method not in vetoedMethods:
+    if 'subsets' in sweepModes:
+        for nMethods in range(1, len(methods)):
+            for methodSubset in itertools.combinations(methods, nMethods):
+                subsets.append(('+'.join(methodSubset), numpy.isin(measurementMethods, methodSubset)))
 
-                        measurementDir = '/'.join([ '..', 'btv-scale-factors', opt.campaign, 'csv', 'btagging_fixedWP_SFb', '' ])
+    if 'ptbins' in sweepModes:
+        for meas, (ptbin, method) in enumerate(measurementVectors.measurements):
+            selected = numpy.ones(len(measurementVectors), dtype=bool)
+            selected[meas] = False
+            subsets.append(('without '+method+' '+ptbin, selected))
 
-                        if measurements[method]['version']!='last':
-                            measurementFileName = measurementDir+algo+'_'+method+'_'+measurements[method]['version']+'.csv'
-                            if not os.path.exists(measurementFileName):
-                                measurementFileName = measurementDir+algo+workingPoints[wp]+'_'+method+'_'+measurements[method]['version']+'.csv'
-                            if not os.path.exists(measurementFileName):
-                                print('Measurement file for', algo, wp, method, measurements[method]['version'], 'not found')
-                                exit()
+    return subsets
 
-                        else:
-                            measurementFileList = glob.glob(measurementDir+algo+'_'+method+'_v*.csv')
-                            if len(measurementFileList)==0:
-                                measurementFileList = glob.glob(measurementDir+algo+workingPoints[wp]+'_'+method+'_v*.csv')
-                            if len(measurementFileList)==0:
-                                print('No measurement files for', algo, wp, method)
-                                exit()
-
-                            lastVersion = max([ int(x.split('_')[-1].replace('.csv','').replace('v','')) for x in measurementFileList ])
-                            measurementFileName = measurementDir+algo+'_'+method+'_v'+str(lastVersion)+'.csv'
-
-                        # ... to read the results of scale factor measurements, and fill ...
-                        with open(measurementFileName) as csvfile:
-                            for row in csv.DictReader(csvfile):
-                                if row['wp']==workingPoints[wp] and float(row['ptMin'])<maxPtCampaign:
-
-                                    if '+' not in row['formula'].replace('e-','') and '-' not in row['formula'].replace('e-',''):
-                                        measuredScaleFactor = float(row['formula'])
-                                    elif ('+' in row['formula'].replace('e-','') and '-' not in row['formula'].replace('e-','')) or ('+-' in row['formula']):
-                                        measuredScaleFactor = float(row['formula'].split('+')[0])+float(row['formula'].replace(row['formula'].split('+')[0]+'+',''))
-                                    elif ('-' in row['formula'].replace('e-','') and '+' not in row['formula'].replace('e-','')) or ('-+' in row['formula']):
-                                        measuredScaleFactor = float(row['formula'].split('-')[0])-float(row['formula'].replace(row['formula'].split('-')[0]+'-',''))
-
-                                    if measuredScaleFactor>0.:
-
-                                        ptbin = 'Pt-'+str(int(float(row['ptMin'])))+'to'+str(int(float(row['ptMax'])))
-                                        if ptbin not in measuredScaleFactors: measuredScaleFactors[ptbin] = OrderedDict()
-                                        if method not in measuredScaleFactors[ptbin]: measuredScaleFactors[ptbin][method] = {}
-                                        measuredScaleFactors[ptbin][method][row['syst']] = measuredScaleFactor
-
-                        # ... the systematics to be used to construct the covariance matrix and ...
-                        for ptbin in list(measuredScaleFactors.keys()):
-                            if method in  measuredScaleFactors[ptbin]:
-
-                                measuredScaleFactors[ptbin][method]['systematics'] = {}
-                                total_systematics_up, total_systematics_down = 0., 0.
-                                total_systematics_up_signed, total_systematics_down_signed = 0., 0.
-                                for syst in list(measuredScaleFactors[ptbin][method].keys()):
-                                    if syst!='central' and syst!='systematics':
-                                    
-                                        systName = 'total' if '_' not in syst else syst.split('_')[1]
-                                        if systName not in measuredScaleFactors[ptbin][method]['systematics']:
-
-                                            upSF   = measuredScaleFactors[ptbin][method]['up']   if systName=='total' else measuredScaleFactors[ptbin][method]['up_'+systName]
-                                            downSF = measuredScaleFactors[ptbin][method]['down'] if systName=='total' else measuredScaleFactors[ptbin][method]['down_'+systName]
-                                            upSyst   = upSF   - measuredScaleFactors[ptbin][method]['central']
-                                            downSyst = downSF - measuredScaleFactors[ptbin][method]['central']
-                                            measuredScaleFactors[ptbin][method]['systematics'][systName] = math.copysign((abs(upSyst)+abs(downSyst))/2., upSyst)
-
-                                            if systName!='total':
-
-                                                total_systematics_up += upSyst*upSyst
-                                                total_systematics_down += downSyst*downSyst
-                                                if upSyst>0.:
-                                                    total_systematics_up_signed += upSyst*upSyst
-                                                    total_systematics_down_signed += downSyst*downSyst
-                                                else:                                                            
-                                                    total_systematics_down_signed += upSyst*upSyst
-                                                    total_systematics_up_signed += downSyst*downSyst
-
-                                                if systName not in systematicPtCorrelated and systName not in systematicPtUncorrelated: 
-                                                    print('Error:', systName, 'not assigned as pt-correlated nor as pt-uncorrelated')
-                                                    exit()
-
-                                                if systName in systematicPtCorrelated and systName in systematicPtUncorrelated:
-                                                    print('Error:', systName, 'assigned both as pt-correlated and pt-uncorrelated')
-                                                    exit()
-
-                                                if systName not in systematicYearCorrelated and systName not in systematicYearUncorrelated:
-                                                    print('Error:', systName, 'not assigned as year-correlated nor as year-uncorrelated')
-                                                    exit()
-
-                                                if systName in systematicYearCorrelated and systName in systematicYearUncorrelated:
-                                                    print('Error:', systName, 'assigned both as year-correlated and year-uncorrelated')
-                                                    exit()
-   
-                                                if systName not in type1Systematics and systName not in type2Systematics and systName not in type3Systematics:
-                                                    print('Error:', systName, 'not assigned to any breakdown category')
-                                                    exit()
-
-                                                if (systName in type1Systematics and systName in type2Systematics) or (systName in type1Systematics and systName in type3Systematics) or (systName in type2Systematics and systName in type3Systematics):
-                                                    print('Error:', systName, 'assigned to more than one breakdown category')
-                                                    exit()
-
-                                total_systematics_up_signed = math.sqrt(total_systematics_up_signed)
-                                total_systematics_down_signed = math.sqrt(total_systematics_down_signed)
-                                total_systematics_up = math.sqrt(total_systematics_up)
-                                total_systematics_down = math.sqrt(total_systematics_down)
-                                total_up = measuredScaleFactors[ptbin][method]['up']-measuredScaleFactors[ptbin][method]['central']
-                                total_down = measuredScaleFactors[ptbin][method]['central']-measuredScaleFactors[ptbin][method]['down']
-                                minUpDiff = total_up-total_systematics_up if abs(total_systematics_up-total_up)<abs(total_systematics_up_signed-total_up) else total_up-total_systematics_up_signed
-                                minDownDiff = total_down-total_systematics_down if abs(total_systematics_down-total_down)<abs(total_systematics_down_signed-total_down) else total_down-total_systematics_down_signed
-                                if minUpDiff<-0.02 or minDownDiff<-0.02:
-                                    print('Error: total error smaller than the sum of the systematics for method', method, ', algorithm', algo, ', working point', wp, ', ptbin', ptbin, ':', total_up, minUpDiff, total_down, minDownDiff)
-                                    exit()
-                                if minUpDiff>2e-03 or minDownDiff>2e-03:
-                                    print('Error: total error does not match the sum of the systematics for method', method, ', algorithm', algo, ', working point', wp, ', ptbin', ptbin, ':', total_up, minUpDiff, total_down, minDownDiff)
-                                    if method+'method' in type3Systematics and (method+'method' in systematicPtCorrelated or method+'method' in systematicPtUncorrelated) and not (method+'method' in systematicPtCorrelated and method+'method' in systematicPtUncorrelated) and (method+'method' in systematicYearCorrelated or method+'method' in systematicYearUncorrelated) and not (method+'method' in systematicYearCorrelated and method+'method' in systematicYearUncorrelated):
-                                        print('... fixing it')
-                                        upMethodError = math.sqrt(total_up*total_up-(total_up-minUpDiff)*(total_up-minUpDiff))
-                                        downMethodError = math.sqrt(total_down*total_down-(total_down-minDownDiff)*(total_down-minDownDiff))
-                                        measuredScaleFactors[ptbin][method]['systematics'][method+'method'] = max(upMethodError,downMethodError)
-                                    elif not opt.ignoremismatch:
-                                        print('... to fix the mismatch, please declare the method error in the campaign info')
+# Print the combined scale factors, uncertainties, and normalized chi2 for each subset of the mask sweep. The
+# subsets are combined from the submatrices of the covariance matrix of all the measurements, and the results
+# are before the sample dependence and chi2 inflation treatments
+def printMaskSweep(algo, comb, wp, measurementVectors, covarianceMatrix):
+
+    subsets = maskSweepSubsets(algo, wp, measurementVectors)
+    labelWidth = max([ len(label) for label, selected in subsets ])
+
+    print('\nMask sweep for combination', comb, 'algorithm', algo, 'working point', wp, 'with', len(subsets), 'subsets\n')
+    print('    '+'subset'.ljust(labelWidth)+'  ndf  chi2/ndf'+''.join([ ptbin.rjust(16) for ptbin in measurementVectors.ptbins ]))
+
+    for label, selected in subsets:
+
+        subsetResults = combinationEngine.combineMeasurementSubset(measurementVectors, covarianceMatrix, selected)
+        if subsetResults is None:
+            print('    '+label.ljust(labelWidth)+'  not combinable')
+            continue
+
+        ptbinIndices, combinedScaleFactorVector, combinedScaleFactorUncertaintyVector, chi2, ndf = subsetResults
+        normalizedChi2 = chi2/ndf if ndf>0 else chi2
+
+        combinedScaleFactors = [ '-' ]*len(measurementVectors.ptbins)
+        for iptbin, combinedScaleFactor, combinedScaleFactorUncertainty in zip(ptbinIndices, combinedScaleFactorVector, combinedScaleFactorUncertaintyVector):
+            combinedScaleFactors[iptbin] = '%.3f+-%.3f' % (combinedScaleFactor, combinedScaleFactorUncertainty)
+
+        print('    '+label.ljust(labelWidth)+' %4d %9.3f' % (ndf, normalizedChi2)+''.join([ combinedScaleFactor.rjust(16) for combinedScaleFactor in combinedScaleFactors ]))
+
+    print('\n')
+
+# Warn about a matrix that is invertible, but nearly singular or not positive definite, with the diagnostics of
+# its factorization, as the combination can't be trusted to all the printed digits
+def printConditioningWarning(matrixName, factorization, algo, comb, wp):
+
+    if factorization.illConditioned:
+        print('Warning:', matrixName, 'ill-conditioned for combination', comb, 'algorithm', algo, 'working point', wp, ': pivot ratio %g, log-determinant %g, determinant sign %d%s' %
+              (factorization.pivotRatio, factorization.logDeterminant, factorization.determinantSign, '' if factorization.positiveDefinite else ', not positive definite'))
+
+# Seed of the toy experiments of one algorithm, combination, and working point, which doesn't depend on
+# the order the combinations are run in
+def toySeed(algo, comb, wp):
+    return [ opt.toyseed, zlib.crc32('/'.join([ algo, comb, wp ]).encode()) ]
+
+def printToyExperiments(measurementVectors, combinedScaleFactorUncertaintyVector, toyExperiments, chi2, ndf):
+
+    print('    Toy experiments:', toyExperiments.nToys, 'toys with seed', opt.toyseed, '\n')
+
+    # The chi2 is only normalized with at least one degree of freedom, as in the combination printout
+    normalizedChi2 = chi2/ndf if ndf>0 else chi2
+    toyNormalizedChi2 = toyExperiments.chi2/ndf if ndf>0 else toyExperiments.chi2
+    print('    Normalized chi2: observed', round(normalizedChi2,3), ', toys mean', round(float(numpy.mean(toyNormalizedChi2)),3),
+          ', 68% and 95% quantiles', round(float(numpy.quantile(toyNormalizedChi2, 0.68)),3), round(float(numpy.quantile(toyNormalizedChi2, 0.95)),3),
+          ', p-value', round(toyExperiments.pValue(chi2),4), '\n')
+
+    for iptbin, ptbin in enumerate(measurementVectors.ptbins):
+        print('    Toys for pt bin', ptbin, ': uncertainty', round(toyExperiments.scaleFactorUncertainties[iptbin],4), 'vs', round(combinedScaleFactorUncertaintyVector[iptbin],4),
+              ', pull mean', round(toyExperiments.scaleFactorPullMeans[iptbin],3), 'width', round(toyExperiments.scaleFactorPullWidths[iptbin],3))
+    print('')
+
+    for method in OrderedDict.fromkeys(measurementVectors.methods):
+        pullMoments = toyExperiments.measurementPullMoments([ meas for meas, measurementMethod in enumerate(measurementVectors.methods) if measurementMethod==method ])
+        if pullMoments is not None:
+            print('    Toy measurement pulls for method', method, ': mean', round(pullMoments[0],3), 'width', round(pullMoments[1],3))
+    print('\n')
+
+# Read the scale factor measurements of one algorithm, combination, and working point in a campaign, with their
+# systematics checked against the campaign classification and the total uncertainties, and the points of each
+# method for the plots. The masked measurements are removed, unless they are evaluated by the mask sweep
+def readMeasuredScaleFactors(campaignName, algo, comb, wp):
+
+    measuredScaleFactors = OrderedDict() 
+    measurementPlotPoints = OrderedDict()
+
+    # loop on the measurement methods ...
+    for method in measurements:
+        if comb in measurements[method]['data'] and method not in vetoedMethods:
+
+            measurementDir = '/'.join([ '..', 'btv-scale-factors', campaignName, 'csv', 'btagging_fixedWP_SFb', '' ])
+
+            measurementFileName = measurementLoader.findMeasurementFile(measurementDir, algo, workingPoints[wp], method, measurements[method]['version'])
+            if measurementFileName is None:
+                if measurements[method]['version']!='last': print('Measurement file for', algo, wp, method, measurements[method]['version'], 'not found')
+                else: print('No measurement files for', algo, wp, method)
+                exit()
+
+            # ... to read the results of scale factor measurements, and fill ...
+            try:
+                measurementFile = measurementLoader.loadMeasurementFile(measurementFileName, None if opt.cacheoff else opt.cachedir)
+            except measurementLoader.FormulaError as error:
+                print('Error:', error)
+                exit()
+
+            for ptbin in measurementFile.ptbins(workingPoints[wp], maxPtCampaign):
+                if ptbin not in measuredScaleFactors: measuredScaleFactors[ptbin] = OrderedDict()
+                if method not in measuredScaleFactors[ptbin]: measuredScaleFactors[ptbin][method] = {}
+                measuredScaleFactors[ptbin][method].update(measurementFile.scaleFactors[workingPoints[wp]][ptbin])
+
+            profiler.lap('ingestion')
+
+            # ... the systematics to be used to construct the covariance matrix and ...
+            for ptbin in list(measuredScaleFactors.keys()):
+                if method in  measuredScaleFactors[ptbin]:
+
+                    measuredScaleFactors[ptbin][method]['systematics'] = {}
+                    total_systematics_up, total_systematics_down = 0., 0.
+                    total_systematics_up_signed, total_systematics_down_signed = 0., 0.
+                    for syst in list(measuredScaleFactors[ptbin][method].keys()):
+                        if syst!='central' and syst!='systematics':
+                        
+                            systName = 'total' if '_' not in syst else syst.split('_')[1]
+                            if systName not in measuredScaleFactors[ptbin][method]['systematics']:
+
+                                upSF   = measuredScaleFactors[ptbin][method]['up']   if systName=='total' else measuredScaleFactors[ptbin][method]['up_'+systName]
+                                downSF = measuredScaleFactors[ptbin][method]['down'] if systName=='total' else measuredScaleFactors[ptbin][method]['down_'+systName]
+                                upSyst   = upSF   - measuredScaleFactors[ptbin][method]['central']
+                                downSyst = downSF - measuredScaleFactors[ptbin][method]['central']
+                                measuredScaleFactors[ptbin][method]['systematics'][systName] = math.copysign((abs(upSyst)+abs(downSyst))/2., upSyst)
+
+                                if systName!='total':
+
+                                    total_systematics_up += upSyst*upSyst
+                                    total_systematics_down += downSyst*downSyst
+                                    if upSyst>0.:
+                                        total_systematics_up_signed += upSyst*upSyst
+                                        total_systematics_down_signed += downSyst*downSyst
+                                    else:                                                            
+                                        total_systematics_down_signed += upSyst*upSyst
+                                        total_systematics_up_signed += downSyst*downSyst
+
+                                    # Double assignments are rejected when the campaign is loaded
+                                    systematicClass = systematicClassification.get(systName, campaignConfig.unassignedSystematic)
+
+                                    if systematicClass.ptCorrelated is None:
+                                        print('Error:', systName, 'not assigned as pt-correlated nor as pt-uncorrelated')
+                                        exit()
+
+                                    if systematicClass.yearCorrelated is None:
+                                        print('Error:', systName, 'not assigned as year-correlated nor as year-uncorrelated')
                                         exit()
-                                    elif minUpDiff<10.02 and minDownDiff<10.02:
-                                        pass
-                                        #upAddError = math.sqrt(total_up*total_up-(total_up-minUpDiff)*(total_up-minUpDiff))
-                                        #downAddError = math.sqrt(total_down*total_down-(total_down-minDownDiff)*(total_down-minDownDiff))
-                                        #addError = max(upAddError,downAddError)
-                                        #measuredScaleFactors[ptbin][method]['systematics']['statistic'] = math.sqrt(measuredScaleFactors[ptbin][method]['systematics']['statistic']*measuredScaleFactors[ptbin][method]['systematics']['statistic']+addError*addError)
-                                    else:
-                                        print('... difference too big to be ignored!')
+
+                                    if systematicClass.category is None:
+                                        print('Error:', systName, 'not assigned to any breakdown category')
                                         exit()
 
-                        # ... the graph to be used for the final plots
-                        graphMetod, graphMetodTotal = ROOT.TGraphErrors(), ROOT.TGraphErrors() 
+                    total_systematics_up_signed = math.sqrt(total_systematics_up_signed)
+                    total_systematics_down_signed = math.sqrt(total_systematics_down_signed)
+                    total_systematics_up = math.sqrt(total_systematics_up)
+                    total_systematics_down = math.sqrt(total_systematics_down)
+                    total_up = measuredScaleFactors[ptbin][method]['up']-measuredScaleFactors[ptbin][method]['central']
+                    total_down = measuredScaleFactors[ptbin][method]['central']-measuredScaleFactors[ptbin][method]['down']
+                    minUpDiff = total_up-total_systematics_up if abs(total_systematics_up-total_up)<abs(total_systematics_up_signed-total_up) else total_up-total_systematics_up_signed
+                    minDownDiff = total_down-total_systematics_down if abs(total_systematics_down-total_down)<abs(total_systematics_down_signed-total_down) else total_down-total_systematics_down_signed
+                    if minUpDiff<-0.02 or minDownDiff<-0.02:
+                        print('Error: total error smaller than the sum of the systematics for method', method, ', algorithm', algo, ', working point', wp, ', ptbin', ptbin, ':', total_up, minUpDiff, total_down, minDownDiff)
+                        exit()
+                    if minUpDiff>2e-03 or minDownDiff>2e-03:
+                        print('Error: total error does not match the sum of the systematics for method', method, ', algorithm', algo, ', working point', wp, ', ptbin', ptbin, ':', total_up, minUpDiff, total_down, minDownDiff)
+                        methodSystematicClass = systematicClassification.get(method+'method', campaignConfig.unassignedSystematic)
+                        if methodSystematicClass.category==3 and methodSystematicClass.complete():
+                            print('... fixing it')
+                            upMethodError = math.sqrt(total_up*total_up-(total_up-minUpDiff)*(total_up-minUpDiff))
+                            downMethodError = math.sqrt(total_down*total_down-(total_down-minDownDiff)*(total_down-minDownDiff))
+                            measuredScaleFactors[ptbin][method]['systematics'][method+'method'] = max(upMethodError,downMethodError)
+                        elif not opt.ignoremismatch:
+                            print('... to fix the mismatch, please declare the method error in the campaign info')
+                            exit()
+                        elif minUpDiff<10.02 and minDownDiff<10.02:
+                            pass
+                            #upAddError = math.sqrt(total_up*total_up-(total_up-minUpDiff)*(total_up-minUpDiff))
+                            #downAddError = math.sqrt(total_down*total_down-(total_down-minDownDiff)*(total_down-minDownDiff))
+                            #addError = max(upAddError,downAddError)
+                            #measuredScaleFactors[ptbin][method]['systematics']['statistic'] = math.sqrt(measuredScaleFactors[ptbin][method]['systematics']['statistic']*measuredScaleFactors[ptbin][method]['systematics']['statistic']+addError*addError)
+                        else:
+                            print('... difference too big to be ignored!')
+                            exit()
 
-                        ibin = 0
-                        for ptbin in measuredScaleFactors:
-                            if method in  measuredScaleFactors[ptbin]:
+            profiler.lap('validation')
 
-                                minPt, maxPt = float(ptbin.split('-')[1].split('to')[0]), float(ptbin.split('to')[1]) 
-                                midPt = (maxPt+minPt)/2. + measurements[method]['shift']
-                      
-                                graphMetod.SetPoint(ibin, midPt, measuredScaleFactors[ptbin][method]['central'])
-                                graphMetod.SetPointError(ibin, (maxPt-minPt)/2., measuredScaleFactors[ptbin][method]['systematics']['statistic'])
-                                graphMetodTotal.SetPoint(ibin, midPt, measuredScaleFactors[ptbin][method]['central'])
-                                graphMetodTotal.SetPointError(ibin, (maxPt-minPt)/2., measuredScaleFactors[ptbin][method]['systematics']['total'])
-
-                                ibin += 1
+            # ... the points to be used for the final plots
+            if not opt.plotoff:
 
-                        graphMetod.SetFillColor(measurements[method]['color']);    graphMetodTotal.SetFillColor(measurements[method]['color']);
-                        graphMetod.SetMarkerStyle(measurements[method]['marker']); graphMetodTotal.SetMarkerStyle(measurements[method]['marker']);
-                        graphMetod.SetMarkerColor(measurements[method]['color']);  graphMetodTotal.SetMarkerColor(measurements[method]['color']);
-                        graphMetod.SetMarkerSize(measurements[method]['size']);    graphMetodTotal.SetMarkerSize(measurements[method]['size']);
-                        graphMetod.SetLineStyle(1);                                graphMetodTotal.SetLineStyle(1);
-                        graphMetod.SetLineColor(measurements[method]['color']);    graphMetodTotal.SetLineColor(measurements[method]['color']);
-                        graphMetod.SetLineWidth(measurements[method]['width']);    graphMetodTotal.SetLineWidth(1);
+                methodPtbins = [ ptbin for ptbin in measuredScaleFactors if method in measuredScaleFactors[ptbin] ]
+                minPt = numpy.array([ float(ptbin.split('-')[1].split('to')[0]) for ptbin in methodPtbins ])
+                maxPt = numpy.array([ float(ptbin.split('to')[1]) for ptbin in methodPtbins ])
 
-                        graphScaleFactors[method] = graphMetod
-                        graphScaleFactorsTotal[method] = graphMetodTotal
+                measurementPlotPoints[method] = { 'legname' : measurements[method]['legname'], 'color' : measurements[method]['color'], 'marker' : measurements[method]['marker'],
+                                                  'size' : measurements[method]['size'], 'width' : measurements[method]['width'],
+                                                  'x' : (maxPt+minPt)/2. + measurements[method]['shift'], 'ex' : (maxPt-minPt)/2.,
+                                                  'y' : numpy.array([ measuredScaleFactors[ptbin][method]['central'] for ptbin in methodPtbins ]),
+                                                  'eyStatistic' : numpy.array([ measuredScaleFactors[ptbin][method]['systematics']['statistic'] for ptbin in methodPtbins ]),
+                                                  'eyTotal' : numpy.array([ measuredScaleFactors[ptbin][method]['systematics']['total'] for ptbin in methodPtbins ]) }
 
-                        # Finally, apply masks for this method
-                        for ptbin in list(measuredScaleFactors.keys()):
-                            if method in measuredScaleFactors[ptbin]:
-                                if method in maskedMethods or (method in maskedMeasurements and algo in maskedMeasurements[method] and wp in maskedMeasurements[method][algo] and (ptbin in maskedMeasurements[method][algo][wp] or 'all' in maskedMeasurements[method][algo][wp])):
-                                    del measuredScaleFactors[ptbin][method]
-                            if len(list(measuredScaleFactors[ptbin].keys()))==0: del measuredScaleFactors[ptbin]
+                profiler.lap('plotting')
 
-                # Build the matrices for the fit
-                nMeasurements, nCombinedScaleFactors = 0, len(list(measuredScaleFactors.keys()))
-                for ptbin in measuredScaleFactors: nMeasurements += len(list(measuredScaleFactors[ptbin].keys()))
+            # Finally, apply masks for this method, unless they are evaluated by the mask sweep
+            if opt.sweepmasks=='':
+                for ptbin in list(measuredScaleFactors.keys()):
+                    if method in measuredScaleFactors[ptbin]:
+                        if measurementMasked(method, algo, wp, ptbin):
+                            del measuredScaleFactors[ptbin][method]
+                    if len(list(measuredScaleFactors[ptbin].keys()))==0: del measuredScaleFactors[ptbin]
 
-                matrixU = ROOT.TMatrixD(nMeasurements, nCombinedScaleFactors)
-                matrixU *= 0.
+    return measuredScaleFactors, measurementPlotPoints
 
-                scaleFactorVector = ROOT.TMatrixD(nMeasurements, 1)
-                scaleFactorVector *= 0.
+# Print the era-specific scale factors of the joint combination of several campaigns, and the scale factors
+# averaged over the eras, fitted with the same joint covariance. The difference of the chi2 of the two fits
+# measures the compatibility of the eras. The results are returned as records for the results store, one for
+# each era with the chi2 of the era-specific fit, and one for the average labelled by the joined campaign names
+def printJointCombination(algo, comb, wp, jointCovarianceBuilder, eraSolver, averageSolver, eraMethods):
 
-                covarianceMatrix = ROOT.TMatrixD(nMeasurements, nMeasurements)
-                covarianceMatrix *= 0.
+    scaleFactorVector = jointCovarianceBuilder.scaleFactorVector
+    nMeasurements, nPtbins = len(scaleFactorVector), len(jointCovarianceBuilder.ptbins)
 
-                breakdownCovarianceMatrices = OrderedDict()
+    eraScaleFactorVector = eraSolver.combine(scaleFactorVector)
+    eraScaleFactorUncertaintyVector = numpy.sqrt(numpy.diag(eraSolver.scaleFactorUncertaintyMatrix))
+    eraChi2, eraNdf = eraSolver.chi2(eraSolver.residuals(scaleFactorVector, eraScaleFactorVector)), nMeasurements-len(eraScaleFactorVector)
 
-                if opt.breaksyst:
-                    breakdownCovarianceMatrices['type1'] = ROOT.TMatrixD(nMeasurements, nMeasurements); breakdownCovarianceMatrices['type1'] *= 0.
-                    breakdownCovarianceMatrices['type3'] = ROOT.TMatrixD(nMeasurements, nMeasurements); breakdownCovarianceMatrices['type3'] *= 0.
+    averageScaleFactorVector = averageSolver.combine(scaleFactorVector)
+    averageScaleFactorUncertaintyVector = numpy.sqrt(numpy.diag(averageSolver.scaleFactorUncertaintyMatrix))
+    averageChi2, averageNdf = averageSolver.chi2(averageSolver.residuals(scaleFactorVector, averageScaleFactorVector)), nMeasurements-nPtbins
 
-                if opt.yearcorr:
-                    breakdownCovarianceMatrices['correlated']   = ROOT.TMatrixD(nMeasurements, nMeasurements); breakdownCovarianceMatrices['correlated']   *= 0.
-                    breakdownCovarianceMatrices['uncorrelated'] = ROOT.TMatrixD(nMeasurements, nMeasurements); breakdownCovarianceMatrices['uncorrelated'] *= 0.
+    print('\nJoint combination for combination', comb, 'algorithm', algo, 'working point', wp, 'of campaigns', ', '.join([ eraCampaign.name for eraCampaign in jointCampaigns ]),
+          'with', len(jointCovarianceBuilder.sharedSystematics), 'year-correlated systematics\n')
+    print('    Era-specific fit: chi2/ndf', round(eraChi2,3), '/', eraNdf, ', era-averaged fit: chi2/ndf', round(averageChi2,3), '/', averageNdf,
+          ', compatibility of the eras: chi2/ndf', round(averageChi2-eraChi2,3), '/', averageNdf-eraNdf, '\n')
 
-                row = 0
-                for iptbin, row_ptbin in enumerate(measuredScaleFactors):
-                    for row_method in measuredScaleFactors[row_ptbin]:  
+    columnWidth = max([ len(eraCampaign.name) for eraCampaign in jointCampaigns ]+[ 14 ])+2
+    labelWidth = max([ len(ptbin) for ptbin in jointCovarianceBuilder.ptbins ]+[ 6 ])
+    print('    '+'pt bin'.ljust(labelWidth)+''.join([ eraCampaign.name.rjust(columnWidth) for eraCampaign in jointCampaigns ])+'average'.rjust(columnWidth))
 
-                        matrixU[row][iptbin] = 1.
-                        scaleFactorVector[row][0] = measuredScaleFactors[row_ptbin][row_method]['central']
+    for iptbin, ptbin in enumerate(jointCovarianceBuilder.ptbins):
 
-                        column = 0
-                        for column_ptbin in measuredScaleFactors:
-                            for column_method in measuredScaleFactors[column_ptbin]:
+        scaleFactors = []
+        for era, eraPtbinIndices in enumerate(jointCovarianceBuilder.eraPtbinIndices):
+            eraPtbin = numpy.flatnonzero(eraPtbinIndices==iptbin)
+            if len(eraPtbin)==0: scaleFactors.append('-')
+            else:
+                parameter = jointCovarianceBuilder.eraParameterOffsets[era] + eraPtbin[0]
+                scaleFactors.append('%.3f+-%.3f' % (eraScaleFactorVector[parameter], eraScaleFactorUncertaintyVector[parameter]))
+        scaleFactors.append('%.3f+-%.3f' % (averageScaleFactorVector[iptbin], averageScaleFactorUncertaintyVector[iptbin]))
 
-                                for syst in measuredScaleFactors[row_ptbin][row_method]['systematics']:
-                                    if syst in measuredScaleFactors[column_ptbin][column_method]['systematics'] and syst!='total':
+        print('    '+ptbin.ljust(labelWidth)+''.join([ scaleFactor.rjust(columnWidth) for scaleFactor in scaleFactors ]))
 
-                                        matrixElement = measuredScaleFactors[row_ptbin][row_method]['systematics'][syst]*measuredScaleFactors[column_ptbin][column_method]['systematics'][syst]
+    print('\n')
 
-                                        if row_ptbin!=column_ptbin:
-                                            if syst in systematicPtUncorrelated: continue
-                                            elif syst in ptCorrelationCoefficients: matrixElement *= ptCorrelationCoefficients[syst]
-                                        elif row_method!=column_method and syst in statisticalCorrelationCoefficients:
-                                            if row_method+'-'+column_method in statisticalCorrelationCoefficients[syst]:
-                                                if row_ptbin in statisticalCorrelationCoefficients[syst][row_method+'-'+column_method]:
-                                                    matrixElement *= statisticalCorrelationCoefficients[syst][row_method+'-'+column_method][row_ptbin]
-                                            elif syst=='statistic': continue
+    campaignNames = [ eraCampaign.name for eraCampaign in jointCampaigns ]
+    combinationRecords = []
 
-                                        covarianceMatrix[row][column] += matrixElement
+    for era, (eraPtbinIndices, (eraVetoedMethods, eraMaskedMethods)) in enumerate(zip(jointCovarianceBuilder.eraPtbinIndices, eraMethods)):
+        eraParameters = slice(jointCovarianceBuilder.eraParameterOffsets[era], jointCovarianceBuilder.eraParameterOffsets[era+1])
+        combinationRecords.append({ 'campaign' : campaignNames[era], 'jointCampaigns' : campaignNames, 'vetoedMethods' : eraVetoedMethods, 'maskedMethods' : eraMaskedMethods,
+                                    'nMeasurements' : int(jointCovarianceBuilder.eraOffsets[era+1]-jointCovarianceBuilder.eraOffsets[era]),
+                                    'normalizedChi2' : float(eraChi2/eraNdf if eraNdf>0 else eraChi2), 'ptbins' : [ jointCovarianceBuilder.ptbins[iptbin] for iptbin in eraPtbinIndices ],
+                                    'scaleFactors' : eraScaleFactorVector[eraParameters].tolist(), 'uncertainties' : eraScaleFactorUncertaintyVector[eraParameters].tolist(),
+                                    'breakdowns' : OrderedDict(), 'ptFit' : None })
 
-                                        if opt.breaksyst:
-                                            if syst in type1Systematics: breakdownCovarianceMatrices['type1'][row][column] += matrixElement
-                                            elif syst in type3Systematics: breakdownCovarianceMatrices['type3'][row][column] += matrixElement
-                                            elif syst in type2Systematics: 
-                                                if syst not in breakdownCovarianceMatrices:
-                                                    breakdownCovarianceMatrices[syst] = ROOT.TMatrixD(nMeasurements, nMeasurements)
-                                                    breakdownCovarianceMatrices[syst] *= 0.
-                                                breakdownCovarianceMatrices[syst][row][column] += matrixElement
+    combinationRecords.append({ 'campaign' : '+'.join(campaignNames), 'jointCampaigns' : campaignNames,
+                                'vetoedMethods' : sorted(set(sum([ eraVetoedMethods for eraVetoedMethods, eraMaskedMethods in eraMethods ], []))),
+                                'maskedMethods' : sorted(set(sum([ eraMaskedMethods for eraVetoedMethods, eraMaskedMethods in eraMethods ], []))),
+                                'nMeasurements' : nMeasurements, 'normalizedChi2' : float(averageChi2/averageNdf if averageNdf>0 else averageChi2), 'ptbins' : list(jointCovarianceBuilder.ptbins),
+                                'scaleFactors' : averageScaleFactorVector.tolist(), 'uncertainties' : averageScaleFactorUncertaintyVector.tolist(), 'breakdowns' : OrderedDict(), 'ptFit' : None })
 
-                                        if opt.yearcorr:
-                                            if syst in systematicYearCorrelated: breakdownCovarianceMatrices['correlated'][row][column] += matrixElement
-                                            if syst in systematicYearUncorrelated: breakdownCovarianceMatrices['uncorrelated'][row][column] += matrixElement
+    return combinationRecords
 
-                                column += 1
+# Combine the measurements of one algorithm, combination, and working point of all the campaigns of the joint
+# combination, with the covariance of JointCovarianceBuilder, factorized once for the era-specific and the
+# era-averaged fits. The results are printed, and are before the sample dependence and chi2 inflation treatments
+def combineJointScaleFactors(algo, comb, wp):
 
-                        row += 1
+    profiler.begin()
 
-                if covarianceMatrix.Determinant()==0.:
-                    print('Covariance matrix not invertible for combination', comb, 'algorithm', algo, 'working point', wp)
-                    continue
+    covarianceBuilders, eraMethods = [], []
 
-                # Make the fit
-                transposedMatrixU = ROOT.TMatrixD(nCombinedScaleFactors, nMeasurements)
-                transposedMatrixU.Transpose(matrixU)
- 
-                inverseCovarianceMatrix = ROOT.TMatrixD(covarianceMatrix)
-                inverseCovarianceMatrix.Invert()
+    try:
+        for eraCampaign in jointCampaigns:
 
-                auxiliaryMatrix1 = ROOT.TMatrixD(nCombinedScaleFactors, nMeasurements)
-                auxiliaryMatrix1.Mult(transposedMatrixU, inverseCovarianceMatrix) 
+            activateCampaign(eraCampaign)
+            if algo not in algorithms or wp not in workingPoints or comb not in combinations:
+                print('Error: combination', comb, 'algorithm', algo, 'working point', wp, 'not defined in campaign', eraCampaign.name)
+                exit()
 
-                auxiliaryMatrix2 = ROOT.TMatrixD(nCombinedScaleFactors, nCombinedScaleFactors)
-                auxiliaryMatrix2.Mult(auxiliaryMatrix1, matrixU)
+            measuredScaleFactors, measurementPlotPoints = readMeasuredScaleFactors(eraCampaign.name, algo, comb, wp)
+            if len(measuredScaleFactors)==0:
+                print('No measurements for combination', comb, 'algorithm', algo, 'working point', wp, 'in campaign', eraCampaign.name)
+                return [], None, []
 
-                if auxiliaryMatrix2.Determinant()==0.:
-                   print('Auxiliary matrix 2 not invertible for combination', comb, 'algorithm', algo, 'working point', wp)
-                   continue
+            measurementVectors = combinationEngine.MeasurementVectors(measuredScaleFactors)
+            covarianceBuilders.append(combinationEngine.CovarianceBuilder(measurementVectors, systematicClassification, statisticalCorrelationCoefficients))
+            eraMethods.append((list(vetoedMethods), list(maskedMethods)))
 
-                auxiliaryMatrix2.Invert()
+    finally:
+        activateCampaign(jointCampaigns[0])
 
-                coefficientsMatrix = ROOT.TMatrixD(nCombinedScaleFactors, nMeasurements)
-                coefficientsMatrix.Mult(auxiliaryMatrix2, auxiliaryMatrix1)
+    jointCovarianceBuilder = combinationEngine.JointCovarianceBuilder(covarianceBuilders)
+    covarianceFactorization = combinationEngine.factorizeCovariance(jointCovarianceBuilder, jointCovarianceBuilder.covariance(), opt.solver)
 
-                # Get the scale factors and their uncertainties
-                combinedScaleFactorVector = ROOT.TMatrixD(nCombinedScaleFactors, 1)
-                combinedScaleFactorVector.Mult(coefficientsMatrix, scaleFactorVector)
-                #coefficientsMatrix.Print()
+    profiler.lap('covariance')
 
-                transposedCoefficientsMatrix = ROOT.TMatrixD(nMeasurements, nCombinedScaleFactors)
-                transposedCoefficientsMatrix.Transpose(coefficientsMatrix)
+    eraSolver = combinationEngine.GeneralizedLeastSquaresSolver(jointCovarianceBuilder.matrixU, None, covarianceFactorization)
+    averageSolver = combinationEngine.GeneralizedLeastSquaresSolver(jointCovarianceBuilder.averageMatrixU, None, covarianceFactorization)
 
-                auxiliaryMatrix3 = ROOT.TMatrixD(nCombinedScaleFactors, nMeasurements)
-                auxiliaryMatrix3.Mult(coefficientsMatrix, covarianceMatrix)
+    if not eraSolver.solvable or not averageSolver.solvable:
+        print('Joint covariance matrix not invertible for combination', comb, 'algorithm', algo, 'working point', wp)
+        return [], None, []
 
-                scaleFactorUncertaintyMatrix = ROOT.TMatrixD(nCombinedScaleFactors, nCombinedScaleFactors)
-                scaleFactorUncertaintyMatrix.Mult(auxiliaryMatrix3, transposedCoefficientsMatrix)
-            
-                combinedScaleFactorUncertaintyVector = ROOT.TMatrixD(nCombinedScaleFactors, 1)
-                for iptbin in range(nCombinedScaleFactors): 
-                    combinedScaleFactorUncertaintyVector[iptbin][0] = math.sqrt(scaleFactorUncertaintyMatrix[iptbin][iptbin])
+    printConditioningWarning('Joint covariance matrix', covarianceFactorization, algo, comb, wp)
 
-                combinedScaleFactorUncertaintyBreakdownVectors = OrderedDict()
+    profiler.lap('solve')
 
-                for syst in breakdownCovarianceMatrices:
+    combinationRecords = printJointCombination(algo, comb, wp, jointCovarianceBuilder, eraSolver, averageSolver, eraMethods)
 
-                    breakdownAuxiliaryMatrix3 = ROOT.TMatrixD(nCombinedScaleFactors, nMeasurements)
-                    breakdownAuxiliaryMatrix3.Mult(coefficientsMatrix, breakdownCovarianceMatrices[syst])
+    profiler.lap('printout')
 
-                    scaleFactorUncertaintyBreakdownMatrix = ROOT.TMatrixD(nCombinedScaleFactors, nCombinedScaleFactors)
-                    scaleFactorUncertaintyBreakdownMatrix.Mult(breakdownAuxiliaryMatrix3, transposedCoefficientsMatrix)
+    return [], None, combinationRecords
 
-                    combinedScaleFactorUncertaintyBreakdownVector = ROOT.TMatrixD(nCombinedScaleFactors, 1)
+# Combine the scale factor measurements for one algorithm, combination, and working point. The csv
+# entries are returned as tuples, the plot as a spec to be drawn by plotRenderer, and the results as
+# records for the results store, so that they can be assembled in the parent process
+def combineScaleFactors(algo, comb, wp):
 
-                    for iptbin in range(nCombinedScaleFactors): 
-                        if scaleFactorUncertaintyBreakdownMatrix[iptbin][iptbin]<0. and abs(scaleFactorUncertaintyBreakdownMatrix[iptbin][iptbin])<9.9e-06:
-                            combinedScaleFactorUncertaintyBreakdownVector[iptbin][0] = 0.
-                        else:
-                            print(syst, iptbin, scaleFactorUncertaintyBreakdownMatrix[iptbin][iptbin])
-                            combinedScaleFactorUncertaintyBreakdownVector[iptbin][0] = math.sqrt(scaleFactorUncertaintyBreakdownMatrix[iptbin][iptbin])
+    profiler.begin()
+
+    csvEntries = []
+
+    measuredScaleFactors, measurementPlotPoints = readMeasuredScaleFactors(opt.campaign, algo, comb, wp)
+
+    # Build the matrices for the fit
+    measurementVectors = combinationEngine.MeasurementVectors(measuredScaleFactors)
+    nMeasurements, nCombinedScaleFactors = len(measurementVectors), len(measurementVectors.ptbins)
+
+    matrixU = measurementVectors.matrixU
+    scaleFactorVector = measurementVectors.scaleFactorVector
+
+    covarianceBuilder = combinationEngine.CovarianceBuilder(measurementVectors, systematicClassification, statisticalCorrelationCoefficients)
+    covarianceMatrix = covarianceBuilder.covariance()
+
+    breakdownCovarianceMatrices = combinationEngine.buildBreakdownCovarianceMatrices(covarianceBuilder, opt.breaksyst, opt.yearcorr)
+
+    profiler.lap('covariance')
+
+    if opt.sweepmasks!='':
+        printMaskSweep(algo, comb, wp, measurementVectors, covarianceMatrix)
+        profiler.lap('sweep')
+        return csvEntries, None, []
+
+    # Make the fit
+    covarianceFactorization = combinationEngine.factorizeCovariance(covarianceBuilder, covarianceMatrix, opt.solver)
+    solver = combinationEngine.GeneralizedLeastSquaresSolver(matrixU, covarianceMatrix, covarianceFactorization)
+
+    if not solver.covarianceFactorization.invertible:
+        print('Covariance matrix not invertible for combination', comb, 'algorithm', algo, 'working point', wp)
+        return csvEntries, None, []
+
+    if not solver.fisherFactorization.invertible:
+       print('Auxiliary matrix 2 not invertible for combination', comb, 'algorithm', algo, 'working point', wp)
+       return csvEntries, None, []
+
+    printConditioningWarning('Covariance matrix', solver.covarianceFactorization, algo, comb, wp)
+    printConditioningWarning('Auxiliary matrix 2', solver.fisherFactorization, algo, comb, wp)
+
+    coefficientsMatrix = solver.coefficientsMatrix
+
+    # Get the scale factors and their uncertainties
+    combinedScaleFactorVector = solver.combine(scaleFactorVector)
+
+    scaleFactorUncertaintyMatrix = solver.scaleFactorUncertaintyMatrix
+    combinedScaleFactorUncertaintyVector = numpy.sqrt(numpy.diag(scaleFactorUncertaintyMatrix))
+
+    profiler.lap('solve')
+
+    combinedScaleFactorUncertaintyBreakdowns = combinationEngine.propagateBreakdownUncertainties(coefficientsMatrix, breakdownCovarianceMatrices)
+    combinedScaleFactorUncertaintyBreakdownVectors = OrderedDict(zip(breakdownCovarianceMatrices.keys(), combinedScaleFactorUncertaintyBreakdowns))
+
+    profiler.lap('breakdowns')
+
+    # Compute the fit chi2, and the residuals and pulls of the single measurements
+    measurementResiduals = solver.residuals(scaleFactorVector, combinedScaleFactorVector)
+    measurementPulls = solver.pulls(measurementResiduals)
+    chi2, ndf = solver.chi2(measurementResiduals), nMeasurements - nCombinedScaleFactors
+    normalizedChi2 = chi2/ndf if ndf>0 else chi2
+
+    # Special error treatments, in case of mis-agreement between the scale factor measurements
+    if sampleDependence>0.:
+
+        for iptbin in range(nCombinedScaleFactors):
+
+            sampleDependenceUncertaintySquared = pow(sampleDependence*combinedScaleFactorVector[iptbin],2)
+            combinedScaleFactorUncertaintyVector[iptbin] = math.sqrt(pow(combinedScaleFactorUncertaintyVector[iptbin],2)+sampleDependenceUncertaintySquared)
+            for syst in [ 'type3', 'correlated' ]:
+                if syst in combinedScaleFactorUncertaintyBreakdownVectors:
+                    combinedScaleFactorUncertaintyBreakdownVectors[syst][iptbin] = math.sqrt(pow(combinedScaleFactorUncertaintyBreakdownVectors[syst][iptbin],2)+sampleDependenceUncertaintySquared)
+
+    elif normalizedChi2>normalizedChi2Tollerance:
+
+        for iptbin in range(nCombinedScaleFactors):
+
+            chi2InflationFactor = math.sqrt(normalizedChi2)
+            combinedScaleFactorUncertaintyVector[iptbin] *= chi2InflationFactor
+            for syst in [ 'type1', 'uncorrelated' ]:
+                if syst in combinedScaleFactorUncertaintyBreakdownVectors:
+                    chi2InflationSquared = pow(combinedScaleFactorUncertaintyVector[iptbin],2)*(1.-1./pow(chi2InflationFactor,2))
+                    combinedScaleFactorUncertaintyBreakdownVectors[syst][iptbin] = math.sqrt(pow(combinedScaleFactorUncertaintyBreakdownVectors[syst][iptbin],2)+chi2InflationSquared)
+
+    profiler.lap('chi2')
+
+    # Toy experiments, generated from the covariance matrix around the combined scale factors. The uncertainties
+    # are compared before the sample dependence and chi2 inflation treatments
+    if opt.toys>0:
+
+        try:
+            toyExperiments = combinationEngine.ToyExperiments(solver, combinedScaleFactorVector, opt.toys, toySeed(algo, comb, wp))
+        except ValueError as error:
+            print('Toy experiments not generated for combination', comb, 'algorithm', algo, 'working point', wp, ':', error)
+            toyExperiments = None
+
+        profiler.lap('toys')
+
+    # Fit pt-dependence of combined scale factors
+    if opt.doptfit or not opt.plotoff:
+
+        minCombinedPt, maxCombinedPt = 999999., -1.
+        ptBinErrorScaleVector = numpy.ones(nCombinedScaleFactors)
+
+        for iptbin, ptbin in enumerate(measuredScaleFactors):
+
+            minPt, maxPt = float(ptbin.split('-')[1].split('to')[0]), float(ptbin.split('to')[1])
+
+            if comb in ptBinErrorScales and algo in ptBinErrorScales[comb] and wp in ptBinErrorScales[comb][algo] and ptbin in ptBinErrorScales[comb][algo][wp]: 
+                ptBinErrorScaleVector[iptbin] = ptBinErrorScales[comb][algo][wp][ptbin]
+
+            minCombinedPt = min(minCombinedPt, minPt)
+            maxCombinedPt = max(maxCombinedPt, maxPt)
+
+        if opt.doptfit:
+
+            minPt = numpy.array([ float(ptbin.split('-')[1].split('to')[0]) for ptbin in measuredScaleFactors ])
+            maxPt = numpy.array([ float(ptbin.split('to')[1]) for ptbin in measuredScaleFactors ])
+            midPt, halfWidthPt = (maxPt+minPt)/2., (maxPt-minPt)/2.
+            fitUncertaintyVector = ptBinErrorScaleVector*combinedScaleFactorUncertaintyVector
+
+            if opt.rootfit:
+
+                graphCombinedScaleFactorsForFit = ROOT.TGraphErrors()
+                for iptbin in range(nCombinedScaleFactors):
+                    graphCombinedScaleFactorsForFit.SetPoint(iptbin, midPt[iptbin], combinedScaleFactorVector[iptbin])
+                    graphCombinedScaleFactorsForFit.SetPointError(iptbin, halfWidthPt[iptbin], fitUncertaintyVector[iptbin])
+
+                fittingFunction = fittingFunctions[comb][algo][wp].makeTF1('fittingFunction', minCombinedPt, maxCombinedPt)
+                fittingFunction.SetLineColor(ROOT.kBlack)
+                fittingFunction.SetLineWidth(2)
+                fittingFunction.SetLineStyle(1)
+
+                graphCombinedScaleFactorsForFit.Fit('fittingFunction', '0',    '', minCombinedPt, maxCombinedPt)
+                graphCombinedScaleFactorsForFit.Fit('fittingFunction', 'rve0', '', minCombinedPt, maxCombinedPt)
+
+                ptFitResult = ptDependenceFit.RootFitResult(fittingFunction, fittingFunctions[comb][algo][wp].formula, minCombinedPt, maxCombinedPt)
+
+            else:
+
+                # With --ptfitcov the bin-to-bin correlations of the combined scale factors are kept, with the
+                # uncertainties after the sample dependence and chi2 treatments
+                if opt.ptfitcov:
+                    scaleFactorCorrelationMatrix = scaleFactorUncertaintyMatrix/numpy.outer(numpy.sqrt(numpy.diag(scaleFactorUncertaintyMatrix)), numpy.sqrt(numpy.diag(scaleFactorUncertaintyMatrix)))
+                    fitCovarianceMatrix = scaleFactorCorrelationMatrix*numpy.outer(fitUncertaintyVector, fitUncertaintyVector)
+                else:
+                    fitCovarianceMatrix = numpy.diag(fitUncertaintyVector*fitUncertaintyVector)
+
+                try:
+                    ptFitResult = ptDependenceFit.fitPtDependence(fittingFunctions[comb][algo][wp], midPt, halfWidthPt, combinedScaleFactorVector, fitCovarianceMatrix, minCombinedPt, maxCombinedPt)
+                except ptDependenceFit.PtFitError as error:
+                    print('Error:', error, 'for combination', comb, 'algorithm', algo, 'working point', wp, '(use --rootfit for other functions)')
+                    exit()
+
+            ptFitResult.cacheBinAverages(midPt)
+
+        profiler.lap('ptfit')
+
+    # Print results
+    print('\nFit performed for combination', comb, 'algorithm', algo, 'working point', wp, 'with normalized Chi2 =', normalizedChi2, '\n')
+    for iptbin, ptbin in enumerate(measuredScaleFactors):
+        print('    Combined scale factor for pt bin', ptbin, ':', round(combinedScaleFactorVector[iptbin],3), '+-', round(combinedScaleFactorUncertaintyVector[iptbin],3))
+    print('\n')
+
+    if opt.printpulls:
+        for meas, (ptbin, method) in enumerate(measurementVectors.measurements):
+            print('    Measurement', method, 'in pt bin', ptbin, ': residual', round(measurementResiduals[meas],4), 'pull', round(measurementPulls[meas],2))
+        print('\n')
+
+    if opt.toys>0 and toyExperiments is not None:
+        printToyExperiments(measurementVectors, numpy.sqrt(numpy.diag(solver.scaleFactorUncertaintyMatrix)), toyExperiments, chi2, ndf)
+
+    if opt.doptfit:
+        print('Pt-dependence function:', ptFitResult.formula(), '\n')
+        if ptFitResult.parameterCovariance is not None:
+            print('    Fit parameters:', ', '.join([ '%g +- %g' % (parameter, math.sqrt(max(variance, 0.))) for parameter, variance in zip(ptFitResult.parameters, numpy.diag(ptFitResult.parameterCovariance)) ]),
+                  'with chi2/ndf', round(ptFitResult.chi2,3), '/', ptFitResult.ndf, '\n')
+        if not ptFitResult.converged:
+            print('    Fit not converged ('+ptFitResult.failure+'): parameters', ', '.join([ '%g' % parameter for parameter in ptFitResult.parameters ]), 'with chi2/ndf', round(ptFitResult.chi2,3), '/', ptFitResult.ndf, '\n')
+        chi2ptfit = 0.
+        fittedScaleFactorsAtMidPt = ptFitResult.evaluate(midPt)
+        for iptbin, ptbin in enumerate(measuredScaleFactors):
+            chi2ptfit += pow((fittedScaleFactorsAtMidPt[iptbin]-combinedScaleFactorVector[iptbin])/combinedScaleFactorUncertaintyVector[iptbin], 2)
+            print('    Fitted scale factor for pt bin', ptbin, ':', round(fittedScaleFactorsAtMidPt[iptbin],3), 'difference with combined scale factor:', round(fittedScaleFactorsAtMidPt[iptbin]-combinedScaleFactorVector[iptbin],3))
+        print('    Chi2:', math.sqrt(chi2ptfit))
+    print('\n')
+
+    profiler.lap('printout')
+
+    # Record the results for the results store
+    ptFitRecord = None
+
+    if opt.doptfit:
+        ptFitRecord = { 'formula' : ptFitResult.formula(), 'parameters' : [ float(parameter) for parameter in ptFitResult.parameters ],
+                        'uncertainties' : None if ptFitResult.parameterCovariance is None else numpy.sqrt(numpy.clip(numpy.diag(ptFitResult.parameterCovariance), 0., None)).tolist(),
+                        'chi2' : float(ptFitResult.chi2), 'ndf' : int(ptFitResult.ndf), 'binAverages' : [ float(binAverage) for binAverage in ptFitResult.binAverages ] }
+
+    combinationRecords = [ { 'campaign' : opt.campaign, 'jointCampaigns' : [], 'vetoedMethods' : list(vetoedMethods), 'maskedMethods' : list(maskedMethods),
+                             'nMeasurements' : nMeasurements, 'normalizedChi2' : float(normalizedChi2), 'ptbins' : list(measuredScaleFactors),
+                             'scaleFactors' : combinedScaleFactorVector.tolist(), 'uncertainties' : combinedScaleFactorUncertaintyVector.tolist(),
+                             'breakdowns' : OrderedDict([ (syst, numpy.asarray(uncertainties).tolist()) for syst, uncertainties in combinedScaleFactorUncertaintyBreakdownVectors.items() ]),
+                             'ptFit' : ptFitRecord } ]
+
+    # Store results for csv files 
+    if opt.store:
+
+        for csvFlavour in jetFlavoursToBeStored:
+
+            systematicsToBeStored = [ 'up', 'down' ]
 
-                    combinedScaleFactorUncertaintyBreakdownVectors[syst] = combinedScaleFactorUncertaintyBreakdownVector
+            if opt.storebyfunction:
 
-                # Compute the fit chi2 
-                normalizedChi2 = 0.
+                centralScaleFactor = ptFitResult.formula().replace('--','+')
+                csvEntries.append((int(csvWorkingPoints[wp]), comb, 'central', int(csvFlavour), 0., maxEtaCampaign, 
+                                   minCombinedPt, maxCombinedPt, algorithms[algo][0], algorithms[algo][1], centralScaleFactor))
 
-                for meas0 in range(nMeasurements):
-                    for meas1 in range(nMeasurements): 
-                        for ptbin0 in range(nCombinedScaleFactors):
-                            for ptbin1 in range(nCombinedScaleFactors):
-                                normalizedChi2 += matrixU[meas0][ptbin0]*(scaleFactorVector[meas0][0]-combinedScaleFactorVector[ptbin0][0])*inverseCovarianceMatrix[meas0][meas1]*matrixU[meas1][ptbin1]*(scaleFactorVector[meas1][0]-combinedScaleFactorVector[ptbin1][0])
+            else: systematicsToBeStored.insert(0, 'central')
 
-                if nMeasurements>nCombinedScaleFactors: normalizedChi2 /= (nMeasurements - nCombinedScaleFactors)
+            for syst in combinedScaleFactorUncertaintyBreakdownVectors:
+                systematicsToBeStored.append('up_'+syst)
+                systematicsToBeStored.append('down_'+syst)
 
-                # Special error treatments, in case of mis-agreement between the scale factor measurements
-                if sampleDependence>0.:
+            for iptbin, ptbin in enumerate(measuredScaleFactors):
 
-                    for iptbin in range(nCombinedScaleFactors):
+                minPt, maxPt = float(ptbin.split('-')[1].split('to')[0]), float(ptbin.split('to')[1])
+                midPt = (maxPt+minPt)/2.
 
-                        sampleDependenceUncertaintySquared = pow(sampleDependence*combinedScaleFactorVector[iptbin][0],2)
-                        combinedScaleFactorUncertaintyVector[iptbin][0] = math.sqrt(pow(combinedScaleFactorUncertaintyVector[iptbin][0],2)+sampleDependenceUncertaintySquared)
-                        for syst in [ 'type3', 'correlated' ]:
-                            if syst in combinedScaleFactorUncertaintyBreakdownVectors:
-                                combinedScaleFactorUncertaintyBreakdownVectors[syst][iptbin][0] = math.sqrt(pow(combinedScaleFactorUncertaintyBreakdownVectors[syst][iptbin][0],2)+sampleDependenceUncertaintySquared)
+                for syst in systematicsToBeStored:
 
-                elif normalizedChi2>normalizedChi2Tollerance:
+                    if syst=='central': 
 
-                    for iptbin in range(nCombinedScaleFactors):
+                        centralScaleFactor = str(combinedScaleFactorVector[iptbin])
+                        scaleFactorSystematic = ''
 
-                        chi2InflationFactor = math.sqrt(normalizedChi2)
-                        combinedScaleFactorUncertaintyVector[iptbin][0] *= chi2InflationFactor
-                        for syst in [ 'type1', 'uncorrelated' ]:
-                            if syst in combinedScaleFactorUncertaintyBreakdownVectors:
-                                chi2InflationSquared = pow(combinedScaleFactorUncertaintyVector[iptbin][0],2)*(1.-1./pow(chi2InflationFactor,2))
-                                combinedScaleFactorUncertaintyBreakdownVectors[syst][iptbin][0] = math.sqrt(pow(combinedScaleFactorUncertaintyBreakdownVectors[syst][iptbin][0],2)+chi2InflationSquared)
+                    else:
 
-                # Fit pt-dependence of combined scale factors
-                if opt.doptfit or not opt.plotoff:
+                        if '_' not in syst: scaleFactorUncertainty = combinedScaleFactorUncertaintyVector[iptbin]
+                        else: scaleFactorUncertainty = combinedScaleFactorUncertaintyBreakdownVectors[syst.split('_')[1]][iptbin]
+                        
+                        if opt.storebyfunction:        
+                            scaleFactorUncertainty *= ptFitResult.binAverages[iptbin]/combinedScaleFactorVector[iptbin]
 
-                    graphCombinedScaleFactors, graphCombinedScaleFactorsForFit = ROOT.TGraphErrors(), ROOT.TGraphErrors()
-                    minCombinedPt, maxCombinedPt = 999999., -1.
+                        if csvFlavour==btagCalibrationWriter.flavourC:
+                            scaleFactorUncertainty *= cJetsInflationFactor[wp] 
 
-                    for iptbin, ptbin in enumerate(measuredScaleFactors):
+                        if syst.split('_')[0]=='up': scaleFactorSystematic = '+'+str(scaleFactorUncertainty) if scaleFactorUncertainty>=0. else str(scaleFactorUncertainty)
+                        elif syst.split('_')[0]=='down': scaleFactorSystematic = '-'+str(scaleFactorUncertainty) if scaleFactorUncertainty>=0. else '+'+str(abs(scaleFactorUncertainty))
 
-                        minPt, maxPt = float(ptbin.split('-')[1].split('to')[0]), float(ptbin.split('to')[1])
-                        midPt = (maxPt+minPt)/2.
+                    csvEntries.append((int(csvWorkingPoints[wp]), comb, syst.replace('type1','statistic'), int(csvFlavour), 
+                                       0., maxEtaCampaign, minPt, maxPt, algorithms[algo][0], algorithms[algo][1], centralScaleFactor+scaleFactorSystematic))
 
-                        ptBinErrorScale = 1.
-                        if comb in ptBinErrorScales and algo in ptBinErrorScales[comb] and wp in ptBinErrorScales[comb][algo] and ptbin in ptBinErrorScales[comb][algo][wp]: 
-                            ptBinErrorScale = ptBinErrorScales[comb][algo][wp][ptbin]
+        profiler.lap('csv')
 
-                        graphCombinedScaleFactors.SetPoint(iptbin, midPt, combinedScaleFactorVector[iptbin][0])
-                        graphCombinedScaleFactors.SetPointError(iptbin, (maxPt-minPt)/2., combinedScaleFactorUncertaintyVector[iptbin][0])
+    # Record the plot of the results of the scale factor combination
+    plotSpec = None
 
-                        graphCombinedScaleFactorsForFit.SetPoint(iptbin, midPt, combinedScaleFactorVector[iptbin][0])
-                        graphCombinedScaleFactorsForFit.SetPointError(iptbin, (maxPt-minPt)/2., ptBinErrorScale*combinedScaleFactorUncertaintyVector[iptbin][0])
+    if not opt.plotoff:
 
-                        minCombinedPt = min(minCombinedPt, minPt)
-                        maxCombinedPt = max(maxCombinedPt, maxPt)
+        minPt = numpy.array([ float(ptbin.split('-')[1].split('to')[0]) for ptbin in measuredScaleFactors ])
+        maxPt = numpy.array([ float(ptbin.split('to')[1]) for ptbin in measuredScaleFactors ])
+        midPt, halfWidthPt = (maxPt+minPt)/2., (maxPt-minPt)/2.
 
-                    if opt.doptfit:
+        plotHeader = algo + ' ' + ''.join([ x for x in wp if x.isupper() ])
+
+        plotMeasurements = [ 'NoPtFit' ] if opt.plotfitoff else []
+        for method in measurementPlotPoints: plotMeasurements.append(('masked' if method in maskedMethods else '')+measurements[method]['plotname'])
+
+        plotSpec = { 'header' : plotHeader, 'luminosityLabel' : campaignLuminosity + centerOfMassEnergy, 'widthYAxis' : widthYAxis, 'ptRange' : (minCombinedPt, maxCombinedPt),
+                     'measurements' : list(measurementPlotPoints.values()),
+                     'combined' : { 'x' : midPt, 'ex' : halfWidthPt, 'y' : combinedScaleFactorVector, 'ey' : combinedScaleFactorUncertaintyVector },
+                     'fit' : None,
+                     'plotDirectory' : '/'.join([ opt.plotdir, opt.campaign, '_'.join(plotMeasurements), '' ]), 'indexFileName' : opt.plotdir+'/index.php',
+                     'plotName' : '_'.join([ 'SFb', opt.campaign, plotHeader.replace(' ',''), '_'.join(plotMeasurements) ]),
+                     'plotFormats' : opt.plotformat.split('-') }
+
+        if not opt.plotfitoff:
+
+            fittedScaleFactors = ptFitResult.binAverages
+
+            plotSpec['fit'] = { 'formula' : fittingFunctions[comb][algo][wp].formula, 'minPt' : minCombinedPt, 'maxPt' : maxCombinedPt,
+                                'parameters' : [ float(parameter) for parameter in ptFitResult.parameters ],
+                                'x' : midPt, 'ex' : halfWidthPt, 'y' : fittedScaleFactors, 'ey' : combinedScaleFactorUncertaintyVector*fittedScaleFactors/combinedScaleFactorVector }
+
+        profiler.lap('plotting')
+
+    return csvEntries, plotSpec, combinationRecords
+
+# Worker for the process pool: the printout of each combination is collected and returned to the parent
+# process, to be printed in the same order as for a serial run, together with the csv entries, plot spec,
+# result records, and profiled stages
+def runCombination(task):
+
+    algo, comb, wp = task
+    combine = combineJointScaleFactors if len(jointCampaigns)>0 else combineScaleFactors
+
+    profiler.beginTask(task)
+
+    if opt.jobs<=1 and not opt.incremental:
+        csvEntries, plotSpec, combinationRecords = combine(algo, comb, wp)
+        return '', csvEntries, plotSpec, combinationRecords, profiler.endTask(task), False
+
+    output = io.StringIO()
+    csvEntries, plotSpec, combinationRecords, exitRequested = [], None, [], False
+
+    with contextlib.redirect_stdout(output):
+        try:
+            csvEntries, plotSpec, combinationRecords = combine(algo, comb, wp)
+        except SystemExit:
+            exitRequested = True
+
+    return output.getvalue(), csvEntries, plotSpec, combinationRecords, profiler.endTask(task), exitRequested
+
+# Options that don't change the results of a single combination, and are therefore left out of its input hash
+manifestIgnoredOptions = [ 'algorithm', 'combination', 'workingpoint', 'vetomethod', 'maskmethod', 'publish', 'csvfiledir', 'standalone',
+                           'jobs', 'cachedir', 'cacheoff', 'incremental', 'manifestdir', 'resultsdb', 'resultsoff', 'keepspool', 'profile', 'profiledump' ]
+
+# Settings that apply to all the combinations of the campaign
+campaignWideSettings = [ setting for setting in campaignConfig.requiredSettings if setting not in [ 'algorithms', 'workingPoints', 'combinations', 'measurements',
+                         'vetoedMethods', 'maskedMethods', 'maskedMeasurements', 'fittingFunctions', 'ptBinErrorScales', 'cJetsInflationFactor' ] ]
+
+# Inputs of the combination for one algorithm, combination, and working point: the measurement files it reads, the
+# campaign settings it uses, the options, and the code. The measurement files are returned separately, as None
+# if any is missing, in which case the combination is always rerun to report it
+def combinationInputs(algo, comb, wp):
+
+    measurementDir = '/'.join([ '..', 'btv-scale-factors', opt.campaign, 'csv', 'btagging_fixedWP_SFb', '' ])
+    usedMethods = [ method for method in measurements if comb in measurements[method]['data'] and method not in vetoedMethods ]
+
+    measurementFiles = []
+    for method in usedMethods:
+        measurementFileName = measurementLoader.findMeasurementFile(measurementDir, algo, workingPoints[wp], method, measurements[method]['version'])
+        if measurementFileName is None: return None, None
+        measurementFiles.append([ measurementFileName, measurementLoader.measurementFileHash(measurementFileName) ])
+
+    campaignSlice = { 'algorithm' : algorithms[algo], 'workingPoint' : workingPoints[wp],
+                      'measurements' : [ [ method, measurements[method] ] for method in usedMethods ],
+                      'maskedMethods' : [ method for method in maskedMethods if method in usedMethods ],
+                      'maskedMeasurements' : [ [ method, maskedMeasurements[method].get(algo, {}).get(wp, None) ] for method in usedMethods if method in maskedMeasurements ],
+                      'fittingFunction' : fittingFunctions.get(comb, {}).get(algo, {}).get(wp, None),
+                      'ptBinErrorScales' : ptBinErrorScales.get(comb, {}).get(algo, {}).get(wp, None),
+                      'cJetsInflationFactor' : cJetsInflationFactor.get(wp, None),
+                      'csvWorkingPoint' : csvWorkingPoints[wp] if opt.store else None }
+    for setting in campaignWideSettings: campaignSlice[setting] = globals()[setting]
+
+    options = { option : value for option, value in sorted(vars(opt).items()) if option not in manifestIgnoredOptions }
+
+    return measurementFiles, { 'measurementFiles' : measurementFiles, 'campaign' : campaignSlice, 'options' : options, 'code' : combinationCodeHash() }
+
+# Content hash of the code of the combination
+def combinationCodeHash():
+    return combinationManifest.hashFiles([ __file__, campaignConfig.__file__, combinationEngine.__file__, ptDependenceFit.__file__, measurementLoader.__file__, plotRenderer.__file__ ])
+
+# Add the result records of a combination to the results database, with the hash of its inputs, which is only
+# defined for the combinations of a single campaign
+def storeCombinationRecords(store, storeRun, task, combinationRecords, combinationHashes):
+
+    if len(combinationRecords)==0: return
+
+    inputHash = None
+    if len(jointCampaigns)==0:
+        if task in combinationHashes: inputHash = combinationHashes[task][0]
+        else:
+            measurementFiles, inputs = combinationInputs(*task)
+            if inputs is not None: inputHash = combinationManifest.hashInputs(inputs)
+
+    for combinationRecord in combinationRecords:
+        store.storeCombination(storeRun, *task, combinationRecord, inputHash)
+
+# Run the combinations of a campaign, as given by the command line arguments
+def main(arguments=None):
+
+    global opt, jetFlavoursToBeStored, profiler, jointCampaigns
+
+    # Input parameters
+    usage = 'usage: %prog [options]'
+    parser = optparse.OptionParser(usage)   
+    parser.add_option('--campaign'       , dest='campaign'       , help='Measurement campaign'           , default='') 
+    parser.add_option('--algorithm'      , dest='algorithm'      , help='Algorithms to be analysed'      , default='all')
+    parser.add_option('--combination'    , dest='combination'    , help='Combination to be performed'    , default='all')
+    parser.add_option('--workingpoint'   , dest='workingpoint'   , help='Working points to be analysed'  , default='all')
+    parser.add_option('--vetomethod'     , dest='vetomethod'     , help='Measurement methods to veto'    , default='NONE')
+    parser.add_option('--maskmethod'     , dest='maskmethod'     , help='Measurement methods to mask'    , default='NONE')
+    parser.add_option('--plotoff'        , dest='plotoff'        , help='Don\'t make plots'              , default=False, action='store_true')
+    parser.add_option('--plotfitoff'     , dest='plotfitoff'     , help='Don\'t plot pt-dependence fit'  , default=False, action='store_true')
+    parser.add_option('--plotformat'     , dest='plotformat'     , help='Plot formats, e.g.: png-pdf-root', default='png-pdf-root')
+    parser.add_option('--store'          , dest='store'          , help='Store csv files'                , default=False, action='store_true')
+    parser.add_option('--storebybins'    , dest='storebybins'    , help='Store csv files by bins'        , default=False, action='store_true')
+    parser.add_option('--breaksyst'      , dest='breaksyst'      , help='Store systematics breakdown'    , default=False, action='store_true')
+    parser.add_option('--yearcorr'       , dest='yearcorr'       , help='Store year correlations'        , default=False, action='store_true')
+    parser.add_option('--cjetsoff'       , dest='cjetsoff'       , help='Don\'t store SFs for c jets'    , default=False, action='store_true')
+    parser.add_option('--forceptfit'     , dest='forceptfit'     , help='Force the pt-dependence fit'    , default=False, action='store_true')
+    parser.add_option('--ptfitcov'       , dest='ptfitcov'       , help='Pt fit with bin-to-bin covariance', default=False, action='store_true')
+    parser.add_option('--rootfit'        , dest='rootfit'        , help='Pt fit with ROOT instead of numpy', default=False, action='store_true')
+    parser.add_option('--standalone'     , dest='standalone'     , help='Use standalone csv file format' , default=False, action='store_true')
+    parser.add_option('--publish'        , dest='publish'        , help='Publish csv file version'       , default='')
+    parser.add_option('--plotdir'        , dest='plotdir'        , help='Output directory for plots'     , default='./Plots')
+    parser.add_option('--csvfiledir'     , dest='csvfiledir'     , help='Output directory for csv files' , default='./CSVFiles')
+    parser.add_option('--ignoremismatch' , dest='ignoremismatch' , help='Ignore error mismatch'          , default=False, action='store_true')
+    parser.add_option('--printpulls'     , dest='printpulls'     , help='Print measurement pulls'        , default=False, action='store_true')
+    parser.add_option('--sweepmasks'     , dest='sweepmasks'     , help='Mask sweep: leaveoneout,subsets,ptbins', default='')
+    parser.add_option('--toys'           , dest='toys'           , help='Number of toy experiments'      , default=0, type='int')
+    parser.add_option('--toyseed'        , dest='toyseed'        , help='Seed of the toy experiments'    , default=1, type='int')
+    parser.add_option('--jointcampaigns' , dest='jointcampaigns' , help='Campaigns to combine jointly with --campaign', default='')
+    parser.add_option('--solver'         , dest='solver'         , help='Covariance solver: auto, dense, block', default='auto')
+    parser.add_option('--jobs'           , dest='jobs'           , help='Number of parallel processes'   , default=1, type='int')
+    parser.add_option('--cachedir'       , dest='cachedir'       , help='Cache dir. for measurement files', default='./MeasurementCache')
+    parser.add_option('--cacheoff'       , dest='cacheoff'       , help='Don\'t cache measurement files'  , default=False, action='store_true')
+    parser.add_option('--incremental'    , dest='incremental'    , help='Only rerun changed combinations' , default=False, action='store_true')
+    parser.add_option('--manifestdir'    , dest='manifestdir'    , help='Dir. for the combination results', default='./CombinationManifest')
+    parser.add_option('--resultsdb'      , dest='resultsdb'      , help='Database of the combination results', default='./CombinationResults.sqlite')
+    parser.add_option('--resultsoff'     , dest='resultsoff'     , help='Don\'t store results in the database', default=False, action='store_true')
+    parser.add_option('--keepspool'      , dest='keepspool'      , help='Keep the csv spool file on failure', default=False, action='store_true')
+    parser.add_option('--profile'        , dest='profile'        , help='Print time and memory by stage'  , default=False, action='store_true')
+    parser.add_option('--profiledump'    , dest='profiledump'    , help='cProfile output file (main proc.)', default='')
+    (opt, args) = parser.parse_args(arguments)
+
+    if opt.profile or opt.profiledump!='':
+        profiler = stageProfiler.makeProfiler(opt.profile, opt.profiledump)
+        profiler.start()
+
+    # Some setting
+    if not os.path.exists('./Campaigns/'+opt.campaign+'.py'):
+        print('Campaign', opt.campaign, 'not found. Please, specify a valid campaign name')
+        exit()
+
+    if os.environ.get('CMSSW_VERSION') is None or int(os.environ['CMSSW_VERSION'].split('_')[1])<=13: opt.standalone = True
+
+    if opt.storebybins or opt.breaksyst or opt.yearcorr or opt.publish!='': opt.store = True
+
+    if opt.store:
+
+        opt.storebyfunction = not opt.storebybins
+        jetFlavoursToBeStored = [ btagCalibrationWriter.flavourB ]
+        if not opt.cjetsoff: jetFlavoursToBeStored.append(btagCalibrationWriter.flavourC)
+
+        if opt.publish!='': 
+            opt.csvfiledir = '../btv-scale-factors/'+opt.campaign+'/csv/btagging_fixedWP_SFb/'
+        else: 
+            opt.csvfiledir += '/'+opt.campaign
+            os.system('mkdir -p '+opt.csvfiledir)
+
+    else:
+        opt.storebyfunction = False
+
+    if opt.solver not in combinationEngine.solverModes:
+        print('Error: unknown solver', opt.solver, '(valid solvers:', ', '.join(combinationEngine.solverModes)+')')
+        exit()
+
+    if opt.sweepmasks!='':
+
+        unknownSweepModes = [ sweepMode for sweepMode in opt.sweepmasks.split(',') if sweepMode not in maskSweepModes ]
+        if len(unknownSweepModes)>0:
+            print('Error: unknown mask sweep modes', ', '.join(unknownSweepModes), '(valid modes:', ', '.join(maskSweepModes)+')')
+            exit()
 
-                        fittingFunction = ROOT.TF1('fittingFunction', str(fittingFunctions[comb][algo][wp].GetExpFormula().ReplaceAll('p','')), minCombinedPt, maxCombinedPt)
-                        for par in range(fittingFunction.GetNpar()): fittingFunction.SetParameter(par, fittingFunctions[comb][algo][wp].GetParameter(par)) 
-                        fittingFunction.SetLineColor(ROOT.kBlack)
-                        fittingFunction.SetLineWidth(2)
-                        fittingFunction.SetLineStyle(1)
-
-                        graphCombinedScaleFactorsForFit.Fit('fittingFunction', '0',    '', minCombinedPt, maxCombinedPt)
-                        graphCombinedScaleFactorsForFit.Fit('fittingFunction', 'rve0', '', minCombinedPt, maxCombinedPt)
-
-                # Print results
-                print('\nFit performed for combination', comb, 'algorithm', algo, 'working point', wp, 'with normalized Chi2 =', normalizedChi2, '\n')
-                for iptbin, ptbin in enumerate(measuredScaleFactors):
-                    print('    Combined scale factor for pt bin', ptbin, ':', round(combinedScaleFactorVector[iptbin][0],3), '+-', round(combinedScaleFactorUncertaintyVector[iptbin][0],3))
-                print('\n')
-
-                if opt.doptfit:
-                    print('Pt-dependence function:', str(fittingFunction.GetExpFormula('p')), '\n')
-                    chi2ptfit = 0.
-                    for iptbin, ptbin in enumerate(measuredScaleFactors):
-                        midPt = (float(ptbin.split('-')[1].split('to')[0])+float(ptbin.split('to')[1]))/2.
-                        chi2ptfit += pow((fittingFunction.Eval(midPt)-combinedScaleFactorVector[iptbin][0])/combinedScaleFactorUncertaintyVector[iptbin][0], 2)
-                        print('    Fitted scale factor for pt bin', ptbin, ':', round(fittingFunction.Eval(midPt),3), 'difference with combined scale factor:', round(fittingFunction.Eval(midPt)-combinedScaleFactorVector[iptbin][0],3))
-                    print('    Chi2:', math.sqrt(chi2ptfit))
-                print('\n')
-
-                # Store results for csv files 
-                if opt.store:
-
-                    for csvFlavour in jetFlavoursToBeStored:
-
-                        systematicsToBeStored = [ 'up', 'down' ]
-
-                        if opt.storebyfunction:
-
-                            centralScaleFactor = str(fittingFunction.GetExpFormula('p')).replace('--','+')
-                            params = ROOT.BTagEntry.Parameters(csvWorkingPoints[wp], comb, 'central', csvFlavour, 0., maxEtaCampaign, 
-                                                               minCombinedPt, maxCombinedPt, algorithms[algo][0], algorithms[algo][1])
-                            SFFun = ROOT.TF1 ('SFFun', centralScaleFactor, minCombinedPt, maxCombinedPt)
-                            entry = ROOT.BTagEntry(SFFun, params)
-                            csvFile.addEntry(entry)
-
-                        else: systematicsToBeStored.insert(0, 'central')
-
-                        for syst in combinedScaleFactorUncertaintyBreakdownVectors:
-                            systematicsToBeStored.append('up_'+syst)
-                            systematicsToBeStored.append('down_'+syst)
-
-                        for iptbin, ptbin in enumerate(measuredScaleFactors):
-
-                            minPt, maxPt = float(ptbin.split('-')[1].split('to')[0]), float(ptbin.split('to')[1])
-                            midPt = (maxPt+minPt)/2.
-
-                            for syst in systematicsToBeStored:
-
-                                if syst=='central': 
-
-                                    centralScaleFactor = str(combinedScaleFactorVector[iptbin][0])
-                                    scaleFactorSystematic = ''
-
-                                else:
-
-                                    if '_' not in syst: scaleFactorUncertainty = combinedScaleFactorUncertaintyVector[iptbin][0]
-                                    else: scaleFactorUncertainty = combinedScaleFactorUncertaintyBreakdownVectors[syst.split('_')[1]][iptbin][0]
-                                    
-                                    if opt.storebyfunction:        
-                                        fittedScaleFactor = fittingFunction.Integral(midPt-1.,midPt+1.)/2.
-                                        scaleFactorUncertainty *= fittedScaleFactor/combinedScaleFactorVector[iptbin][0]
-
-                                    if csvFlavour==ROOT.BTagEntry.FLAV_C:
-                                        scaleFactorUncertainty *= cJetsInflationFactor[wp] 
-
-                                    if syst.split('_')[0]=='up': scaleFactorSystematic = '+'+str(scaleFactorUncertainty) if scaleFactorUncertainty>=0. else str(scaleFactorUncertainty)
-                                    elif syst.split('_')[0]=='down': scaleFactorSystematic = '-'+str(scaleFactorUncertainty) if scaleFactorUncertainty>=0. else '+'+str(abs(scaleFactorUncertainty))
-
-                                params = ROOT.BTagEntry.Parameters(csvWorkingPoints[wp], comb, syst.replace('type1','statistic'), csvFlavour, 
-                                                                   0., maxEtaCampaign, minPt, maxPt, algorithms[algo][0], algorithms[algo][1])
-                                SFFun = ROOT.TF1 ('SFFun', centralScaleFactor+scaleFactorSystematic, minPt, maxPt)
-                                entry = ROOT.BTagEntry(SFFun, params)
-                                csvFile.addEntry(entry)
-
-                # Plot the results of the scale factor combination
-                if not opt.plotoff:
-                 
-                    canvasHight = 350 if opt.plotfitoff else 700
-                    c1 = ROOT.TCanvas('c1','plots',200,0,700,canvasHight)
-                    c1.SetFillColor(10)
-                    c1.SetFillStyle(4000)
-                    c1.SetBorderSize(2)
-     
-                    padHight = 0.03 if opt.plotfitoff else 0.52
-                    pad1 = ROOT.TPad('pad1','This is pad1',0.02,padHight,0.98,0.98,21)
- 
-                    # Run2015B Setting
-                    ROOT.gStyle.SetOptFit(0)
-                    ROOT.gStyle.SetOptStat(0)
-                    ROOT.gStyle.SetOptTitle(0)
-                    c1.Range(0,0,1,1)
-                    c1.SetFillColor(10)
-                    c1.SetBorderMode(0)
-                    c1.SetBorderSize(2)
-                    c1.SetTickx(1)
-                    c1.SetTicky(1)
-                    c1.SetLeftMargin(0.16)
-                    c1.SetRightMargin(0.02)
-                    c1.SetTopMargin(0.05)
-                    c1.SetBottomMargin(0.13)
-                    c1.SetFrameFillColor(0)
-                    c1.SetFrameFillStyle(0)
-                    c1.SetFrameBorderMode(0)
-       
-                    pad1.SetFillColor(0)
-                    pad1.SetBorderMode(0)
-                    pad1.SetBorderSize(2)
-                    #pad1.SetLogy()
-                    pad1.SetLogx()
-                    pad1.SetTickx(1)
-                    pad1.SetTicky(1)
-                    pad1.SetLeftMargin(0.16)
-                    pad1.SetRightMargin(0.02)
-                    pad1.SetTopMargin(0.065)
-                    pad1.SetBottomMargin(0.13)
-                    pad1.SetFrameFillStyle(0)
-                    pad1.SetFrameBorderMode(0)
-                    pad1.SetFrameFillStyle(0)
-                    pad1.SetFrameBorderMode(0)
-                    pad1.Draw()
-     
-                    if not opt.plotfitoff:
-
-                        pad2 = ROOT.TPad('pad2','This is pad2',0.02,    0.03,0.98,0.49,21)
-
-                        pad2.SetFillColor(0)
-                        pad2.SetBorderMode(0)
-                        pad2.SetBorderSize(2)
-                        #pad2.SetGridy()
-                        pad2.SetLogx()
-                        pad2.SetTickx(1)
-                        pad2.SetTicky(1)
-                        pad2.SetLeftMargin(0.16)
-                        pad2.SetRightMargin(0.02)
-                        #pad2.SetTopMargin(0.05)
-                        #pad2.SetBottomMargin(0.31)
-                        pad2.SetTopMargin(0.065)
-                        pad2.SetBottomMargin(0.13)
-                        pad2.SetFrameFillStyle(0)
-                        pad2.SetFrameBorderMode(0)
-                        pad2.SetFrameFillStyle(0)
-                        pad2.SetFrameBorderMode(0)
-                        pad2.Draw()
-                        # End Run2015B Setting 
-       
-                    # Plot the measurements in the top pad
-                    pad1.cd()
-
-                    histo = ROOT.TH2F('histo','',58,minCombinedPt,maxCombinedPt,100,1.-widthYAxis,1.+widthYAxis)
-                    histo.SetLabelSize(0.05, 'XYZ')
-                    histo.SetTitleSize(0.06, 'XYZ') 
-                    histo.SetLabelFont(42, 'XYZ') 
-                    histo.SetTitleFont(42, 'XYZ')
-                    #histo.GetXaxis().SetTitle('Jet p_{T} [GeV]')
-                    histo.GetXaxis().SetTitle('p_{T} [GeV]')
-                    #histo.GetYaxis().SetTitle('Data/Simulation SF_{b}')
-                    histo.GetYaxis().SetTitle('SF_{b}')
-                    #histo.SetTitleOffset(1.1,'X') # Ideal for .png
-                    histo.SetTitleOffset(0.95,'X')
-                    histo.SetTitleOffset(0.8,'Y')
-                    histo.SetTickLength(0.06,'X')
-                    histo.SetNdivisions(509, 'XYZ')
-                    histo.GetXaxis().SetMoreLogLabels()
-                    histo.GetXaxis().SetNoExponent()
-                    histo.Draw('')
-                   
-                    for method in graphScaleFactors: graphScaleFactors[method].Draw('P')
-                    for method in graphScaleFactorsTotal: graphScaleFactorsTotal[method].Draw('P')                  
- 
-                    # Run2015B Style
-                    tex = ROOT.TLatex(0.2,0.88,'CMS') 
-                    tex.SetNDC() 
-                    tex.SetTextAlign(13)
-                    tex.SetTextFont(61)
-                    tex.SetTextSize(0.07475)
-                    tex.SetLineWidth(2) 
-                    tex.Draw()                                                                                       
-                    tex1 = ROOT.TLatex(0.2,0.79,'Preliminary') 
-                    tex1.SetNDC()
-                    tex1.SetTextAlign(13)
-                    tex1.SetTextFont(52)
-                    tex1.SetTextSize(0.05681)
-                    tex1.SetLineWidth(2)   
-                    tex1.Draw()   
-                    text1 = ROOT.TLatex(0.98,0.95125, campaignLuminosity + centerOfMassEnergy) 
-                    text1.SetNDC()                                              
-                    text1.SetTextAlign(31)                          
-                    text1.SetTextFont(42)    
-                    text1.SetTextSize(0.04875)   
-                    text1.SetLineWidth(2)    
-                    text1.Draw() 
-                    # End Run2015B Style
-
-                    # Print the combination result in the top pad
-                    graphCombinedScaleFactors.SetFillStyle(3005)
-                    graphCombinedScaleFactors.SetFillColor(ROOT.kGray+3)
-                    graphCombinedScaleFactors.Draw('e2')
-
-                    # Add legend
-                    plotHeader = algo + ' ' + ''.join([ x for x in wp if x.isupper() ])
-                    leg1 = ROOT.TLegend(0.48,0.64,0.70,0.89)
-                    leg1.SetBorderSize(0)
-                    leg1.SetFillColor(ROOT.kWhite)
-                    leg1.SetTextFont(62)
-                    leg1.SetHeader(plotHeader) 
-                    leg1.SetNColumns(int((len(graphScaleFactors))/3)+1)
-
-                    for method in graphScaleFactors:
-                        leg1.AddEntry(graphScaleFactors[method], measurements[method]['legname'], 'PL')
-                    leg1.AddEntry(graphCombinedScaleFactors,'weighted average','PF')
-
-                    leg1.SetY1(0.89 - 0.25*leg1.GetNRows()/4)
-                    if leg1.GetNColumns()>1: leg1.SetX2(0.92)
-                    if leg1.GetNColumns()>2: 
-                        leg1.SetX1(0.36) 
-                        leg1.SetX2(0.95) 
-                    leg1.Draw()
-       
-                    # Superimpose the single measurements on the combination and legend   
-                    for method in graphScaleFactors: graphScaleFactors[method].Draw('P')
-                    for method in graphScaleFactorsTotal: graphScaleFactorsTotal[method].Draw('P')
-
-                    # Now plotting the combination in the bottom pad
-                    if not opt.plotfitoff:
-
-                        pad2.cd()
-                        histo.Draw('')
-                        graphCombinedScaleFactors.Draw('e2')
-       
-                        # Add the functions values to the bottom pad
-                        graphFittedScaleFactors = ROOT.TGraphErrors()
-
-                        for iptbin, ptbin in enumerate(measuredScaleFactors):
-
-                            minPt, maxPt = float(ptbin.split('-')[1].split('to')[0]), float(ptbin.split('to')[1])
-                            midPt = (maxPt+minPt)/2.
-
-                            fittedScaleFactor = fittingFunction.Integral(midPt-1.,midPt+1.)/2.
-                            fittedScaleFactorError = combinedScaleFactorUncertaintyVector[iptbin][0]*fittedScaleFactor/combinedScaleFactorVector[iptbin][0]
- 
-                            graphFittedScaleFactors.SetPoint(iptbin, midPt, fittedScaleFactor)
-                            graphFittedScaleFactors.SetPointError(iptbin, (maxPt-minPt)/2., fittedScaleFactorError)
-
-                        graphFittedScaleFactors.SetMarkerColor(ROOT.kRed)
-                        graphFittedScaleFactors.SetLineColor(ROOT.kRed)
-                        graphFittedScaleFactors.SetLineStyle(1)
-                        graphFittedScaleFactors.SetMarkerStyle(24)
-                        graphFittedScaleFactors.SetMarkerSize(0.001)
-                        graphFittedScaleFactors.SetLineWidth(2)
-                        graphFittedScaleFactors.Draw('P') 
-                        fittingFunction.SetMarkerColor(1)
-                        fittingFunction.Draw('same') 
-        
-                        # Add legend
-                        leg2 = ROOT.TLegend(0.48,0.64,0.70,0.89)
-                        leg2.SetBorderSize(0)
-                        leg2.SetFillColor(ROOT.kWhite)
-                        leg2.SetTextFont(62)
-                        leg2.SetTextSize(0.05)   
-                        leg2.SetHeader(plotHeader)
-                        leg2.AddEntry(graphCombinedScaleFactors,'weighted average','PF')
-                        leg2.AddEntry(fittingFunction,'fit','L')
-                        leg2.AddEntry(graphFittedScaleFactors,'fit #pm (stat #oplus syst)','LE')
-                        leg2.Draw()
-       
-                        # Run2015B Style
-                        tex2 = ROOT.TLatex(0.2,0.88,'CMS') 
-                        tex2.SetNDC() 
-                        tex2.SetTextAlign(13)
-                        tex2.SetTextFont(61)
-                        tex2.SetTextSize(0.07475)
-                        tex2.SetLineWidth(2) 
-                        tex2.Draw()                                                                                       
-                        tex3 = ROOT.TLatex(0.2,0.79,'Preliminary') 
-                        tex3.SetNDC()
-                        tex3.SetTextAlign(13)
-                        tex3.SetTextFont(52)
-                        tex3.SetTextSize(0.05681)
-                        tex3.SetLineWidth(2)   
-                        tex3.Draw()      
-       
-                        text2 = ROOT.TLatex(0.98,0.95125, campaignLuminosity + centerOfMassEnergy) 
-                        text2.SetNDC()                                              
-                        text2.SetTextAlign(31)                          
-                        text2.SetTextFont(42)    
-                        text2.SetTextSize(0.04875)   
-                        text2.SetLineWidth(2)    
-                        text2.Draw()  
-                        # End Run2015B Style 
-
-                    # Save plots
-                    plotMeasurements = [ 'NoPtFit' ] if opt.plotfitoff else []
-                    for method in graphScaleFactors: plotMeasurements.append(('masked' if method in maskedMethods else '')+measurements[method]['plotname'])
-
-                    plotDirectory = '/'.join([ opt.plotdir, opt.campaign, '_'.join(plotMeasurements), '' ])
-                    os.system('mkdir -p '+plotDirectory+'; cp '+opt.plotdir+'/index.php '+plotDirectory+'/../; cp '+opt.plotdir+'/index.php '+plotDirectory)
-
-                    plotTitleList = [ 'SFb', opt.campaign, plotHeader.replace(' ',''), '_'.join(plotMeasurements) ]
-
-                    for fileExtension in [ '.png', '.pdf', '.root' ]: #, '.C' ]:
-                        c1.Print(plotDirectory+'_'.join(plotTitleList)+fileExtension)
-
-                    del c1
-
-        # Store the results of the scale factor combinations for this algorithm
         if opt.store:
-            with open(opt.csvfiledir+'/'+'_'.join(csvFileNameList)+'.csv', 'w') as f:
-                if opt.standalone: f.write(csvFile.makeNewCSV())
-                else: f.write(csvFile.makeCSV())
+            print('Error: csv files can\'t be stored in mask sweep mode')
+            exit()
+
+        opt.plotoff, opt.forceptfit = True, False
+
+    if opt.jointcampaigns!='':
+
+        if opt.store or opt.sweepmasks!='' or opt.incremental or opt.toys>0:
+            print('Error: the joint combination can\'t be run with --store, --sweepmasks, --incremental, or --toys')
+            exit()
+
+        opt.plotoff, opt.forceptfit = True, False
+
+    if opt.plotoff: opt.plotfitoff = True
+    opt.doptfit = not opt.plotfitoff or opt.storebyfunction or opt.forceptfit
+    if (opt.doptfit and opt.rootfit) or not opt.plotoff: importROOT()
+    
+    # Read campaign info
+    try:
+        campaign = campaignConfig.loadCampaign(opt.campaign, opt, ROOT)
+    except campaignConfig.CampaignError as error:
+        print('Error:', error)
+        exit()
+
+    activateCampaign(campaign)
+
+    # Campaigns of the joint combination, with the methods vetoed and masked by the options in each of them
+    jointCampaigns = []
+
+    if opt.jointcampaigns!='':
+
+        jointCampaigns.append(campaign)
+        for eraCampaignName in opt.jointcampaigns.split(','):
+
+            if eraCampaignName in [ eraCampaign.name for eraCampaign in jointCampaigns ]:
+                print('Error: campaign', eraCampaignName, 'given twice for the joint combination')
+                exit()
+
+            try:
+                jointCampaigns.append(campaignConfig.loadCampaign(eraCampaignName, opt, ROOT))
+            except campaignConfig.CampaignError as error:
+                print('Error:', error)
+                exit()
+
+        for eraCampaign in jointCampaigns[1:]:
+            activateCampaign(eraCampaign)
+            applyMethodOptions()
+        activateCampaign(campaign)
+
+    profiler.lap('setup')
+
+    # Get list of combinations, algorithms, working points, and measurement methods
+    if opt.algorithm!='all':
+       for algo in list(algorithms.keys()):
+           if algo.lower() not in opt.algorithm.lower(): del algorithms[algo]
+
+    if opt.combination!='all':
+       for comb in copy.deepcopy(combinations):
+           if comb.lower() not in opt.combination.lower(): combinations.remove(comb)
+
+    if opt.workingpoint!='all':
+       for wp in list(workingPoints.keys()):
+           keepWP = False
+           for wp2keep in opt.workingpoint.split(','):
+               if wp.lower()==wp2keep.lower(): keepWP = True
+           if not keepWP: del workingPoints[wp]
+
+    applyMethodOptions()
+
+    if opt.doptfit:
+        try:
+            campaign.validateFittingFunctions(combinations, algorithms, workingPoints)
+        except campaignConfig.CampaignError as error:
+            print('Error:', error)
+            exit()
+
+    # Loop on algorithms, combinations, and working points: the combinations run in a pool of worker
+    # processes, and their results are collected here in the same order as in a serial run
+    combinationTasks = [ (algo, comb, wp) for algo in algorithms for comb in combinations for wp in workingPoints ]
+
+    # In incremental mode, the combinations whose inputs didn't change since the last run are taken from the manifest
+    storedResults, combinationHashes = {}, {}
+
+    if opt.incremental:
 
+        manifest = combinationManifest.CombinationManifest(os.path.join(opt.manifestdir, opt.campaign))
+
+        for task in combinationTasks:
+            measurementFiles, inputs = combinationInputs(*task)
+            if inputs is None: continue
+            combinationHashes[task] = (combinationManifest.hashInputs(inputs), measurementFiles)
+            results = manifest.load(task, combinationHashes[task][0])
+            if results is not None: storedResults[task] = results
+
+        print('Incremental run:', len(combinationTasks)-len(storedResults), 'of', len(combinationTasks), 'combinations to be recomputed')
+
+    tasksToRun = [ task for task in combinationTasks if task not in storedResults ]
+
+    # The results of the combinations are added to the results database as they are collected, and committed at the end of the run
+    if not opt.resultsoff:
+
+        try:
+            store = resultsStore.ResultsStore(opt.resultsdb)
+        except resultsStore.ResultsStoreError as error:
+            print('Error:', error)
+            exit()
+
+        storeRun = store.beginRun(opt.campaign, [ eraCampaign.name for eraCampaign in jointCampaigns ], combinationCodeHash(), dict(sorted(vars(opt).items())))
+
+    if opt.jobs>1:
+        if ROOT is not None: ROOT.gROOT.SetBatch(True)
+        combinationPool = multiprocessing.get_context('fork').Pool(opt.jobs)
+        combinationResults = combinationPool.imap(runCombination, tasksToRun)
+    else:
+        combinationPool = None
+        combinationResults = map(runCombination, tasksToRun)
+
+    plotSpecs, csvFile = [], None
+
+    # The open csv writer is discarded and the results database closed however the combinations stop
+    try:
+
+        for algo in algorithms:
+
+            if opt.store:
+            
+                wpFlag = '' if opt.workingpoint=='all' else '-'.join([ ''.join([ x for x in y if x.isupper() ]) for y in workingPoints ])
+                csvFileNameList = [ algo+wpFlag ]
+                if opt.combination!='all': csvFileNameList.append('-'.join([ x for x in combinations ]))
+                if opt.publish=='':
+                    if len(maskedMethods)>0 or len(vetoedMethods)>0: 
+                        csvFileNameList.append('masked'+'-'.join([ measurements[x]['plotname'] for x in sorted(set(vetoedMethods+maskedMethods)) ]))
+                else:
+                    csvFileNameList.append(csvFileNameFlag)
+
+                if opt.storebybins: csvFileNameList.append('Binned')
+                if opt.breaksyst: csvFileNameList.append('CategoryBreakdown')
+                if opt.yearcorr: csvFileNameList.append('YearCorrelation')
+
+                if opt.publish!='':
+                    if opt.publish=='new':
+                        measurementFileList = glob.glob(opt.csvfiledir+'/'+'_'.join(csvFileNameList)+'_v*.csv')
+                        lastVersion = -1 if len(measurementFileList)==0 else max([ int(x.split('_')[-1].replace('.csv','').replace('v','')) for x in measurementFileList ])
+                        csvFileNameList.append('v'+str(lastVersion+1))
+                    else:
+                        csvFileNameList.append(opt.publish)
+
+                csvFileName = opt.csvfiledir+'/'+'_'.join(csvFileNameList)+'.csv'
+                csvFile = btagCalibrationWriter.BTagCalibrationWriter(csvFileName, csvFileName, opt.standalone, opt.keepspool)
+
+            for comb in combinations:
+                for wp in workingPoints:
+
+                    task = (algo, comb, wp)
+
+                    if task in storedResults:
+                        output, csvEntries, plotSpec, combinationRecords = storedResults[task]
+                        exitRequested = False
+                        if plotSpec is not None and plotRenderer.plotFilesExist(plotSpec): plotSpec = None
+                    else:
+                        output, csvEntries, plotSpec, combinationRecords, taskStages, exitRequested = next(combinationResults)
+                        profiler.addTask(task, taskStages)
+                        if opt.incremental and not exitRequested and task in combinationHashes:
+                            inputHash, measurementFiles = combinationHashes[task]
+                            manifest.store(task, inputHash, (output, csvEntries, plotSpec, combinationRecords), measurementFiles)
+
+                    sys.stdout.write(output)
+                    if exitRequested:
+                        if combinationPool is not None: combinationPool.terminate()
+                        if opt.incremental: manifest.write()
+                        exit()
+
+                    if plotSpec is not None: plotSpecs.append(plotSpec)
+
+                    if not opt.resultsoff:
+                        profiler.begin()
+                        storeCombinationRecords(store, storeRun, task, combinationRecords, combinationHashes)
+                        profiler.lap('results')
+
+                    if opt.store:
+                        profiler.begin()
+                        csvFile.addEntries(csvEntries)
+                        profiler.lap('csv')
+
+            # Store the results of the scale factor combinations for this algorithm
+            if opt.store:
+                profiler.begin()
+                csvFile.close()
+                csvFile = None
+                profiler.lap('csv')
+
+        if opt.incremental: manifest.write()
+
+        if not opt.resultsoff: store.commit()
+
+    finally:
+        if csvFile is not None: csvFile.discard()
+        if not opt.resultsoff: store.close()
+
+    # Draw the plots queued by the combinations, in the same pool of worker processes. The plots of the
+    # combinations taken from the manifest are only drawn again if their files are missing
+    profiler.begin()
+    plotRenderer.renderPlots(plotSpecs, combinationPool)
+    if len(plotSpecs)>0: profiler.lap('plotting')
+
+    if combinationPool is not None:
+        combinationPool.close()
+        combinationPool.join()
+
+    profiler.stop()
+    profiler.printSummary()
+
+if __name__ == '__main__':
+    main()
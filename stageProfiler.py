@@ -0,0 +1,171 @@
+import sys
+import time
+import cProfile
+import tracemalloc
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Maximum resident set size of the process so far, in bytes
+def maxResidentMemory():
+
+    if resource is None: return 0
+    maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxRSS if sys.platform=='darwin' else maxRSS*1024
+
+def emptyRecord():
+    return { 'calls' : 0, 'wallTime' : 0., 'peakMemory' : 0, 'maxRSS' : 0 }
+
+def addToRecord(record, calls, wallTime, peakMemory, maxRSS):
+
+    record['calls'] += calls
+    record['wallTime'] += wallTime
+    record['peakMemory'] = max(record['peakMemory'], peakMemory)
+    record['maxRSS'] = max(record['maxRSS'], maxRSS)
+
+# Wall time, number of calls and memory of the stages of a run. The time is measured in laps: begin() starts the
+# clock, and each lap(stage) adds the time elapsed since the previous mark to the stage, so the code being profiled
+# only needs one call at the end of each stage. If memory is traced, each stage also records the peak of the memory
+# allocated by python during the stage, and the maximum resident memory of the process at its end.
+# The laps between beginTask(task) and endTask(task) are kept apart, and endTask returns them, so that the stages
+# of each (algorithm, combination, working point) can be recorded also when it runs in a worker process
+class StageProfiler:
+
+    def __init__(self, traceMemory=False, profileFileName=''):
+
+        self.stages = OrderedDict()
+        self.tasks = OrderedDict()
+        self.currentTask = None
+        self.traceMemory = traceMemory
+        self.profileFileName = profileFileName
+        self.codeProfile = None
+        self.mark = time.perf_counter()
+
+    def start(self):
+
+        if self.traceMemory and not tracemalloc.is_tracing(): tracemalloc.start()
+        if self.profileFileName!='':
+            self.codeProfile = cProfile.Profile()
+            self.codeProfile.enable()
+        self.begin()
+
+    def stop(self):
+
+        if self.codeProfile is not None:
+            self.codeProfile.disable()
+            self.codeProfile.dump_stats(self.profileFileName)
+            self.codeProfile = None
+        if self.traceMemory and tracemalloc.is_tracing(): tracemalloc.stop()
+
+    def begin(self):
+
+        if self.traceMemory and tracemalloc.is_tracing(): tracemalloc.reset_peak()
+        self.mark = time.perf_counter()
+
+    def lap(self, stage):
+
+        now = time.perf_counter()
+        peakMemory, maxRSS = 0, 0
+
+        if self.traceMemory and tracemalloc.is_tracing():
+            peakMemory = tracemalloc.get_traced_memory()[1]
+            maxRSS = maxResidentMemory()
+            tracemalloc.reset_peak()
+
+        stages = self.stages if self.currentTask is None else self.tasks[self.currentTask]
+        if stage not in stages: stages[stage] = emptyRecord()
+        addToRecord(stages[stage], 1, now - self.mark, peakMemory, maxRSS)
+
+        self.mark = time.perf_counter()
+
+    def beginTask(self, task):
+
+        self.currentTask = task
+        self.tasks[task] = OrderedDict()
+        self.begin()
+
+    def endTask(self, task):
+
+        self.currentTask = None
+        return self.tasks.pop(task, OrderedDict())
+
+    # Add the stages of a task, as returned by endTask in this or in a worker process
+    def addTask(self, task, taskStages):
+
+        if taskStages is None: return
+        self.tasks[task] = taskStages
+        for stage, record in taskStages.items():
+            if stage not in self.stages: self.stages[stage] = emptyRecord()
+            addToRecord(self.stages[stage], record['calls'], record['wallTime'], record['peakMemory'], record['maxRSS'])
+
+    def summary(self):
+        return OrderedDict([ (stage, dict(record)) for stage, record in self.stages.items() ])
+
+    def taskSummary(self):
+        return OrderedDict([ ('/'.join(task), OrderedDict([ (stage, dict(record)) for stage, record in taskStages.items() ])) for task, taskStages in self.tasks.items() ])
+
+    # Print the stages, and the tasks if any, sorted by decreasing wall time
+    def printSummary(self):
+
+        totalTime = sum([ record['wallTime'] for record in self.stages.values() ])
+        megaByte = 1024.*1024.
+
+        print('\nStage profile:\n')
+        print('    %-16s %8s %14s %9s %17s %13s' % ('stage', 'calls', 'wall time [s]', 'fraction', 'peak memory [MB]', 'max RSS [MB]'))
+        for stage, record in sorted(self.stages.items(), key=lambda item: -item[1]['wallTime']):
+            print('    %-16s %8d %14.4f %9.3f %17.2f %13.1f' % (stage, record['calls'], record['wallTime'], record['wallTime']/totalTime if totalTime>0. else 0.,
+                                                              record['peakMemory']/megaByte, record['maxRSS']/megaByte))
+
+        if len(self.tasks)>0:
+            print('\nCombination profile:\n')
+            print('    %-48s %14s %17s   %s' % ('algorithm/combination/working point', 'wall time [s]', 'peak memory [MB]', 'slowest stage'))
+            taskTimes = [ (task, sum([ record['wallTime'] for record in taskStages.values() ]), taskStages) for task, taskStages in self.tasks.items() ]
+            for task, taskTime, taskStages in sorted(taskTimes, key=lambda item: -item[1]):
+                slowestStage = max(taskStages, key=lambda stage: taskStages[stage]['wallTime']) if len(taskStages)>0 else ''
+                peakMemory = max([ record['peakMemory'] for record in taskStages.values() ] or [ 0 ])
+                print('    %-48s %14.4f %17.2f   %s' % ('/'.join(task), taskTime, peakMemory/megaByte, slowestStage))
+
+        print('')
+
+# Profiler used when profiling is off, which does nothing
+class NullProfiler:
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def begin(self):
+        pass
+
+    def lap(self, stage):
+        pass
+
+    def beginTask(self, task):
+        pass
+
+    def endTask(self, task):
+        return None
+
+    def addTask(self, task, taskStages):
+        pass
+
+    def summary(self):
+        return OrderedDict()
+
+    def taskSummary(self):
+        return OrderedDict()
+
+    def printSummary(self):
+        pass
+
+# Profiler for the options of a script: a StageProfiler, tracing the memory, if profiling is requested,
+# and a NullProfiler otherwise
+def makeProfiler(profile, profileFileName=''):
+
+    if not profile and profileFileName=='': return NullProfiler()
+    return StageProfiler(traceMemory=True, profileFileName=profileFileName)